@@ -2,18 +2,36 @@
 """ Defines sequence of actions required to send delivery to client """
 
 
+import copy
 import gnupg
+import hashlib
 import logging
 import os
+import queue
 import stat
+import threading
+import time
+import uuid
 import fs.osfs
 
-from fs.copy import copy_file
-from fs.move import move_file
 from fs.tempfs import TempFS
 from fs.errors import ResourceNotFound
 from collections import namedtuple
+from contextlib import contextmanager
 from oc_cdtapi import NexusAPI
+from .gpg_stream import pipe_through_process
+from .ftp_transfer import upload_file, upload_stream, commit_upload, get_temp_name, remove_quietly, is_uploaded, \
+    mark_uploaded
+from .gpg_keyrings import default_keyrings, get_keys_digest
+from .crypto_executor import default_executor
+from .compression_policy import default_policy
+from .ftp_session import default_sessions
+from .scratch import default_scratch
+from .ftp_listing import CachedListingFS
+from .mvn_transfer import upload_artifact, stream_artifact, remove_artifact, get_headers_md5
+from .mvn_download import download_artifact, get_artifact_size
+from .integrity import Digests, TeeReader
+from .resource_pool import create_external_nexus
 from .upload_errors import DeliveryUploadError, ClientSetupError, EnvironmentSetupError, DeliveryExistsError, \
     DeliveryEncryptionError, UploadProcessException
 import posixpath
@@ -35,21 +53,464 @@ class ClientDeliverySender():
         self.nexus_fs = context.nexus_fs
         self.ftp_fs = context.base_ftp_fs
         self.kwargs = kwargs
+        # the same for copies working with other connections
+        self.staging_consumer = uuid.uuid4().hex
+
+    def with_context(self, context):
+        """
+        Makes the same sender working with other connections, e.g. for sending from another thread
+        :param tuple context: ConnectionsContext with connections not used by this sender
+        :return ClientDeliverySender: sender copy
+        """
+        sender = copy.copy(self)
+        sender.nexus_fs = context.nexus_fs
+        sender.ftp_fs = context.base_ftp_fs
+
+        # FTP listings are shared by all connections of the run
+        if isinstance(self.ftp_fs, CachedListingFS) and sender.ftp_fs is not None \
+                and not isinstance(sender.ftp_fs, CachedListingFS):
+            sender.ftp_fs = self.ftp_fs.with_fs(sender.ftp_fs)
+
+        return sender
+
+    def get_connections_limit(self):
+        """
+        :return int: number of deliveries which may be sent to destination simultaneously
+        """
+        return int(self.kwargs.get('ftp_max_connections') or 1)
+
+    def required_connections(self):
+        """
+        :return tuple: kinds of pooled connections sender copy made by 'with_context' works with
+        """
+        return ("mvn", "ftp")
 
     def send_delivery(self, delivery):
         """ 
         Loads clean delivery, preprocesses it and sends it to client
         :param delivery: Delivery model instance to send 
         """
-        self._validate_outgoing_delivery(delivery)
-        target_dir = self._get_destination_dir()
-        logging.info(f"Target directory for [{delivery.gav}]: [{target_dir}]")
+        item = _PipelineItem(0, delivery, release=self._release_staged)
+
+        try:
+            self._fetch_stage(item)
+            self._process_stage(item)
+            self._upload_stage(item)
+        finally:
+            item.close()
+
+    def is_pipelined(self):
+        """
+        :return bool: whether several deliveries should be sent with 'send_deliveries'
+        """
+        return str(self.kwargs.get('delivery_pipeline') or '').lower() in ['y', 'yes', 'true']
+
+    def send_deliveries(self, deliveries):
+        """
+        Sends deliveries by three stages running simultaneously: while one delivery is uploaded,
+        the next one is processed and the one after it is downloaded.
+        Stages are connected by queues holding a single delivery, so local disk usage stays bounded.
+        Stage durations are kept in 'stage_timings' and logged at the end.
+        :param list deliveries: Delivery model instances to send
+        :return list: DeliveryUploadError raised for each delivery, None if delivery was sent
+        :raises: any error other than DeliveryUploadError, after all stages are stopped
+        """
+        deliveries = list(deliveries)
+        self.stage_timings = {"fetch": 0.0, "process": 0.0, "upload": 0.0}
+        errors = [None] * len(deliveries)
+        fatal_errors = list()
+        stop = threading.Event()
+        fetched = queue.Queue(maxsize=1)
+        processed = queue.Queue(maxsize=1)
+
+        def _fetch():
+            for index, delivery in enumerate(deliveries):
+                item = _PipelineItem(index, delivery, release=self._release_staged)
+                self.__run_stage("fetch", self._fetch_stage, item)
+
+                if not _put_until_stopped(fetched, item, stop):
+                    item.close()
+                    return
+
+            _put_until_stopped(fetched, None, stop)
+
+        def _process():
+            while True:
+                item = _get_until_stopped(fetched, stop)
+
+                if item is not None:
+                    self.__run_stage("process", self._process_stage, item)
+
+                if not _put_until_stopped(processed, item, stop):
+                    if item is not None:
+                        item.close()
+
+                    return
+
+                if item is None:
+                    return
+
+        def _guarded(stage):
+            try:
+                stage()
+            except Exception as _e:
+                fatal_errors.append(_e)
+                stop.set()
+
+        stages = [threading.Thread(target=_guarded, args=(_stage,), name=f"dl{_stage.__name__.strip('_')}", daemon=True)
+                  for _stage in (_fetch, _process)]
+        [_stage.start() for _stage in stages]
+
+        try:
+            while True:
+                item = _get_until_stopped(processed, stop)
+
+                if item is None or stop.is_set():
+                    # the rest is cleaned up below
+                    if item is not None:
+                        item.close()
+
+                    break
+
+                try:
+                    self.__run_stage("upload", self._upload_stage, item)
+                finally:
+                    item.close()
+
+                if item.error is None:
+                    logging.info(f"Successfully sent: [{item.delivery.gav}]")
+                else:
+                    # ignore this single delivery and don't change its flags
+                    logging.error(f"Error uploading [{item.delivery.gav}]: {str(item.error)}")
+
+                errors[item.index] = item.error
+        except Exception as _e:
+            fatal_errors.append(_e)
+        finally:
+            stop.set()
+            [_stage.join() for _stage in stages]
+
+            # deliveries taken by stopped stages
+            for _queue in (fetched, processed):
+                while not _queue.empty():
+                    item = _queue.get_nowait()
+
+                    if item is not None:
+                        item.close()
+
+        logging.info(f"Stage timings for [{self.client.code}], seconds: " +
+                     ", ".join(f"{_k} [{_v:.3f}]" for _k, _v in self.stage_timings.items()))
+
+        if fatal_errors:
+            raise fatal_errors[0]
+
+        return errors
+
+    def __run_stage(self, name, stage, item):
+        """
+        Runs pipeline stage for delivery not failed at previous stages, stores delivery error to item
+        """
+        if item.error is not None:
+            return
+
+        started = time.monotonic()
+
+        try:
+            stage(item)
+        except DeliveryUploadError as _e:
+            item.error = _e
+        finally:
+            # each stage is updated by its own thread only
+            self.stage_timings[name] += time.monotonic() - started
+
+    def _fetch_stage(self, item):
+        """
+        Validates delivery and downloads its clean content, streams it if streaming is enabled
+        :param _PipelineItem item: delivery being sent
+        """
+        self._validate_outgoing_delivery(item.delivery)
+        item.target_dir = self._get_destination_dir()
+        logging.info(f"Target directory for [{item.delivery.gav}]: [{item.target_dir}]")
+        item.source_key = self._get_source_key(item.delivery)
+
+        if item.source_key and self._is_uploaded(item.delivery, item.target_dir, item.source_key):
+            logging.info(f"[{item.delivery.gav}] made the same way is in [{item.target_dir}] already, skipping")
+            item.skipped = True
+            return
+
+        if self._stream_delivery(item.delivery, item.target_dir):
+            item.streamed = True
+            return
+
+        item.work_fs = self._open_scratch(item.delivery)
+
+        with self._get_ftp_sessions().keepalive(self.ftp_fs):
+            item.file_name = self._get_clean_delivery_content(item.delivery, item.work_fs)
+
+    def _process_stage(self, item):
+        """
+        Processes downloaded content, FTP connection is kept alive meanwhile
+        :param _PipelineItem item: delivery being sent
+        """
+        if item.streamed or item.skipped:
+            return
+
+        with self._get_ftp_sessions().keepalive(self.ftp_fs):
+            item.file_name = self._process_delivery_content(item.delivery, item.file_name, item.work_fs)
+
+    def _upload_stage(self, item):
+        """
+        :param _PipelineItem item: delivery being sent
+        """
+        if not item.streamed and not item.skipped:
+            self._upload_delivery(item.delivery, item.file_name, item.work_fs, item.target_dir)
+
+        if item.source_key and not item.skipped:
+            self._mark_uploaded(item.delivery, item.target_dir, item.source_key)
+
+        item.delivery.set_uploaded()
+
+    def _get_source_key(self, delivery):
+        """
+        Identifies delivery uploaded by what it is made of: registered MD5 of clean content and processing settings.
+        Processed content differs on each run, e.g. encrypted one, so it can not be compared itself.
+        Used if enabled by 'ftp_skip_identical'.
+        :param dlmanager.Delivery delivery: delivery to send
+        :return str: key to compare with one stored at upload, None if delivery is to be uploaded anyway
+        """
+        if str(self.kwargs.get('ftp_skip_identical') or '').lower() not in ['y', 'yes', 'true']:
+            return None
+
+        settings = self._get_processing_settings()
+
+        if not settings:
+            return None
+
+        md5 = self._get_registered_md5(delivery)
+
+        if not md5:
+            return None
+
+        return hashlib.sha256(f"{md5.lower()}:{settings}".encode("utf-8")).hexdigest()
+
+    def _get_processing_settings(self):
+        """
+        Hook for senders uploading to FTP: settings processed content depends on, e.g. keys used
+        :return str: settings description, None if uploads of the sender are never skipped
+        """
+        return None
+
+    def _get_uploaded_names(self, delivery):
+        """
+        :param dlmanager.Delivery delivery: delivery to send
+        :return list: names of files uploaded for delivery to target directory, the last one is uploaded last
+        """
+        return [NexusAPI.gav_to_filename(_delivery_packaged_gav(delivery, "pgp"))]
+
+    def _is_uploaded(self, delivery, target_dir, source_key):
+        """
+        :param dlmanager.Delivery delivery: delivery to send
+        :param str target_dir: path at FTP to place delivery
+        :param str source_key: key of delivery source and processing
+        :return bool: whether delivery made the same way is uploaded already
+        """
+        return is_uploaded(self._open_target_dir(target_dir), self._get_uploaded_names(delivery), source_key)
+
+    def _mark_uploaded(self, delivery, target_dir, source_key):
+        """
+        Stores key of uploaded delivery next to it, failure is logged only: delivery is sent already
+        :param dlmanager.Delivery delivery: delivery sent
+        :param str target_dir: path at FTP delivery is uploaded to
+        :param str source_key: key of delivery source and processing
+        """
+        try:
+            mark_uploaded(self._open_target_dir(target_dir), self._get_uploaded_names(delivery)[0], source_key)
+        except Exception as _e:
+            logging.warning(f"Unable to mark [{delivery.gav}] uploaded to [{target_dir}]: [{str(_e)}]")
+
+    def _stream_delivery(self, delivery, target_dir):
+        """
+        Passes delivery from MVN through gpg to FTP without temporary files if streaming is enabled.
+        Falls back to regular processing on any failure except ones regular processing would fail with too.
+        :param dlmanager.Delivery delivery: delivery to send
+        :param str target_dir: path at FTP to place delivery
+        :return bool: whether delivery was sent
+        """
+        if str(self.kwargs.get('delivery_streaming') or '').lower() not in ['y', 'yes', 'true']:
+            return False
+
+        staging = self.kwargs.get('delivery_staging')
+        keyring_lease = self._open_keyring()
+
+        if keyring_lease is None:
+            return False
+
+        with keyring_lease as keyring:
+            command = self._get_streaming_command(delivery, keyring)
+
+            if not command:
+                return False
+
+            if staging and not staging.claim(delivery, self.staging_consumer):
+                logging.debug(f"[{delivery.gav}] is staged for other destinations, streaming skipped")
+                return False
+
+            command, prefix = command
+            target_fs = self._open_target_dir(target_dir)
+            basename = self._get_uploaded_names(delivery)[0]
+            # existing file is overwritten only when the new one is complete
+            temp_name = get_temp_name(basename)
+            source = TeeReader(self._open_clean_stream(delivery))
+            processed = Digests()
+
+            try:
+                logging.info(f"Streaming [{delivery.gav}] to [{posixpath.join(target_dir, basename)}]")
+                pipe_through_process(command, source,
+                                     lambda output: upload_stream(target_fs, temp_name, TeeReader(output, processed)),
+                                     prefix=prefix)
+                _check_registered_md5(delivery, self._get_registered_md5(delivery), source.digests.hexdigests())
+                commit_upload(target_fs, temp_name, basename)
+                self._get_ftp_sessions().used(self.ftp_fs)
+                self._register_processed_delivery(delivery, posixpath.join(target_dir, basename), processed)
+                return True
+            except Exception as _e:
+                logging.warning(f"Streaming [{delivery.gav}] failed, falling back to regular upload: [{str(_e)}]")
+                remove_quietly(target_fs, temp_name)
+                return False
+            finally:
+                source.close()
+
+    def _open_clean_stream(self, delivery):
+        """
+        Opens clean delivery content at MVN for sequential reading without local copy
+        :param dlmanager.Delivery delivery: delivery to read
+        :return: binary file-like object, should be closed by caller
+        """
+        gav_as_filename = _delivery_packaged_gav(delivery, "zip")
+
+        try:
+            _open_stream = getattr(self.nexus_fs, "open_stream", self.nexus_fs.openbin)
+            return _open_stream(gav_as_filename)
+        except ResourceNotFound as _e:
+            raise DeliveryUploadError(f"Not found at MVN: [{gav_as_filename}]") from _e
+
+    def _open_keyring(self):
+        """
+        Hook for senders using GPG: leases keyring with keys required for processing
+        :return: context manager giving gpg_keyrings.Keyring, None if sender does not use GPG
+        """
+        return None
+
+    def _get_keyrings(self):
+        """
+        :return GpgKeyrings: keyrings passed in arguments, process-wide ones by default
+        """
+        return self.kwargs.get('gpg_keyrings') or default_keyrings
+
+    def _get_crypto_executor(self):
+        """
+        :return CryptoExecutor: executor passed in arguments, process-wide one by default
+        """
+        return self.kwargs.get('crypto_executor') or default_executor
+
+    def _get_compression_policy(self):
+        """
+        :return CompressionPolicy: policy passed in arguments, process-wide one by default
+        """
+        return self.kwargs.get('compression_policy') or default_policy
+
+    def _get_ftp_sessions(self):
+        """
+        :return FtpSessions: sessions passed in arguments, process-wide ones by default
+        """
+        return self.kwargs.get('ftp_sessions') or default_sessions
+
+    def _get_scratch(self):
+        """
+        :return ScratchSpace: scratch space passed in arguments, process-wide one by default
+        """
+        return self.kwargs.get('scratch') or default_scratch
+
+    def _open_scratch(self, delivery):
+        """
+        Opens work directory for delivery with space reserved for its clean and processed content
+        :param dlmanager.Delivery delivery: delivery to be downloaded
+        :return ScratchFS: work directory, should be closed by caller
+        :raises ScratchSpaceError: if local disk has not enough free space for delivery
+        """
+        size = self._get_delivery_size(delivery)
+        return self._get_scratch().open(size=self._get_scratch_size(size) if size else None)
+
+    def _get_delivery_size(self, delivery):
+        """
+        :param dlmanager.Delivery delivery: delivery to check
+        :return int: size of clean delivery at MVN, None if it is unknown
+        """
+        nexus_client = getattr(self.nexus_fs, "nexus_client", None)
+
+        if not nexus_client:
+            return None
+
+        gav_as_filename = _delivery_packaged_gav(delivery, "zip")
+
+        try:
+            return get_artifact_size(nexus_client, gav_as_filename)
+        except Exception as _e:
+            # missing delivery is reported by download
+            logging.debug(f"Unable to get size of [{gav_as_filename}]: [{str(_e)}]")
+            return None
+
+    def _get_scratch_size(self, size):
+        """
+        :param int size: size of clean delivery
+        :return int: local space needed to process delivery: clean content and ASCII-armored output
+        """
+        return size + size * 3 // 2
+
+    def _choose_compression(self, clean_path=None):
+        """
+        Chooses gpg compression by destination setting, worker setting or delivery content
+        :param str clean_path: local path to clean delivery content, if downloaded
+        :return CompressionChoice: compression to use
+        """
+        setting = (self.kwargs.get('dest') or dict()).get('compression', self.kwargs.get('gpg_compression'))
+        # clean deliveries are always zip archives, see '_delivery_packaged_gav' usage
+        return self._get_compression_policy().choose("zip", path=clean_path, setting=setting)
+
+    def _record_compression(self, delivery, compression, work_fs, clean_file_name, processed_file_name, cpu_seconds):
+        """
+        Passes result of processing with compression chosen to the policy
+        """
+        self._get_compression_policy().record(delivery.gav, compression, work_fs.getsize(clean_file_name),
+                                              work_fs.getsize(processed_file_name), cpu_seconds)
+
+    def _get_streaming_command(self, delivery, keyring):
+        """
+        Hook for streaming processing: gpg command reading clean delivery from stdin and writing result to stdout
+        :param dlmanager.Delivery delivery: delivery to process
+        :param Keyring keyring: leased keyring with keys required
+        :return tuple: command as list and bytes to write to stdin before content, None if streaming is not supported
+        """
+        return None
+
+    def _open_target_dir(self, target_dir):
+        """
+        Makes sure FTP connection is alive and opens target directory
+        :param str target_dir: path at FTP to place delivery
+        :return: FS object pointing to target directory
+        """
+        try:
+            self._get_ftp_sessions().ensure(self.ftp_fs)
+            _target_fs = self.ftp_fs.opendir(target_dir)
+            self._get_ftp_sessions().used(self.ftp_fs)
+            return _target_fs
+        except fs.errors.PermissionDenied as _pd:
+            raise UploadProcessException(f"Permission denied when opening FTP: [{target_dir}]") from _pd
+        except ResourceNotFound as _e:
+            if self.kwargs.get('keys_cache'):
+                self.kwargs['keys_cache'].forget_ftp(target_dir)
 
-        with TempFS() as temp_fs:
-            clean_file_name = self._get_clean_delivery_content(delivery, temp_fs)
-            processed_file_name = self._process_delivery_content(delivery, clean_file_name, temp_fs)
-            self._upload_delivery(delivery, processed_file_name, temp_fs, target_dir)
-        delivery.set_uploaded()
+            raise ClientSetupError(f"Not found on FTP: [{target_dir}]") from _e
 
     def _process_delivery_content(self, delivery, clean_data_handle):
         """ 
@@ -82,20 +543,91 @@ class ClientDeliverySender():
 
     def _get_clean_delivery_content(self, delivery, work_fs):
         """ 
-        Retrieves clean delivery content.
+        Retrieves clean delivery content. Content staged for several senders is reused if staging is given.
         :param dlmanager.Delivery delivery: delivery to load
         :param fs.BaseFS work_fs: FS object to place loaded content
         :return str: path to file relative to work_fs root
         """
+        clean_file_name = "clean_file"
+        staging = self.kwargs.get('delivery_staging')
+
+        if staging:
+            staging.fetch(delivery, work_fs, clean_file_name, self._download_clean_delivery, self.staging_consumer,
+                          measure=self._get_delivery_size)
+        else:
+            self._download_clean_delivery(delivery, work_fs, clean_file_name)
+
+        return clean_file_name
+
+    def _release_staged(self, delivery):
+        """
+        Tells staging this sender is done with delivery, so content is not kept for it if it was not fetched
+        :param dlmanager.Delivery delivery: delivery sent or failed
+        """
+        staging = self.kwargs.get('delivery_staging')
+
+        if staging:
+            staging.release(delivery, self.staging_consumer)
+
+    def _download_clean_delivery(self, delivery, work_fs, clean_file_name):
+        """
+        Downloads clean delivery content from MVN, or takes it from local artifact cache if one is given.
+        Content is hashed while it is written and checked against MD5 registered for delivery.
+        :param dlmanager.Delivery delivery: delivery to load
+        :param fs.BaseFS work_fs: FS object to place loaded content
+        :param str clean_file_name: path to file relative to work_fs root
+        """
         gav_as_filename = _delivery_packaged_gav(delivery, "zip")
+        artifact_cache = self.kwargs.get('artifact_cache')
+        md5 = self._get_registered_md5(delivery)
+        digests = dict()
+
+        def _download(download_fs, file_name):
+            digests.update(self._download_artifact(gav_as_filename, download_fs, file_name, md5))
+            return digests
 
         try:
-            clean_file_name = "clean_file"
-            copy_file(self.nexus_fs, gav_as_filename, work_fs, clean_file_name)
+            if artifact_cache:
+                # cached content is addressed by registered MD5, so it is checked already if taken from cache
+                artifact_cache.fetch(gav_as_filename, work_fs, clean_file_name, _download, md5=md5)
+            else:
+                _download(work_fs, clean_file_name)
         except ResourceNotFound as _e:
             raise DeliveryUploadError(f"Not found at MVN: [{gav_as_filename}]") from _e
 
-        return clean_file_name
+        if digests:
+            _check_registered_md5(delivery, md5, digests)
+
+    def _get_registered_md5(self, delivery):
+        """
+        :param dlmanager.Delivery delivery: delivery to check
+        :return str: MD5 of clean delivery registered in checksums database, None if not registered
+        """
+        from .upload_steps import get_registered_md5
+        return get_registered_md5(delivery.gav)
+
+    def _download_artifact(self, gav, work_fs, file_name, md5=None):
+        """
+        Downloads artifact from MVN. Large artifacts are downloaded by parts over several connections
+        if repository client is available and target is a local file.
+        :param str gav: artifact GAV
+        :param fs.BaseFS work_fs: FS object to place loaded content
+        :param str file_name: path to file relative to work_fs root
+        :param str md5: checksum registered for artifact, if known
+        :return dict: hex digests of content by algorithm name: 'md5', 'sha1' and 'sha256'
+        """
+        nexus_client = getattr(self.nexus_fs, "nexus_client", None)
+
+        if not nexus_client or not work_fs.hassyspath(file_name):
+            with self.nexus_fs.openbin(gav) as source:
+                reader = TeeReader(source)
+                work_fs.upload(file_name, reader)
+
+            return reader.digests.hexdigests()
+
+        return download_artifact(nexus_client, gav, work_fs.getsyspath(file_name), md5=md5,
+                                 connections=int(self.kwargs.get('mvn_download_connections') or 1),
+                                 part_size=int(float(self.kwargs.get('mvn_download_part_size') or 16) * 1024 * 1024))
 
     def _upload_delivery(self, delivery, processed_file_name, work_fs, target_dir):
         """ 
@@ -105,27 +637,53 @@ class ClientDeliverySender():
         :param fs.BaseFS work_fs: FS object containing processed delivery
         :param str target_dir: path at FTP to place delivery
         """
-        try:
-            self._reconnect_ftp()
-            target_fs = self.ftp_fs.opendir(target_dir)
-            basename = NexusAPI.gav_to_filename(_delivery_packaged_gav(delivery, "pgp"))
+        target_fs = self._open_target_dir(target_dir)
+        basename = self._get_uploaded_names(delivery)[0]
+        digests = Digests()
+        self._upload_file(work_fs, processed_file_name, target_fs, basename, target_dir, digests=digests)
+        self._register_processed_delivery(delivery, posixpath.join(target_dir, basename), digests)
 
-            # if file exists - we have to overwrite it
-            if target_fs.exists(basename):
-                target_fs.remove(basename)
+    def _register_processed_delivery(self, delivery, path, digests):
+        """
+        Registers checksums of processed delivery at its FTP location, so later runs may verify it without reading.
+        Registration is enabled by 'processed_location_type', its failure is logged only: delivery is sent already.
+        :param dlmanager.Delivery delivery: delivery sent
+        :param str path: path at FTP delivery is uploaded to
+        :param Digests digests: checksums of uploaded content
+        """
+        loc_type = self.kwargs.get('processed_location_type')
+
+        if not loc_type:
+            return
+
+        try:
+            from .upload_steps import register_processed_location
+            register_processed_location(path, loc_type, digests.hexdigests(), delivery.gav)
+        except Exception as _e:
+            logging.warning(f"Unable to register [{path}] checksums for [{delivery.gav}]: [{str(_e)}]")
 
-            move_file(work_fs, processed_file_name, target_fs, basename)
+    def _upload_file(self, work_fs, file_name, target_fs, basename, target_dir, digests=None):
+        """
+        Moves local file to FTP directory, existing file is overwritten.
+        File is uploaded under temporary name and renamed then, so it never appears incomplete.
+        Interrupted transfer is continued 'ftp_upload_retries' times.
+        :param fs.BaseFS work_fs: FS object containing file
+        :param str file_name: path to file relative to work_fs root
+        :param fs.BaseFS target_fs: FS pointing to target directory
+        :param str basename: name of file in target directory
+        :param str target_dir: path at FTP of target directory, for error messages
+        :param Digests digests: checksums to update with content uploaded
+        """
+        try:
+            upload_file(work_fs, file_name, target_fs, basename, digests=digests,
+                        retries=int(self.kwargs.get('ftp_upload_retries') or 0),
+                        backoff=float(self.kwargs.get('ftp_retry_backoff') or 5))
         except fs.errors.PermissionDenied as _pd:
             raise UploadProcessException(f"Permission denied when uploading [{basename}] for FTP: [{target_dir}]") from _pd
         except ResourceNotFound as _e:
             raise ClientSetupError(f"Not found on FTP: [{target_dir}]") from _e
 
-    def _reconnect_ftp(self):
-        """ 
-        Forces FTPFS to recreate connection since delivery processing may run long and ftp timeout can occur
-        """
-        self.ftp_fs._ftp = None
-        self.ftp_fs._get_ftp()
+        self._get_ftp_sessions().used(self.ftp_fs)
 
 
 class EncryptingSender(ClientDeliverySender):
@@ -138,10 +696,16 @@ class EncryptingSender(ClientDeliverySender):
         :param str client: client which receives delivery
         :param tupe context: ConnectionsContext MVN with clean deliveries and FTP for outgoing deliveries
         :param repo_svn_fs: SvnFS pointing to client repo, used for keys reading
+        :param keys_cache: ClientKeysCache to reuse keys from while SVN revision is not changed, optional
         :param **kwargs: data for external resources initialization, see worker arguemnts for description
         """
         super().__init__(client, context, **kwargs)
-        svn_data_fs = self._get_svn_data_subdir(client, self.kwargs.get('repo_svn_fs'))
+        repo_svn_fs = self.kwargs.get('repo_svn_fs')
+
+        if self.kwargs.get('keys_cache'):
+            repo_svn_fs = self.kwargs['keys_cache'].open(repo_svn_fs)
+
+        svn_data_fs = self._get_svn_data_subdir(client, repo_svn_fs)
         self.encryption_keys = self._read_encryption_keys(svn_data_fs)
 
     def _get_svn_data_subdir(self, client, repo_svn_fs):
@@ -175,9 +739,20 @@ class EncryptingSender(ClientDeliverySender):
         _key = read_key(_key_fs, _key_path)
 
         encryption_keys.append(_key)
-        _validate_keys(encryption_keys)
+        self.encryption_keys = encryption_keys
+
+        # keys are validated by import
+        with self._open_keyring():
+            pass
+
         return encryption_keys
 
+    def _open_keyring(self):
+        return self._get_keyrings().open(self.encryption_keys, owner=f"encrypt:{self.client.code}")
+
+    def _get_processing_settings(self):
+        return f"encrypt:{get_keys_digest(self.encryption_keys)}"
+
     def _process_delivery_content(self, delivery, clean_file_name, work_fs):
         """
         Encrypts delivery for fetched keys
@@ -186,25 +761,35 @@ class EncryptingSender(ClientDeliverySender):
         :param fs.BaseFS work_fs: filesystem where delivery clean file resides
         """
         processed_file_name = "processed_file"
-        with TempFS() as temp_fs:
-            gpg = _get_initialized_gpg(temp_fs, self.encryption_keys)
-            temp_dir = temp_fs._temp_dir
 
+        compression = self._choose_compression(work_fs.getsyspath(clean_file_name))
+
+        with self._open_keyring() as keyring:
             # large files can be processed by encrypt_file only
-            output_path = os.path.join(temp_dir, processed_file_name)
-            fingerprints = gpg.list_keys().fingerprints
-            filename_args = _get_gpg_filename_args(delivery)
+            encryption_result = self._get_crypto_executor().encrypt(
+                keyring, work_fs.getsyspath(clean_file_name), work_fs.getsyspath(processed_file_name),
+                extra_args=_get_gpg_filename_args(delivery) + compression.args)
 
-            with work_fs.openbin(clean_file_name) as clean_data_handle:
-                encryption_result = gpg.encrypt_file(clean_data_handle, fingerprints, always_trust=True,
-                                                     extra_args=filename_args, output=output_path)
             if encryption_result.ok:
-                move_file(temp_fs, processed_file_name, work_fs, processed_file_name)
+                self._record_compression(delivery, compression, work_fs, clean_file_name, processed_file_name,
+                                         encryption_result.cpu_seconds)
                 return processed_file_name
 
         logging.error(encryption_result.stderr)
         raise DeliveryEncryptionError(f"Encryption failed: [{delivery.gav}]")
 
+    def _get_streaming_command(self, delivery, keyring):
+        """
+        Encrypts stdin for fetched keys, output is the same as 'encrypt_file' gives
+        """
+        command = _get_gpg_command(keyring.gpg) + ["--armor", "--always-trust", "--encrypt"]
+
+        for fingerprint in keyring.fingerprints:
+            command += ["--recipient", fingerprint]
+
+        command += _get_gpg_filename_args(delivery) + self._choose_compression().args
+        return command + ["--output", "-"], None
+
     def _get_destination_dir(self):
         """
         Places encrypted delivery to client/TO_BNK FTP folder
@@ -227,6 +812,10 @@ class SigningSender(ClientDeliverySender):
         self._private_key_data = self._read_private_key()
         self.passphrase = self.kwargs['pgp_private_key_password']
 
+        # key is validated by import
+        with self._open_keyring():
+            pass
+
     def _read_private_key(self):
         """
         Reads private key used to sign delivery 
@@ -240,9 +829,51 @@ class SigningSender(ClientDeliverySender):
         if not _key_fs.exists(_key_path):
             raise EnvironmentSetupError(f"NotFound: [{_key_path}]")
 
-        private_key = read_key(_key_fs, _key_path)
-        _validate_keys([private_key, ])
-        return private_key
+        return read_key(_key_fs, _key_path)
+
+    def _open_keyring(self):
+        return self._get_keyrings().open([self._private_key_data], passphrase=self.passphrase, owner="sign")
+
+    def _get_processing_settings(self):
+        return f"sign:{self._get_signature_extension() or 'inline'}:{get_keys_digest([self._private_key_data])}"
+
+    def _get_uploaded_names(self, delivery):
+        extension = self._get_signature_extension()
+
+        if not extension:
+            return super()._get_uploaded_names(delivery)
+
+        basename = NexusAPI.gav_to_filename(_delivery_packaged_gav(delivery, "zip"))
+        return [basename, f"{basename}.{extension}"]
+
+    def _get_signature_extension(self):
+        """
+        Detached signature is configured with 'signature: detached' for destination,
+        'signature_armor: false' gives binary signature instead of ASCII-armored one
+        :return str: extension of detached signature file, None if delivery is signed inline
+        """
+        _dest = self.kwargs.get('dest') or dict()
+
+        if str(_dest.get('signature') or 'inline').lower() != 'detached':
+            return None
+
+        return "asc" if _dest.get('signature_armor', True) else "sig"
+
+    def _get_streaming_command(self, delivery, keyring):
+        """
+        Signs stdin, output is the same as 'sign_file' gives. Passphrase is passed as the first stdin line.
+        Detached signature is never streamed: the original file is uploaded as is.
+        """
+        if self._get_signature_extension():
+            return None
+
+        command = _get_gpg_command(keyring.gpg) + ["--passphrase-fd", "0"]
+
+        if keyring.gpg.version >= (2, 1):
+            command += ["--pinentry-mode", "loopback"]
+
+        command += ["--sign"] + _get_gpg_filename_args(delivery) + self._choose_compression().args + ["--output", "-"]
+        return command, f"{self.passphrase or ''}\n".encode("utf-8")
 
     def _get_destination_dir(self):
         """
@@ -259,25 +890,62 @@ class SigningSender(ClientDeliverySender):
         """
         processed_file_name = "processed_file"
 
-        with TempFS() as temp_fs:
-            gpg = _get_initialized_gpg(temp_fs, [self._private_key_data], passphrase=self.passphrase)
-            # also clearsign should be disabled
-            temp_dir = temp_fs._temp_dir
-            output_path = os.path.join(temp_dir, processed_file_name)
-            filename_args = _get_gpg_filename_args(delivery)
+        if self._get_signature_extension():
+            return self._sign_detached(delivery, clean_file_name, work_fs)
+
+        compression = self._choose_compression(work_fs.getsyspath(clean_file_name))
 
-            with work_fs.openbin(clean_file_name) as clean_data_handle:
-                sign_result = gpg.sign_file(clean_data_handle, passphrase=self.passphrase,
-                                            binary=True, output=output_path,
-                                            extra_args=filename_args, clearsign=False)
+        with self._open_keyring() as keyring:
+            # also clearsign is disabled
+            sign_result = self._get_crypto_executor().sign(
+                keyring, self.passphrase, work_fs.getsyspath(clean_file_name),
+                work_fs.getsyspath(processed_file_name), extra_args=_get_gpg_filename_args(delivery) + compression.args)
 
-            if sign_result:  # truthy if signed successfully
-                move_file(temp_fs, processed_file_name, work_fs, processed_file_name)
+            if sign_result.ok:
+                self._record_compression(delivery, compression, work_fs, clean_file_name, processed_file_name,
+                                         sign_result.cpu_seconds)
                 return processed_file_name
             
         logging.error(sign_result.stderr)
         raise DeliveryEncryptionError(f"Signing failed: [{delivery.gav}]")
 
+    def _sign_detached(self, delivery, clean_file_name, work_fs):
+        """
+        Writes detached signature next to clean delivery, delivery itself is left unchanged
+        :param dlmanager.Delivery delivery: delivery to process
+        :param str clean_file_name: a filename with delivery
+        :param fs.BaseFS work_fs: filesystem where delivery is stored
+        :return str: clean_file_name, signature is placed to the same name with signature extension
+        """
+        signature_file_name = f"{clean_file_name}.{self._get_signature_extension()}"
+
+        with self._open_keyring() as keyring:
+            sign_result = self._get_crypto_executor().sign(
+                keyring, self.passphrase, work_fs.getsyspath(clean_file_name),
+                work_fs.getsyspath(signature_file_name), detach=True,
+                armor=self._get_signature_extension() == "asc")
+
+        if not sign_result.ok:
+            logging.error(sign_result.stderr)
+            raise DeliveryEncryptionError(f"Signing failed: [{delivery.gav}]")
+
+        return clean_file_name
+
+    def _upload_delivery(self, delivery, processed_file_name, work_fs, target_dir):
+        """
+        Uploads original delivery and its detached signature, signed delivery if signed inline
+        """
+        extension = self._get_signature_extension()
+
+        if not extension:
+            return super()._upload_delivery(delivery, processed_file_name, work_fs, target_dir)
+
+        target_fs = self._open_target_dir(target_dir)
+        basename, signature_name = self._get_uploaded_names(delivery)
+        # signature goes last: its presence means the delivery is complete
+        self._upload_file(work_fs, processed_file_name, target_fs, basename, target_dir)
+        self._upload_file(work_fs, f"{processed_file_name}.{extension}", target_fs, signature_name, target_dir)
+
 
 class MvnSender(ClientDeliverySender):
     """
@@ -287,6 +955,17 @@ class MvnSender(ClientDeliverySender):
     def _process_delivery_content(self, delivery, clean_data_handle, work_fs):
         return clean_data_handle
 
+    def _get_scratch_size(self, size):
+        # clean content is uploaded as is
+        return size
+
+    def get_connections_limit(self):
+        return int(self.kwargs.get('mvn_ext_max_connections') or 1)
+
+    def required_connections(self):
+        # external MVN client is leased for each upload
+        return ("mvn",)
+
     def _get_destination_dir(self):
         logging.debug('MvnSender: reached _get_destination_dir')
         target_repo = self.kwargs["dest"].get('target_repo')
@@ -295,18 +974,91 @@ class MvnSender(ClientDeliverySender):
 
     def _upload_delivery(self, delivery, processed_file_name, work_fs, target_dir):
         logging.debug(f'MvnSender: Reached _upload_delivery, target_dir: [{target_dir}]')
-        na = NexusAPI.NexusAPI(
-                root=self.kwargs["mvn_ext_url"],
-                user=self.kwargs["mvn_ext_user"],
-                auth=self.kwargs["mvn_ext_password"])
+        external_gav = self._get_external_gav(delivery.gav)
+
+        with self._lease_external_nexus() as na, work_fs.openbin(processed_file_name) as data:
+            upload_artifact(na, external_gav, target_dir, data)
+
+    def _stream_delivery(self, delivery, target_dir):
+        """
+        Copies delivery from internal MVN to external one without temporary files if streaming is enabled.
+        Delivery with registered MD5 is streamed only if internal MVN tells the same MD5 in advance.
+        Falls back to regular processing on any failure except missing delivery.
+        :param dlmanager.Delivery delivery: delivery to send
+        :param str target_dir: external repository to place delivery
+        :return bool: whether delivery was sent
+        """
+        if str(self.kwargs.get('delivery_streaming') or '').lower() not in ['y', 'yes', 'true']:
+            return False
+
+        staging = self.kwargs.get('delivery_staging')
+
+        if staging and not staging.claim(delivery, self.staging_consumer):
+            logging.debug(f"[{delivery.gav}] is staged for other destinations, streaming skipped")
+            return False
+
+        external_gav = self._get_external_gav(delivery.gav)
+        md5 = self._get_registered_md5(delivery)
+        source = TeeReader(self._open_clean_stream(delivery))
+
+        try:
+            # streamed content is published before it is checked, so the source has to confirm it in advance
+            if md5 and get_headers_md5(getattr(source, "headers", None) or dict()) != md5.lower():
+                logging.debug(f"MVN gives no MD5 of [{delivery.gav}] matching registered one, streaming skipped")
+                return False
+
+            logging.info(f"Streaming [{delivery.gav}] to [{target_dir}]")
+
+            with self._lease_external_nexus() as na:
+                if stream_artifact(na, external_gav, target_dir, source):
+                    self._check_streamed(na, delivery, external_gav, target_dir, md5, source.digests)
+
+            return True
+        except Exception as _e:
+            logging.warning(f"Streaming [{delivery.gav}] failed, falling back to regular upload: [{str(_e)}]")
+            return False
+        finally:
+            source.close()
+
+    def _check_streamed(self, nexus_api, delivery, external_gav, target_dir, md5, digests):
+        """
+        Checks streamed content against registered MD5, damaged artifact is removed from external repository
+        :param NexusAPI nexus_api: client of external repository
+        :param dlmanager.Delivery delivery: delivery streamed
+        :param str external_gav: GAV of artifact uploaded
+        :param str target_dir: external repository artifact is uploaded to
+        :param str md5: MD5 of clean delivery registered in checksums database, None if not registered
+        :param Digests digests: checksums of content streamed
+        :raises: DeliveryUploadError if content differs from registered one
+        """
+        try:
+            _check_registered_md5(delivery, md5, digests.hexdigests())
+        except DeliveryUploadError:
+            logging.warning(f"Removing damaged [{external_gav}] from [{target_dir}]")
 
-        with work_fs.openbin(processed_file_name) as data:
-            external_gav = self._get_external_gav(delivery.gav)
-            na.upload(external_gav, repo=target_dir, data=data)
+            try:
+                remove_artifact(nexus_api, external_gav, target_dir)
+            except Exception as _e:
+                logging.error(f"Unable to remove damaged [{external_gav}] from [{target_dir}]: [{str(_e)}]")
 
-            if not na.exists(external_gav, target_dir):
-                raise NexusAPI.NexusAPIError(
-                        f"MVN uploading failed. URL: [{self.kwargs['mvn_ext_url']}], GAV: [{external_gav}], repo: [{target_dir}]")
+            raise
+
+    @contextmanager
+    def _lease_external_nexus(self):
+        """
+        Leases external MVN client from 'resource_pool', so HTTP connections are kept between deliveries.
+        Without pool the client is created once per sender.
+        """
+        if self.kwargs.get('resource_pool'):
+            with self.kwargs['resource_pool'].lease("mvn_ext") as na:
+                yield na
+
+            return
+
+        if not getattr(self, '_external_nexus', None):
+            self._external_nexus = create_external_nexus(**self.kwargs)
+
+        yield self._external_nexus
 
     def _get_external_gav(self, gav):
         logging.debug(f'Reached _get_external_gav. GAV: [{gav}]')
@@ -336,6 +1088,64 @@ class KeyValidation(object):
         _validate_private_keys([private_key], passphrase, pgp_mail_from, mail_domain)
 
 
+class _PipelineItem(object):
+    """
+    Delivery passed between 'send_deliveries' stages
+    """
+
+    def __init__(self, index, delivery, release=None):
+        """
+        :param int index: delivery position in list sent
+        :param dlmanager.Delivery delivery: delivery being sent
+        :param callable release: called with delivery when item is closed
+        """
+        self.index = index
+        self.delivery = delivery
+        self.release = release
+        self.target_dir = None
+        self.work_fs = None
+        self.file_name = None
+        self.streamed = False
+        self.skipped = False
+        self.source_key = None
+        self.error = None
+
+    def close(self):
+        if self.work_fs is not None:
+            self.work_fs.close()
+
+        if self.release is not None:
+            # sender is done with delivery whether it was fetched or not
+            self.release(self.delivery)
+            self.release = None
+
+
+def _put_until_stopped(target_queue, item, stop):
+    """
+    :return bool: whether item was put, False if pipeline was stopped
+    """
+    while not stop.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def _get_until_stopped(source_queue, stop):
+    """
+    :return: item taken, None if pipeline was stopped or there are no more items
+    """
+    while True:
+        try:
+            return source_queue.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+
 ConnectionsContext = namedtuple("ConnectionsContext",
                                 ["nexus_fs",  # nexus_fs: NexusFS with access to zip artifacts
                                  "base_ftp_fs" # base_ftp_fs: FtpFS pointing to root of FTP server
@@ -361,15 +1171,6 @@ def _get_initialized_gpg(temp_fs, keys, passphrase=None):
     return gpg
 
 
-def _validate_keys(keys):
-    """
-    raises exception if keys are invalid, otherwise returns normally
-    :param list keys: list of gpg-keys data
-    """
-    with TempFS() as temp_fs:
-        _get_initialized_gpg(temp_fs, keys)
-
-
 def _validate_private_keys(keys, passphrase, pgp_mail_from, mail_domain):
     """
     Checks that the passphrase is correct
@@ -391,6 +1192,17 @@ def _validate_private_keys(keys, passphrase, pgp_mail_from, mail_domain):
         signed = gpg.sign(message, keyid=pgp_mail_from, passphrase=passphrase)
 
 
+def _check_registered_md5(delivery, md5, digests):
+    """
+    :param dlmanager.Delivery delivery: delivery downloaded
+    :param str md5: MD5 of clean delivery registered in checksums database, None if not registered
+    :param dict digests: hex digests of content downloaded by algorithm name
+    :raises: DeliveryUploadError if content differs from registered one
+    """
+    if md5 and digests["md5"] != md5.lower():
+        raise DeliveryUploadError(f"[{delivery.gav}] is damaged: MD5 [{digests['md5']}] instead of registered [{md5}]")
+
+
 def _delivery_packaged_gav(delivery, packaging):
     """
     Return GAV of packaged delivery
@@ -402,6 +1214,15 @@ def _delivery_packaged_gav(delivery, packaging):
     return NexusAPI.gav_to_str(pkg_gav)
 
 
+def _get_gpg_command(gpg):
+    """
+    Basic command line for non-interactive gpg call
+    :param gnupg.GPG gpg: initialized GPG client instance
+    :return list: gpg binary with options
+    """
+    return [gpg.gpgbinary, "--homedir", gpg.gnupghome, "--batch", "--no-tty", "--yes"]
+
+
 def _get_gpg_filename_args(delivery):
     """
     forces decrypt content as .txt file
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+""" Clean delivery content kept on local disk between runs """
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from fs.errors import NoSysPath
+from fs.osfs import OSFS
+from .integrity import Digests, TeeReader
+
+
+class ArtifactCache(object):
+    """
+    Content-addressed cache of artifacts downloaded from MVN, bounded by size with least recently used
+    entries evicted first. Files are named by MD5 of content, GAV index tells MD5 of the last content seen.
+    Safe for usage from several threads and processes sharing the same root:
+    files appear by atomic renames, GAV downloads and evictions are serialized with file locks.
+    """
+
+    def __init__(self, root, max_bytes):
+        """
+        :param str root: cache directory, created if missing
+        :param int max_bytes: total size of cached content kept
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.__objects = os.path.join(root, "objects")
+        self.__index = os.path.join(root, "index")
+        self.__temp = os.path.join(root, "tmp")
+
+        for _path in [self.__objects, self.__index, self.__temp]:
+            os.makedirs(_path, exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__counters = {"hits": 0, "misses": 0, "bytes_saved": 0, "bytes_downloaded": 0, "evictions": 0}
+
+    def fetch(self, gav, target_fs, target_path, download, md5=None):
+        """
+        Places artifact content to target, downloading it only if cache has no content with checksum expected.
+        Simultaneous fetches of the same GAV wait for the first one instead of downloading it again.
+        :param str gav: artifact GAV
+        :param fs.base.FS target_fs: FS to place content to
+        :param str target_path: path in target_fs
+        :param callable download: function(fs, path) writing artifact content to path in fs given,
+                                  may return dict of content hex digests with 'md5' to spare reading it again
+        :param str md5: checksum registered for artifact, content indexed by GAV is trusted if not given
+        :return bool: True if content was taken from cache
+        """
+        _key = hashlib.sha1(gav.encode("utf-8")).hexdigest()
+
+        with self.__file_lock(os.path.join(self.__index, _key + ".lock")):
+            _md5 = (md5 or self.__read_index(_key) or "").lower()
+
+            if _md5 and self.__copy_cached(_md5, target_fs, target_path):
+                self.__count(hits=1, bytes_saved=target_fs.getsize(target_path))
+                logging.debug(f"[{gav}] taken from artifact cache")
+                return True
+
+            _temp_name = uuid.uuid4().hex
+
+            try:
+                with OSFS(self.__temp) as _temp_fs:
+                    _digests = download(_temp_fs, _temp_name)
+
+                _temp_path = os.path.join(self.__temp, _temp_name)
+
+                if _digests and _digests.get("md5"):
+                    _size, _actual_md5 = os.path.getsize(_temp_path), _digests["md5"]
+                else:
+                    _size, _actual_md5 = _get_md5(_temp_path)
+
+                self.__count(misses=1, bytes_downloaded=_size)
+
+                _place(_temp_path, target_fs, target_path)
+
+                if md5 and _actual_md5 != md5.lower():
+                    logging.warning(f"[{gav}] MD5 [{_actual_md5}] differs from registered [{md5}], not cached")
+                    return False
+
+                self.__store(_key, _actual_md5, _temp_path, _size)
+            finally:
+                _remove_quietly(os.path.join(self.__temp, _temp_name))
+
+        return False
+
+    def stats(self):
+        """
+        :return dict: hits, misses, bytes not downloaded due to hits, bytes downloaded and entries evicted
+        """
+        with self.__lock:
+            return dict(self.__counters)
+
+    def log_stats(self):
+        _stats = self.stats()
+        _fetches = _stats["hits"] + _stats["misses"]
+        _ratio = _stats["hits"] / _fetches if _fetches else 0
+        logging.info(f"Artifact cache: hit ratio [{_ratio:.2f}], " +
+                     ", ".join(f"{_k} [{_v}]" for _k, _v in _stats.items()))
+
+    def __copy_cached(self, md5, target_fs, target_path):
+        _path = os.path.join(self.__objects, md5)
+
+        try:
+            with open(_path, mode="rb") as _data:
+                # modification time orders entries for eviction
+                os.utime(_path)
+                _reader = TeeReader(_data, Digests(["md5"]))
+                target_fs.upload(target_path, _reader)
+        except FileNotFoundError:
+            # never cached or evicted
+            return False
+
+        if _reader.digests.hexdigests()["md5"] != md5:
+            logging.warning(f"Artifact cache entry [{md5}] is damaged, removing it")
+            _remove_quietly(_path)
+            return False
+
+        return True
+
+    def __read_index(self, key):
+        try:
+            with open(os.path.join(self.__index, key), mode="r") as _index:
+                return _index.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def __store(self, key, md5, temp_path, size):
+        if size > self.max_bytes:
+            logging.debug(f"[{size}] bytes exceed artifact cache size, not cached")
+            return
+
+        with self.__file_lock(os.path.join(self.root, ".lock")):
+            os.replace(temp_path, os.path.join(self.__objects, md5))
+            _index_temp = os.path.join(self.__temp, uuid.uuid4().hex)
+
+            with open(_index_temp, mode="w") as _index:
+                _index.write(md5)
+
+            os.replace(_index_temp, os.path.join(self.__index, key))
+            self.__evict()
+
+    def __evict(self):
+        """
+        Removes least recently used entries until total size fits the limit. Called under root lock.
+        """
+        _entries = list()
+
+        with os.scandir(self.__objects) as _scan:
+            for _entry in _scan:
+                try:
+                    _stat = _entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                _entries.append((_stat.st_mtime, _stat.st_size, _entry.path))
+
+        _total = sum(_size for _, _size, _ in _entries)
+
+        for _, _size, _path in sorted(_entries):
+            if _total <= self.max_bytes:
+                break
+
+            # entry being read by another process stays readable until it is closed there
+            _remove_quietly(_path)
+            _total -= _size
+            self.__count(evictions=1)
+
+    def __count(self, **counters):
+        with self.__lock:
+            for _k, _v in counters.items():
+                self.__counters[_k] += _v
+
+    @contextmanager
+    def __file_lock(self, path):
+        # separate descriptors exclude each other both across processes and threads
+        with open(path, mode="a") as _lock_file:
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+
+def _get_md5(path, chunk_size=1024 * 1024):
+    """
+    :return tuple: size and MD5 hex digest of local file content
+    """
+    _hash = hashlib.md5()
+    _size = 0
+
+    with open(path, mode="rb") as _data:
+        for _chunk in iter(lambda: _data.read(chunk_size), b""):
+            _hash.update(_chunk)
+            _size += len(_chunk)
+
+    return _size, _hash.hexdigest()
+
+
+def _place(path, target_fs, target_path):
+    """
+    Hard-links local file to target if both are at the same device, copies it otherwise
+    """
+    try:
+        os.link(path, target_fs.getsyspath(target_path))
+        return
+    except (NoSysPath, OSError) as _e:
+        logging.debug(f"Unable to link downloaded file, copying: [{str(_e)}]")
+
+    with open(path, mode="rb") as _data:
+        target_fs.upload(target_path, _data)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -6,9 +6,11 @@ from fs.errors import ResourceNotFound
 import logging
 
 import posixpath
-from .fs_clients import get_svn_fs_client, get_ftp_fs_client
+from concurrent.futures import ThreadPoolExecutor
+from .resource_pool import create_resource_pool
+from .ftp_listing import CachedListingFS
 
-def update_send_availability_statuses(clients, **kwargs):
+def update_send_availability_statuses(clients, resource_pool=None, **kwargs):
     """ Top-level wrapper for clients status update 
 
     :param list clients: list of clients to update, as records from DB
@@ -18,44 +20,130 @@ def update_send_availability_statuses(clients, **kwargs):
     :param str ftp_url:
     :param str ftp_user:
     :param str ftp_password:
+    :param ClientKeysCache keys_cache: cache for SVN keys listings and FTP directories existence, optional
+    :param ResourcePool resource_pool: pool to lease connections from, new one is created and closed if not given
     """
-    # this case we should raise an error if anything absent, so do not use '.get' method of 'kwargs'
-    svn_fs = get_svn_fs_client(kwargs['svn_clients_url'], kwargs['svn_clients_user'], kwargs['svn_clients_password'])
-    ftp_fs = get_ftp_fs_client(kwargs['ftp_url'], kwargs['ftp_user'], kwargs['ftp_password']) 
+    # this case we should raise an error if anything absent, so pool factories do not use '.get' method of 'kwargs'
+    _pool = resource_pool or create_resource_pool(**kwargs)
 
-    for client in clients:
-        can_receive_encrypted = is_client_encrypted_send_available(client, svn_fs, ftp_fs)
-        update_can_receive_status(client, can_receive_encrypted)
+    try:
+        with _pool.lease("svn") as svn_fs, _pool.lease("ftp") as ftp_fs:
+            ftp_fs = CachedListingFS(ftp_fs)
 
+            for client in clients:
+                can_receive_encrypted = is_client_encrypted_send_available(client, svn_fs, ftp_fs,
+                                                                           keys_cache=kwargs.get('keys_cache'))
+                update_can_receive_status(client, can_receive_encrypted)
+    finally:
+        if _pool is not resource_pool:
+            _pool.close()
 
-def is_client_encrypted_send_available(client, svn_fs, ftp_fs):
+
+def is_client_encrypted_send_available(client, svn_fs, ftp_fs, keys_cache=None):
     """ Checks whether target public keys are available and FTP directory exists 
 
     :param str client: client to check
     :param SvnFS svn_fs: FS object pointing to repository root
     :param FTPFS ftp_fs: FS object pointing to FTP root
+    :param ClientKeysCache keys_cache: cache to reuse SVN listing and FTP check results from, optional
     :return bool: representing whether client can receive encrypted deliveries """
-    try:
-        client_data_path = posixpath.join(client.country, client.code, "data")
-        data_contents = svn_fs.listdir(client_data_path)
+    if not has_client_keys(client, svn_fs, keys_cache=keys_cache):
+        return False
 
-        if not any(name.endswith(".asc") for name in data_contents):
-            logging.info(f"No *.asc files found at [{client_data_path}]")
-            return False
+    return has_client_ftp_dir(client, ftp_fs, keys_cache=keys_cache)
 
-        ftp_path = posixpath.join(client.code, "TO_BNK")
 
-        if not ftp_fs.exists(ftp_path):
-            logging.info(f"Not found in FTP: [{ftp_path}]")
-            return False
+def has_client_keys(client, svn_fs, keys_cache=None):
+    """ Checks whether target public keys are available
+
+    :param str client: client to check
+    :param SvnFS svn_fs: FS object pointing to repository root
+    :param ClientKeysCache keys_cache: cache to reuse SVN listing from while revision is not changed, optional
+    :return bool: whether any *.asc file is present in client's data directory """
+    client_data_path = posixpath.join(client.country, client.code, "data")
 
-        logging.info(f"Client [{client.code}] can receive encrypted deliveries")
-        return True
+    if keys_cache:
+        svn_fs = keys_cache.open(svn_fs)
 
+    try:
+        data_contents = svn_fs.listdir(client_data_path)
     except ResourceNotFound:
         logging.info(f"Not found in SVN: [{client_data_path}]")
         return False
 
+    if not any(name.endswith(".asc") for name in data_contents):
+        logging.info(f"No *.asc files found at [{client_data_path}]")
+        return False
+
+    return True
+
+
+def has_client_ftp_dir(client, ftp_fs, keys_cache=None):
+    """ Checks whether client's FTP directory exists
+
+    :param str client: client to check
+    :param FTPFS ftp_fs: FS object pointing to FTP root
+    :param ClientKeysCache keys_cache: cache to reuse recent check result from, optional
+    :return bool: whether TO_BNK directory exists """
+    ftp_path = posixpath.join(client.code, "TO_BNK")
+    _exists = keys_cache.ftp_exists if keys_cache else lambda _fs, _path: _fs.exists(_path)
+
+    if not _exists(ftp_fs, ftp_path):
+        logging.info(f"Not found in FTP: [{ftp_path}]")
+        return False
+
+    logging.info(f"Client [{client.code}] can receive encrypted deliveries")
+    return True
+
+
+def get_ftp_client_dirs(ftp_fs):
+    """ Lists directories in FTP root by single request
+
+    :param FTPFS ftp_fs: FS object pointing to FTP root
+    :return set: names of directories, i.e. codes of clients having FTP directory """
+    return set(_info.name for _info in ftp_fs.scandir("/") if _info.is_dir)
+
+
+def sweep_send_availability_statuses(clients, resource_pool=None, sweep_workers=8, **kwargs):
+    """ Clients status update optimized for many clients:
+    FTP root is listed once, SVN data directories are listed concurrently
+    and only changed statuses are written to database.
+    Client is available at FTP if it has directory in FTP root, TO_BNK inside it is not checked:
+    its absence is reported by upload then
+
+    :param list clients: list of clients to update, as records from DB
+    :param ResourcePool resource_pool: pool to lease connections from, new one is created and closed if not given
+    :param int sweep_workers: number of concurrent SVN listings
+    :param **kwargs: SVN and FTP credentials, see 'update_send_availability_statuses'
+    """
+    clients = list(clients)
+    _pool = resource_pool or create_resource_pool(**kwargs)
+
+    def _has_client_keys(client):
+        # pysvn client can not be shared between threads, so each listing leases its own connection
+        with _pool.lease("svn") as svn_fs:
+            return has_client_keys(client, svn_fs, keys_cache=kwargs.get('keys_cache'))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(int(sweep_workers), 1), thread_name_prefix="sweep") as _executor:
+            _keys_available = list(_executor.map(_has_client_keys, clients))
+
+        with _pool.lease("ftp") as ftp_fs:
+            _ftp_client_dirs = get_ftp_client_dirs(ftp_fs)
+    finally:
+        if _pool is not resource_pool:
+            _pool.close()
+
+    statuses = dict()
+
+    for client, _has_keys in zip(clients, _keys_available):
+        statuses[client.pk] = _has_keys and client.code in _ftp_client_dirs
+
+        if _has_keys and not statuses[client.pk]:
+            logging.info(f"Not found in FTP: [{client.code}]")
+
+    bulk_update_can_receive_statuses(clients, statuses)
+
 
 def update_can_receive_status(client, can_receive_encrypted):
     """ Sets can_receive flag based on client params and encrypted send availability.
@@ -67,17 +155,66 @@ def update_can_receive_status(client, can_receive_encrypted):
     """
     from oc_delivery_apps.dlmanager.models import FtpUploadClientOptions
     options, _c = FtpUploadClientOptions.objects.get_or_create(client=client)
+    options.can_receive = get_can_receive_status(client, options, can_receive_encrypted)
+    options.save()
+
+    logging.info(f"Set [{client.code}] availability to [{options.can_receive}]")
+
 
+def get_can_receive_status(client, options, can_receive_encrypted):
+    """ Calculates can_receive flag based on client params and encrypted send availability
+
+    :param str client: client to calculate flag for
+    :param FtpUploadClientOptions options: client's settings
+    :param bool can_receive_encrypted: result of availability check
+    :return bool: new can_receive flag value
+    """
     if options.should_encrypt:
         # encrypting client's status is based on previous check
-        options.can_receive = can_receive_encrypted
-    else:
-        # signing client availability currently is not validated, so we allow send
-        logging.warning(f"[{client.code}] doesn't receive encrypted deliveries, so upload is allowed")
-        options.can_receive = True
-    options.save()
+        return can_receive_encrypted
 
-    logging.info(f"Set [{client.code}] availability to [{options.can_receive}]")
+    # signing client availability currently is not validated, so we allow send
+    logging.warning(f"[{client.code}] doesn't receive encrypted deliveries, so upload is allowed")
+    return True
+
+
+def bulk_update_can_receive_statuses(clients, statuses):
+    """ Sets can_receive flags for many clients at once.
+    Missing settings are created, existing ones are written only if flag value is changed
+
+    :param list clients: clients to update
+    :param dict statuses: client primary key ==> result of availability check
+    """
+    from django.db import transaction
+    from oc_delivery_apps.dlmanager.models import FtpUploadClientOptions
+    options = dict((_o.client_id, _o) for _o in FtpUploadClientOptions.objects.filter(client__in=clients))
+    created = list()
+    changed = list()
+
+    for client in clients:
+        _options = options.get(client.pk)
+
+        if _options is None:
+            _options = FtpUploadClientOptions(client=client)
+            _options.can_receive = get_can_receive_status(client, _options, statuses[client.pk])
+            created.append(_options)
+        else:
+            _can_receive = get_can_receive_status(client, _options, statuses[client.pk])
+
+            if _options.can_receive == _can_receive:
+                continue
+
+            _options.can_receive = _can_receive
+            changed.append(_options)
+
+        logging.info(f"Set [{client.code}] availability to [{_options.can_receive}]")
+
+    with transaction.atomic():
+        FtpUploadClientOptions.objects.bulk_create(created)
+        FtpUploadClientOptions.objects.bulk_update(changed, ["can_receive"])
+
+    logging.info(f"Availability statuses: created [{len(created)}], changed [{len(changed)}], "
+                 f"unchanged [{len(clients) - len(created) - len(changed)}]")
 
 
 if __name__ == "__main__":
@@ -85,6 +222,9 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Client availability update")
     parser.add_argument("--client", dest="client", help="Code of client to update status", required=False)
     parser.add_argument("--log-level", dest="log_level", help="Set log level", type=int, default=50)
+    parser.add_argument("--sweep-workers", dest="sweep_workers",
+                        help="Number of clients checked in SVN concurrently when all clients are updated",
+                        default=os.getenv("SWEEP_WORKERS") or "8")
 
     ### FTP arguments
     parser.add_argument("--ftp-url", dest="ftp_url", help="FTP URL",
@@ -139,10 +279,7 @@ if __name__ == "__main__":
     active_clients = Client.objects.filter(is_active=True)
 
     if args.client:
-        clients = active_clients.filter(code=args.client)
+        update_send_availability_statuses(active_clients.filter(code=args.client), **args.__dict__)
     else:
-        clients = active_clients.all()
-
-    # ftp_connect imports Django models, so import it there
-    update_send_availability_statuses(clients, **args.__dict__)
+        sweep_send_availability_statuses(active_clients.all(), **args.__dict__)
 
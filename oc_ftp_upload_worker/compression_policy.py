@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+""" Choice of gpg compression for delivery content and statistics to tune it """
+
+import logging
+import math
+import os
+import threading
+from collections import Counter, namedtuple
+
+CompressionChoice = namedtuple("CompressionChoice", ["name", "args"])
+
+# packagings already compressed by their format
+COMPRESSED_PACKAGINGS = ["zip", "jar", "war", "ear", "gz", "tgz", "bz2", "xz", "7z", "rar"]
+
+
+class CompressionPolicy(object):
+    """
+    Decides whether gpg should compress delivery content.
+    Setting given explicitly (per client or per worker) wins. Otherwise content of compressed packaging
+    is sampled and gpg compression is disabled for it if sampled bytes look random.
+    Without content available packaging is trusted.
+    Keeps per-choice totals of gpg CPU time and sizes, so the policy may be tuned.
+    """
+
+    def __init__(self, sample_size=64 * 1024, samples=4, entropy_threshold=7.5):
+        """
+        :param int sample_size: bytes read for each sample
+        :param int samples: number of samples spread over the file
+        :param float entropy_threshold: bits per byte above which content is considered incompressible
+        """
+        self.sample_size = sample_size
+        self.samples = samples
+        self.entropy_threshold = entropy_threshold
+        self.__lock = threading.Lock()
+        # choice name ==> [deliveries, input bytes, output bytes, cpu seconds]
+        self.__totals = dict()
+
+    def choose(self, packaging, path=None, setting=None):
+        """
+        :param str packaging: delivery packaging, e.g. 'zip'
+        :param str path: local path to clean content, if available
+        :param setting: 'auto', 'none', 'default' or compression level 0-9; 'auto' if not set
+        :return CompressionChoice: choice name and gpg arguments
+        """
+        setting = str(setting if setting is not None else "auto").lower()
+
+        if setting == "none":
+            return CompressionChoice("none", ["--compress-algo", "none"])
+
+        if setting == "default":
+            return CompressionChoice("default", list())
+
+        if setting.isdigit():
+            return CompressionChoice(f"level-{setting}", ["-z", setting])
+
+        if setting != "auto":
+            logging.warning(f"Unknown compression setting [{setting}], using gpg default")
+            return CompressionChoice("default", list())
+
+        if str(packaging).lower() not in COMPRESSED_PACKAGINGS:
+            return CompressionChoice("default", list())
+
+        if path is not None and get_sampled_entropy(path, self.sample_size, self.samples) < self.entropy_threshold:
+            # e.g. archive with stored entries
+            return CompressionChoice("default", list())
+
+        return CompressionChoice("none", ["--compress-algo", "none"])
+
+    def record(self, gav, choice, input_size, output_size, cpu_seconds):
+        """
+        Logs and accumulates result of processing with compression chosen
+        :param str gav: delivery GAV
+        :param CompressionChoice choice: compression used
+        :param int input_size: clean content size, bytes
+        :param int output_size: processed content size, bytes
+        :param float cpu_seconds: CPU time spent by gpg
+        """
+        logging.info(f"Compression [{choice.name}] for [{gav}]: input [{input_size}], output [{output_size}], "
+                     f"saved [{input_size - output_size}] bytes, gpg CPU [{cpu_seconds:.3f}] s")
+
+        with self.__lock:
+            _totals = self.__totals.setdefault(choice.name, [0, 0, 0, 0.0])
+            _totals[0] += 1
+            _totals[1] += input_size
+            _totals[2] += output_size
+            _totals[3] += cpu_seconds
+
+    def stats(self):
+        """
+        :return dict: choice name ==> dict with 'deliveries', 'input_bytes', 'output_bytes', 'cpu_seconds'
+        """
+        with self.__lock:
+            return {_name: dict(zip(["deliveries", "input_bytes", "output_bytes", "cpu_seconds"], _totals))
+                    for _name, _totals in self.__totals.items()}
+
+    def log_stats(self):
+        for _name, _stats in self.stats().items():
+            _mb = _stats['input_bytes'] / (1024 * 1024)
+            _cpu_per_mb = _stats['cpu_seconds'] / _mb if _mb else 0.0
+            logging.info(f"Compression [{_name}] totals: deliveries [{_stats['deliveries']}], "
+                         f"input [{_stats['input_bytes']}], output [{_stats['output_bytes']}] bytes, "
+                         f"gpg CPU [{_stats['cpu_seconds']:.3f}] s, [{_cpu_per_mb:.3f}] s/MB")
+
+
+def get_sampled_entropy(path, sample_size, samples):
+    """
+    Estimates Shannon entropy of file content by several samples spread over it
+    :param str path: local file path
+    :param int sample_size: bytes read for each sample
+    :param int samples: number of samples
+    :return float: bits per byte, 0 for empty file
+    """
+    _size = os.path.getsize(path)
+    _counts = Counter()
+    _total = 0
+
+    with open(path, "rb") as _file:
+        for _offset in sorted({_size * _i // samples for _i in range(samples)}):
+            _file.seek(_offset)
+            _chunk = _file.read(sample_size)
+            _counts.update(_chunk)
+            _total += len(_chunk)
+
+    if not _total:
+        return 0.0
+
+    return -sum(_n / _total * math.log2(_n / _total) for _n in _counts.values())
+
+
+# policy shared by all senders of the process
+default_policy = CompressionPolicy()
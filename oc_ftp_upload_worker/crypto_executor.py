@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+""" Encryption and signing jobs run by a bounded pool of workers """
+
+import atexit
+import gnupg
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+CryptoResult = namedtuple("CryptoResult", ["ok", "stderr", "cpu_seconds"])
+
+
+class _MeasuredGPG(gnupg.GPG):
+    """
+    GPG counting CPU time of its own gpg processes. Each process is reaped with 'wait4' to get its usage,
+    so processes of other jobs finished meanwhile in the same worker are not counted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.cpu_seconds = 0.0
+        super().__init__(*args, **kwargs)
+        # version check on initialization is not a part of the job
+        self.cpu_seconds = 0.0
+
+    def _open_subprocess(self, *args, **kwargs):
+        _process = super()._open_subprocess(*args, **kwargs)
+        _wait = _process.wait
+
+        def _wait_measured(timeout=None):
+            if _process.returncode is not None or timeout is not None:
+                return _wait(timeout)
+
+            _, _status, _usage = os.wait4(_process.pid, 0)
+            _process.returncode = os.WEXITSTATUS(_status) if os.WIFEXITED(_status) else -os.WTERMSIG(_status)
+            self.cpu_seconds += _usage.ru_utime + _usage.ru_stime
+            return _process.returncode
+
+        _process.wait = _wait_measured
+        return _process
+
+
+def encrypt_file(gpgbinary, gnupghome, recipients, input_path, output_path, extra_args=None):
+    """
+    Encrypts file for recipients given. Arguments are plain values, so it may be run in another process.
+    :param str gpgbinary: path to gpg executable
+    :param str gnupghome: path to GPG home with recipients keys imported
+    :param list recipients: fingerprints of keys to encrypt for
+    :param str input_path: path to clean file
+    :param str output_path: path to write encrypted file to
+    :param list extra_args: additional gpg arguments
+    :return CryptoResult: whether encryption succeeded, gpg diagnostics and CPU time
+    """
+    gpg = _MeasuredGPG(gpgbinary=gpgbinary, gnupghome=gnupghome)
+
+    with open(input_path, "rb") as _input:
+        result = gpg.encrypt_file(_input, recipients, always_trust=True, extra_args=extra_args, output=output_path)
+
+    return CryptoResult(bool(result.ok), result.stderr, gpg.cpu_seconds)
+
+
+def sign_file(gpgbinary, gnupghome, passphrase, input_path, output_path, extra_args=None, detach=False, armor=False):
+    """
+    Writes file with both content and signature, or signature only, see 'encrypt_file' for common arguments
+    :param str passphrase: passphrase of private key in GPG home
+    :param bool detach: write signature only
+    :param bool armor: write ASCII-armored output instead of binary one
+    :return CryptoResult: whether signing succeeded, gpg diagnostics and CPU time
+    """
+    gpg = _MeasuredGPG(gpgbinary=gpgbinary, gnupghome=gnupghome)
+
+    with open(input_path, "rb") as _input:
+        result = gpg.sign_file(_input, passphrase=passphrase, binary=not armor, output=output_path,
+                               extra_args=extra_args, clearsign=False, detach=detach)
+
+    return CryptoResult(bool(result), result.stderr, gpg.cpu_seconds)
+
+
+class CryptoExecutor(object):
+    """
+    Runs gpg jobs of all senders with limited concurrency.
+    gpg itself is a separate process, so thread workers already use several cores;
+    process workers additionally move gpg output handling off the worker process.
+    """
+
+    def __init__(self, workers=4, processes=False):
+        """
+        :param int workers: jobs run simultaneously
+        :param bool processes: run jobs in worker processes instead of threads
+        """
+        self.workers = workers
+        self.processes = processes
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def encrypt(self, keyring, input_path, output_path, extra_args=None):
+        """
+        Encrypts file for all keys of keyring, waits for result
+        :param Keyring keyring: leased keyring with recipients keys
+        :param str input_path: path to clean file
+        :param str output_path: path to write encrypted file to
+        :param list extra_args: additional gpg arguments
+        :return CryptoResult: whether encryption succeeded, gpg diagnostics and CPU time
+        """
+        return self.submit(encrypt_file, keyring.gpg.gpgbinary, keyring.gpg.gnupghome, list(keyring.fingerprints),
+                           input_path, output_path, extra_args).result()
+
+    def sign(self, keyring, passphrase, input_path, output_path, extra_args=None, detach=False, armor=False):
+        """
+        Signs file with private key of keyring, waits for result. See 'encrypt' for common arguments.
+        :param str passphrase: passphrase of private key
+        :param bool detach: write signature only
+        :param bool armor: write ASCII-armored output
+        :return CryptoResult: whether signing succeeded, gpg diagnostics and CPU time
+        """
+        return self.submit(sign_file, keyring.gpg.gpgbinary, keyring.gpg.gnupghome, passphrase,
+                           input_path, output_path, extra_args, detach, armor).result()
+
+    def submit(self, job, *args):
+        """
+        :param callable job: module-level function to run
+        :return concurrent.futures.Future: job result
+        """
+        with self.__lock:
+            if self.__executor is None:
+                logging.debug(f"Starting [{self.workers}] crypto {'processes' if self.processes else 'threads'}")
+                self.__executor = self.__create_executor()
+
+            return self.__executor.submit(job, *args)
+
+    def close(self):
+        """
+        Waits for running jobs and stops workers
+        """
+        with self.__lock:
+            _executor, self.__executor = self.__executor, None
+
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+
+    def __create_executor(self):
+        if not self.processes:
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dlcrypto")
+
+        if sys.version_info < (3, 7):
+            return ProcessPoolExecutor(max_workers=self.workers)
+
+        # forked child may inherit locks held by other threads of the worker
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# executor shared by all senders of the process
+default_executor = CryptoExecutor()
+atexit.register(default_executor.close)
+
+
+if __name__ == "__main__":
+    # benchmark: encryption throughput depending on workers count
+    import os
+    import time
+    from argparse import ArgumentParser
+    from fs.tempfs import TempFS
+    from .gpg_keyrings import GpgKeyrings
+
+    parser = ArgumentParser(description="Measure encryption throughput for different crypto workers count")
+    parser.add_argument("--workers", dest="workers", help="Comma-separated workers counts to try",
+                        default=",".join(str(_w) for _w in sorted({1, 2, 4, os.cpu_count() or 1})))
+    parser.add_argument("--jobs", dest="jobs", help="Files encrypted for each workers count", type=int, default=16)
+    parser.add_argument("--size-mb", dest="size_mb", help="Size of each file, megabytes", type=int, default=32)
+    parser.add_argument("--processes", dest="processes", help="Use worker processes instead of threads",
+                        action="store_true")
+    parser.add_argument("--key-file", dest="key_file", help="Public key to encrypt for, generated if not given")
+    parser.add_argument("--log-level", dest="log_level", help="Set log level", type=int, default=30)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    with TempFS() as work_fs:
+        if args.key_file:
+            with open(args.key_file, "rb") as _key_file:
+                key_data = _key_file.read()
+        else:
+            logging.warning("Generating benchmark key")
+            work_fs.makedir("keygen")
+            _gpg = gnupg.GPG(gnupghome=work_fs.getsyspath("keygen"))
+            _key = _gpg.gen_key(_gpg.gen_key_input(key_type="RSA", key_length=2048, no_protection=True,
+                                                   name_email="benchmark@example.com"))
+            key_data = _gpg.export_keys(str(_key))
+
+        for _job in range(args.jobs):
+            with work_fs.openbin(f"clean_{_job}", "w") as _clean:
+                for _ in range(args.size_mb):
+                    _clean.write(os.urandom(1024 * 1024))
+
+        keyrings = GpgKeyrings()
+
+        print(f"{'workers':>8} {'seconds':>10} {'MB/s':>10}")
+
+        with keyrings.open([key_data]) as keyring:
+            for workers in [int(_w) for _w in args.workers.split(",")]:
+                executor = CryptoExecutor(workers=workers, processes=args.processes)
+                # workers are started before measuring
+                executor.submit(len, "").result()
+                started = time.monotonic()
+                futures = [executor.submit(encrypt_file, keyring.gpg.gpgbinary, keyring.gpg.gnupghome,
+                                           keyring.fingerprints, work_fs.getsyspath(f"clean_{_job}"),
+                                           work_fs.getsyspath(f"encrypted_{_job}"))
+                           for _job in range(args.jobs)]
+
+                if not all(_future.result().ok for _future in futures):
+                    raise RuntimeError("Encryption failed")
+
+                elapsed = time.monotonic() - started
+                executor.close()
+                print(f"{workers:>8} {elapsed:>10.2f} {args.jobs * args.size_mb / elapsed:>10.1f}")
+
+        keyrings.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+""" Clean deliveries downloaded once per upload run and shared between destination senders """
+
+import logging
+import os
+import threading
+from fs.copy import copy_file
+from fs.errors import NoSysPath
+from .scratch import default_scratch
+
+_STAGED_NAME = "clean_delivery"
+
+
+class DeliveryStaging(object):
+    """
+    Keeps clean delivery content locally while other senders of the same run still need it.
+    Consumers are declared for each delivery in advance, staged copy is removed after the last consumer
+    has taken it or released it, e.g. failed before fetching.
+    """
+
+    def __init__(self, scratch=None):
+        """
+        :param ScratchSpace scratch: space to keep staged content in, process-wide one by default.
+                                     Each staged delivery gets its own directory with its size reserved,
+                                     staged files are linked to work directories of the same space instead of copying.
+        """
+        self.__scratch = scratch or default_scratch
+        self.__lock = threading.Lock()
+        # gav ==> keys of consumers which did not fetch delivery yet
+        self.__consumers = dict()
+        # gav ==> scratch directory containing staged content
+        self.__staged = dict()
+        # gav ==> lock preventing simultaneous downloads of the same delivery
+        self.__gav_locks = dict()
+
+    def expect(self, deliveries, consumers):
+        """
+        Declares senders which will fetch each delivery
+        :param list deliveries: delivery records
+        :param list consumers: keys of senders for these deliveries
+        """
+        if not consumers:
+            return
+
+        with self.__lock:
+            for delivery in deliveries:
+                self.__consumers.setdefault(delivery.gav, set()).update(consumers)
+
+    def fetch(self, delivery, target_fs, target_name, download, consumer, measure=None):
+        """
+        Places clean delivery content to target. Content is downloaded only once for all consumers.
+        :param dlmanager.Delivery delivery: delivery to fetch
+        :param fs.base.FS target_fs: FS to place content to
+        :param str target_name: path to file relative to target_fs root
+        :param callable download: called with (delivery, fs, path) to download clean content
+        :param consumer: key of sender fetching delivery
+        :param callable measure: called with delivery to get size of clean content to reserve for staged copy,
+                                 space is not reserved if not given
+        :raises ScratchSpaceError: if local disk has not enough free space for staged copy
+        """
+        with self.__lock:
+            _gav_lock = self.__gav_locks.setdefault(delivery.gav, threading.Lock())
+
+        with _gav_lock:
+            try:
+                with self.__lock:
+                    _others = self.__consumers.get(delivery.gav, set()) - {consumer}
+                    _staged = self.__staged.get(delivery.gav)
+
+                if _staged is None and not _others:
+                    # nobody else needs this content, so there is no reason to keep a copy
+                    download(delivery, target_fs, target_name)
+                    return
+
+                if _staged is None:
+                    logging.debug(f"Staging [{delivery.gav}] for [{len(_others) + 1}] senders")
+                    _staged = self.__stage(delivery, download, measure)
+
+                    with self.__lock:
+                        self.__staged[delivery.gav] = _staged
+                else:
+                    logging.debug(f"Taking staged [{delivery.gav}]")
+
+                self.__place(_staged, target_fs, target_name)
+            finally:
+                self.__consume(delivery.gav, consumer)
+
+    def claim(self, delivery, consumer):
+        """
+        Consumes delivery by sender which gets content on its own, e.g. streams it.
+        Possible only if no other sender needs the content.
+        :param dlmanager.Delivery delivery: delivery to claim
+        :param consumer: key of sender claiming delivery
+        :return bool: whether delivery was claimed
+        """
+        with self.__lock:
+            _gav_lock = self.__gav_locks.setdefault(delivery.gav, threading.Lock())
+
+        with _gav_lock:
+            with self.__lock:
+                if delivery.gav in self.__staged or self.__consumers.get(delivery.gav, set()) - {consumer}:
+                    return False
+
+            self.__consume(delivery.gav, consumer)
+            return True
+
+    def release(self, delivery, consumer):
+        """
+        Tells sender is done with delivery. Nothing changes if it has fetched or claimed delivery already,
+        otherwise its expectation is dropped and staged copy is removed if nobody else needs it.
+        :param dlmanager.Delivery delivery: delivery sender is done with
+        :param consumer: key of sender
+        """
+        with self.__lock:
+            _gav_lock = self.__gav_locks.setdefault(delivery.gav, threading.Lock())
+
+        with _gav_lock:
+            self.__consume(delivery.gav, consumer)
+
+    def __stage(self, delivery, download, measure):
+        """
+        Downloads delivery to new scratch directory with space reserved for it
+        :return ScratchFS: directory containing staged content
+        """
+        _staged_fs = self.__scratch.open(size=measure(delivery) if measure else None, identifier="dlstaging")
+
+        try:
+            download(delivery, _staged_fs, _STAGED_NAME)
+            return _staged_fs
+        except BaseException:
+            _staged_fs.close()
+            raise
+
+    def __place(self, staged_fs, target_fs, target_name):
+        """
+        Hard-links staged file to target if possible, copies it otherwise
+        """
+        try:
+            os.link(staged_fs.getsyspath(_STAGED_NAME), target_fs.getsyspath(target_name))
+            return
+        except (NoSysPath, OSError) as _e:
+            logging.debug(f"Unable to link staged file, copying: [{str(_e)}]")
+
+        copy_file(staged_fs, _STAGED_NAME, target_fs, target_name)
+
+    def __consume(self, gav, consumer):
+        with self.__lock:
+            _remaining = self.__consumers.get(gav, set())
+            _remaining.discard(consumer)
+
+            if _remaining:
+                return
+
+            self.__consumers.pop(gav, None)
+            _staged = self.__staged.pop(gav, None)
+
+        if _staged is not None:
+            logging.debug(f"Releasing staged [{gav}]")
+            _staged.close()
+
+    def staged_count(self):
+        """
+        :return int: number of deliveries kept in staging
+        """
+        with self.__lock:
+            return len(self.__staged)
+
+    def expected_count(self):
+        """
+        :return int: number of deliveries some sender has not fetched or released yet
+        """
+        with self.__lock:
+            return len(self.__consumers)
+
+    def close(self):
+        """
+        Removes all staged content including deliveries not taken by all declared consumers
+        """
+        with self.__lock:
+            _staged = list(self.__staged.values())
+            self.__staged.clear()
+            self.__consumers.clear()
+
+        for _staged_fs in _staged:
+            _staged_fs.close()
@@ -4,8 +4,8 @@
 import os
 import re
 from oc_mailer.Mailer import Mailer
-from .fs_clients import get_svn_fs_client, get_ftp_fs_client, get_mvn_fs_client, get_smtp_client
-from fs.tempfs import TempFS
+from .resource_pool import create_resource_pool
+from .ftp_listing import CachedListingFS
 from .ClientDeliverySender import EncryptingSender, SigningSender, ConnectionsContext
 from .upload_errors import DeliveryExistsError, EnvironmentSetupError, UploadProcessException, DeliveryUploadError, ClientSetupError, EnvironmentSetupError, UploadProcessException, DeliveryEncryptionError
 import pkg_resources
@@ -13,52 +13,60 @@ import logging
 import sys
 
 
-def perform_upload(clients, **kwargs):
+def perform_upload(clients, resource_pool=None, **kwargs):
     """ Runs upload process for each client 
 
     :param clients: list of clients to process
+    :param ResourcePool resource_pool: pool to lease connections from, new one is created and closed if not given
     :param **kwargs: keyword options, see worker command line arguments for description
     """
     # following resources are common for all client connections.
     # ClientDeliverySender objects itself create separate connections to concrete client subdir.
+    _pool = resource_pool or create_resource_pool(**kwargs)
 
-    ## make credentials for two MVN connections
-    with TempFS() as work_fs, \
-            get_svn_fs_client(
-                    url=kwargs['svn_clients_url'],
-                    user=kwargs['svn_clients_user'],
-                    password=kwargs['svn_clients_password']) as repo_svn_fs, \
-            get_mvn_fs_client(url=kwargs['mvn_int_url'],
-                    user=kwargs['mvn_int_user'],
-                    password=kwargs['mvn_int_password'],
-                    work_fs=work_fs,
-                    download_repo=kwargs['mvn_download_repo']) as nexus_fs, \
-            get_ftp_fs_client(
-                    url=kwargs['ftp_url'],
-                    user=kwargs['ftp_user'],
-                    password=kwargs['ftp_password']) as base_ftp_fs:
-        context = ConnectionsContext(nexus_fs, base_ftp_fs)
-        from .upload_steps import get_pending_deliveries, notify_deliveries_recipients
-        deliveries = get_pending_deliveries()
-        from .independent_upload import process_clients_independently
-        upload_result = process_clients_independently(deliveries, clients, context,
-                                                      repo_svn_fs, **kwargs)
-
-        smtp_client = get_smtp_client(url=kwargs['smtp_url'],
-                user=kwargs['smtp_user'],
-                password=kwargs['smtp_password'])
-
-        mail_from = kwargs['mail_from']
-
-        if '@' not in mail_from:
-            mail_from = '@'.join([mail_from, kwargs['mail_domain']])
-
-        mailer = Mailer(smtp_client, mail_from, config_path=kwargs['mail_config_file'])
-
-        notify_deliveries_recipients(mailer, clients, upload_result.sent_deliveries, **kwargs)
-        smtp_client.quit()
-
-        postprocess_upload_result(upload_result)
+    try:
+        with _pool.lease("svn") as repo_svn_fs, \
+                _pool.lease("mvn") as nexus_fs, \
+                _pool.lease("ftp") as base_ftp_fs:
+            # directories are listed once per run, existence checks are answered locally then
+            base_ftp_fs = CachedListingFS(base_ftp_fs)
+            context = ConnectionsContext(nexus_fs, base_ftp_fs)
+            from .upload_steps import get_pending_deliveries, notify_deliveries_recipients
+            deliveries = get_pending_deliveries(clients)
+            from .independent_upload import process_clients_independently
+            upload_result = process_clients_independently(deliveries, clients, context,
+                                                          repo_svn_fs, resource_pool=_pool, **kwargs)
+
+            mail_from = kwargs['mail_from']
+
+            if '@' not in mail_from:
+                mail_from = '@'.join([mail_from, kwargs['mail_domain']])
+
+            with _pool.lease("smtp") as smtp_client:
+                mailer = Mailer(smtp_client, mail_from, config_path=kwargs['mail_config_file'])
+                notify_deliveries_recipients(mailer, clients, upload_result.sent_deliveries, **kwargs)
+
+            if kwargs.get('keys_cache'):
+                kwargs['keys_cache'].log_stats()
+
+            if kwargs.get('compression_policy'):
+                kwargs['compression_policy'].log_stats()
+
+            if kwargs.get('ftp_sessions'):
+                kwargs['ftp_sessions'].log_stats()
+
+            base_ftp_fs.listing.log_stats()
+
+            if kwargs.get('artifact_cache'):
+                kwargs['artifact_cache'].log_stats()
+
+            if kwargs.get('scratch'):
+                kwargs['scratch'].log_stats()
+
+            postprocess_upload_result(upload_result)
+    finally:
+        if _pool is not resource_pool:
+            _pool.close()
 
 
 def postprocess_upload_result(upload_result):
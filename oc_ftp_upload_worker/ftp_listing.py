@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+""" FTP directory listings kept during an upload run """
+
+import logging
+import threading
+from collections import OrderedDict
+from fs.errors import ResourceNotFound, DirectoryExpected
+from fs.path import abspath, normpath, split, join, recursepath
+from fs.wrapfs import WrapFS
+
+_CACHED_NAMESPACES = {"basic", "details"}
+
+
+class FtpListingCache(object):
+    """
+    Directory listings of one FTP server, safe for usage from several threads.
+    Directory is listed once (MLSD if server supports it) when any of its entries is looked up first time.
+    Entries reported written are refreshed individually on next lookup,
+    removed ones are forgotten without asking the server.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # directory path ==> OrderedDict name ==> Info or None for entry to be refreshed; None for missing directory
+        self.__listings = dict()
+        self.__counters = {"hits": 0, "listings": 0, "refreshes": 0}
+
+    def lookup(self, ftp_fs, path):
+        """
+        :param fs.base.FS ftp_fs: FS to read listings from
+        :param str path: absolute path
+        :return fs.info.Info: basic and details of path, None if it does not exist
+        """
+        _path = abspath(normpath(path))
+        _dir, _name = split(_path)
+
+        if not _name:
+            # root is never cached
+            return ftp_fs.getinfo(_path, namespaces=["details"])
+
+        with self.__lock:
+            if self.__has_missing_ancestor(_dir):
+                self.__counters["hits"] += 1
+                return None
+
+        _listing = self.__get_listing(ftp_fs, _dir)
+
+        with self.__lock:
+            if _listing is None or _name not in _listing:
+                return None
+
+            _info = _listing[_name]
+
+        if _info is not None:
+            return _info
+
+        try:
+            _info = ftp_fs.getinfo(_path, namespaces=["details"])
+        except ResourceNotFound:
+            _info = None
+
+        with self.__lock:
+            self.__counters["refreshes"] += 1
+            _listing = self.__listings.get(_dir)
+
+            if _listing is not None and _name in _listing and _listing[_name] is None:
+                if _info is None:
+                    del _listing[_name]
+                else:
+                    _listing[_name] = _info
+
+        return _info
+
+    def listdir(self, ftp_fs, path):
+        """
+        :param fs.base.FS ftp_fs: FS to read listing from
+        :param str path: absolute directory path
+        :return list: names in directory, None if directory does not exist
+        """
+        _path = abspath(normpath(path))
+        _listing = self.__get_listing(ftp_fs, _path)
+
+        if _listing is None:
+            return None
+
+        with self.__lock:
+            _names = list(_listing.items())
+
+        # entries written since listing may have gone
+        return [_name for _name, _info in _names if _info is not None or self.lookup(ftp_fs, join(_path, _name))]
+
+    def forget(self, path):
+        """
+        Marks path as written, so its metadata is refreshed on next lookup
+        :param str path: absolute path
+        """
+        _path = abspath(normpath(path))
+        _dir, _name = split(_path)
+
+        with self.__lock:
+            self.__drop_tree(_path)
+
+            if _dir not in self.__listings:
+                return
+
+            if self.__listings[_dir] is None:
+                # directory appeared
+                del self.__listings[_dir]
+                return
+
+            self.__listings[_dir][_name] = None
+
+    def removed(self, path):
+        """
+        Forgets path removed along with everything below it
+        :param str path: absolute path
+        """
+        _path = abspath(normpath(path))
+        _dir, _name = split(_path)
+
+        with self.__lock:
+            self.__drop_tree(_path)
+
+            if self.__listings.get(_dir) is not None:
+                self.__listings[_dir].pop(_name, None)
+
+    def stats(self):
+        """
+        :return dict: lookups answered locally, directories listed and entries refreshed
+        """
+        with self.__lock:
+            return dict(self.__counters)
+
+    def log_stats(self):
+        logging.info("FTP listing cache: " + ", ".join(f"{_k} [{_v}]" for _k, _v in self.stats().items()))
+
+    def __get_listing(self, ftp_fs, path):
+        with self.__lock:
+            if path in self.__listings:
+                self.__counters["hits"] += 1
+                return self.__listings[path]
+
+        try:
+            _listing = OrderedDict((_info.name, _info) for _info in ftp_fs.scandir(path, namespaces=["details"]))
+        except (ResourceNotFound, DirectoryExpected):
+            _listing = None
+
+        with self.__lock:
+            self.__counters["listings"] += 1
+            # listed by another thread meanwhile
+            return self.__listings.setdefault(path, _listing)
+
+    def __has_missing_ancestor(self, path):
+        """
+        :return bool: whether any cached listing on the way to path shows it can not exist
+        """
+        _parents = recursepath(path)
+
+        for _parent, _child in zip(_parents, _parents[1:]):
+            if _parent not in self.__listings:
+                continue
+
+            _listing = self.__listings[_parent]
+
+            if _listing is None or split(_child)[1] not in _listing:
+                return True
+
+        return False
+
+    def __drop_tree(self, path):
+        _prefix = path.rstrip("/") + "/"
+
+        for _dir in [_d for _d in self.__listings if _d == path or _d.startswith(_prefix)]:
+            del self.__listings[_dir]
+
+
+class CachedListingFS(WrapFS):
+    """
+    FS view answering existence and metadata questions from listing cache.
+    Writes are passed through as is: writer should tell the cache what it changed, see 'ftp_transfer'
+    """
+
+    def __init__(self, wrap_fs, listing=None):
+        """
+        :param fs.base.FS wrap_fs: FS pointing to FTP root
+        :param FtpListingCache listing: cache to use, new one if not given
+        """
+        super().__init__(wrap_fs)
+        self.listing = listing or FtpListingCache()
+
+    def with_fs(self, wrap_fs):
+        """
+        :param fs.base.FS wrap_fs: another connection to the same FTP server
+        :return CachedListingFS: view of that connection sharing this view cache
+        """
+        return CachedListingFS(wrap_fs, self.listing)
+
+    def getinfo(self, path, namespaces=None):
+        if not _CACHED_NAMESPACES.issuperset(namespaces or []) or abspath(normpath(path)) == "/":
+            return super().getinfo(path, namespaces=namespaces)
+
+        self.check()
+        _info = self.listing.lookup(self.delegate_fs(), path)
+
+        if _info is None:
+            raise ResourceNotFound(path)
+
+        return _info
+
+    def exists(self, path):
+        try:
+            self.getinfo(path)
+            return True
+        except ResourceNotFound:
+            return False
+
+    def isdir(self, path):
+        try:
+            return self.getinfo(path).is_dir
+        except ResourceNotFound:
+            return False
+
+    def isfile(self, path):
+        try:
+            return not self.getinfo(path).is_dir
+        except ResourceNotFound:
+            return False
+
+    def getsize(self, path):
+        return self.getinfo(path, namespaces=["details"]).size
+
+    def listdir(self, path):
+        self.check()
+        _names = self.listing.listdir(self.delegate_fs(), path)
+
+        if _names is None:
+            raise ResourceNotFound(path)
+
+        return _names
+
+    def scandir(self, path, namespaces=None, page=None):
+        if page is not None or not _CACHED_NAMESPACES.issuperset(namespaces or []):
+            return super().scandir(path, namespaces=namespaces, page=page)
+
+        return iter([self.getinfo(join(path, _name)) for _name in self.listdir(path)])
+
+
+def get_ftp_fs(ftp_fs):
+    """
+    :param fs.base.FS ftp_fs: FS pointing to FTP, may be seen through listing cache or other wrappers
+    :return fs.base.FS: innermost FS
+    """
+    while isinstance(ftp_fs, WrapFS):
+        ftp_fs = ftp_fs.delegate_fs()
+
+    return ftp_fs
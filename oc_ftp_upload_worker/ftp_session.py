@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+""" FTP control connections reused while they are alive """
+
+import ftplib
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from fs.ftpfs import FTPFS
+from .ftp_listing import get_ftp_fs
+
+_CONNECTION_ERRORS = ftplib.all_errors + (EOFError,)
+
+
+class FtpSessions(object):
+    """
+    Keeps FTP control connections instead of reopening them before each upload.
+    Connection used recently is trusted, connection idle for a while is probed with NOOP and reopened only
+    if the probe fails, connection idle longer than servers usually keep it is reopened without probe.
+    Keep-alives may be sent while connection waits for long delivery processing.
+    """
+
+    def __init__(self, probe_after=30, max_idle=600, keepalive_interval=30, clock=time.monotonic):
+        """
+        :param float probe_after: seconds of idleness after which connection is probed before use
+        :param float max_idle: seconds of idleness after which connection is reopened without probe
+        :param float keepalive_interval: seconds between keep-alives, 0 disables them
+        :param callable clock: monotonic time source
+        """
+        self.probe_after = probe_after
+        self.max_idle = max_idle
+        self.keepalive_interval = keepalive_interval
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # FTPFS ==> last time connection was known to be alive
+        self.__last_used = weakref.WeakKeyDictionary()
+        self.__counters = {"connects": 0, "reconnects": 0, "probes": 0, "keepalives": 0}
+
+    def ensure(self, ftp_fs):
+        """
+        Makes sure FS has working control connection
+        :param ftp_fs: FS to check, anything other than FTPFS (or its wrapper) is left as is
+        :return bool: whether connection was opened
+        """
+        ftp_fs = get_ftp_fs(ftp_fs)
+
+        if not isinstance(ftp_fs, FTPFS):
+            return False
+
+        with ftp_fs._lock:
+            with self.__lock:
+                _last_used = self.__last_used.get(ftp_fs)
+
+            _idle = None if _last_used is None else self.__clock() - _last_used
+            _opened = False
+
+            if ftp_fs._ftp is None:
+                self.__open(ftp_fs, "connects")
+                _opened = True
+            elif _idle is not None and self.max_idle is not None and _idle > self.max_idle:
+                logging.debug(f"FTP connection is idle for [{_idle:.0f}] seconds, reconnecting")
+                self.__open(ftp_fs, "reconnects")
+                _opened = True
+            elif (_idle is None or _idle > self.probe_after) and not self.__probe(ftp_fs, "probes"):
+                logging.debug("FTP connection is dead, reconnecting")
+                self.__open(ftp_fs, "reconnects")
+                _opened = True
+
+            self.__touch(ftp_fs)
+            return _opened
+
+    def used(self, ftp_fs):
+        """
+        Records that connection has just served a request, so it is not probed or reopened as idle one
+        :param ftp_fs: FS used, anything other than FTPFS (or its wrapper) is ignored
+        """
+        ftp_fs = get_ftp_fs(ftp_fs)
+
+        if isinstance(ftp_fs, FTPFS) and ftp_fs._ftp is not None:
+            self.__touch(ftp_fs)
+
+    @contextmanager
+    def keepalive(self, ftp_fs):
+        """
+        Sends NOOP periodically while in context, so server does not close idle connection
+        :param ftp_fs: FS which connection is to be kept, anything other than FTPFS is ignored
+        """
+        ftp_fs = get_ftp_fs(ftp_fs)
+
+        if not isinstance(ftp_fs, FTPFS) or not self.keepalive_interval:
+            yield
+            return
+
+        _stop = threading.Event()
+
+        def _send():
+            while not _stop.wait(self.keepalive_interval):
+                # connection in use by someone else is alive anyway
+                if not ftp_fs._lock.acquire(blocking=False):
+                    continue
+
+                try:
+                    if ftp_fs._ftp is not None and self.__probe(ftp_fs, "keepalives"):
+                        self.__touch(ftp_fs)
+                finally:
+                    ftp_fs._lock.release()
+
+        _thread = threading.Thread(target=_send, name="ftpkeepalive", daemon=True)
+        _thread.start()
+
+        try:
+            yield
+        finally:
+            _stop.set()
+            _thread.join()
+
+    def stats(self):
+        """
+        :return dict: numbers of connects, reconnects, probes and keep-alives
+        """
+        with self.__lock:
+            return dict(self.__counters)
+
+    def log_stats(self):
+        logging.info("FTP sessions: " + ", ".join(f"{_k} [{_v}]" for _k, _v in self.stats().items()))
+
+    def __probe(self, ftp_fs, counter):
+        """
+        :return bool: whether server answered NOOP
+        """
+        self.__count(counter)
+
+        try:
+            ftp_fs._ftp.voidcmd("NOOP")
+            return True
+        except _CONNECTION_ERRORS as _e:
+            logging.debug(f"FTP NOOP failed: [{str(_e)}]")
+            return False
+
+    def __open(self, ftp_fs, counter):
+        _broken, ftp_fs._ftp = ftp_fs._ftp, None
+
+        if _broken is not None:
+            try:
+                _broken.close()
+            except Exception:
+                pass
+
+        self.__count(counter)
+        ftp_fs._get_ftp()
+
+    def __touch(self, ftp_fs):
+        with self.__lock:
+            self.__last_used[ftp_fs] = self.__clock()
+
+    def __count(self, counter):
+        with self.__lock:
+            self.__counters[counter] += 1
+
+
+# sessions shared by all senders of the process
+default_sessions = FtpSessions()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+""" Uploads never visible to clients partially written """
+
+import ftplib
+import logging
+import time
+from fs.ftpfs import FTPFS, ftp_errors
+from fs.copy import copy_file
+from .ftp_listing import CachedListingFS
+from .integrity import TeeReader
+
+
+def get_temp_name(basename):
+    """
+    :param str basename: final file name
+    :return str: name to write file content to before it is renamed to the final one
+    """
+    return f".{basename}.part"
+
+
+def get_source_name(basename):
+    """
+    :param str basename: uploaded file name
+    :return str: name of sidecar file identifying content uploaded by its source and processing
+    """
+    return f".{basename}.source"
+
+
+def is_uploaded(target_fs, basenames, source_key):
+    """
+    Checks whether files made of the same source the same way are uploaded already
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param list basenames: names of files uploaded for delivery, sidecar of the first one is checked
+    :param str source_key: key of source and processing, see 'mark_uploaded'
+    :return bool: True if all files are there and sidecar tells the same key
+    """
+    _source_name = get_source_name(basenames[0])
+
+    if not all(target_fs.exists(_name) for _name in list(basenames) + [_source_name]):
+        return False
+
+    return target_fs.readtext(_source_name).strip() == source_key
+
+
+def mark_uploaded(target_fs, basename, source_key):
+    """
+    Writes sidecar telling what uploaded file was made of, so the same upload may be skipped next time
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param str basename: uploaded file name
+    :param str source_key: key of source and processing, e.g. hash of clean content checksum and keys used
+    """
+    _source_name = get_source_name(basename)
+
+    try:
+        target_fs.writetext(_source_name, source_key)
+    finally:
+        _written(target_fs, _source_name)
+
+
+def commit_upload(target_fs, temp_name, basename):
+    """
+    Makes file uploaded under temporary name visible with final name
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param str temp_name: name file was uploaded with
+    :param str basename: final file name, existing file is overwritten
+    """
+    # sidecar of previous content must not describe the new one
+    _remove(target_fs, get_source_name(basename))
+    replace(target_fs, temp_name, basename)
+
+
+def replace(target_fs, temp_name, basename):
+    """
+    Renames uploaded file to final name, server-side for FTP
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param str temp_name: name file was uploaded with
+    :param str basename: final file name, existing file is overwritten
+    """
+    _remove(target_fs, basename)
+    _ftp_fs, _temp_path, _ = _delegate_path(target_fs, temp_name)
+    _, _path, _ = _delegate_path(target_fs, basename)
+
+    try:
+        if isinstance(_ftp_fs, FTPFS):
+            with _ftp_fs._lock:
+                with ftp_errors(_ftp_fs, _path):
+                    _ftp_fs.ftp.rename(_temp_path, _path)
+        else:
+            target_fs.move(temp_name, basename)
+    except Exception:
+        _written(target_fs, temp_name)
+        raise
+    else:
+        _removed(target_fs, temp_name)
+    finally:
+        _written(target_fs, basename)
+
+
+def upload_stream(target_fs, path, stream):
+    """
+    Writes content read from stream to target
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param str path: path relative to target_fs root
+    :param stream: binary file-like object to read content from
+    """
+    try:
+        target_fs.upload(path, stream)
+    finally:
+        _written(target_fs, path)
+
+
+def store_resumable(get_ftp, path, local_file, size, retries=3, backoff=5.0, sleep=time.sleep):
+    """
+    Uploads file to FTP, continues interrupted transfer with APPE from the size already stored
+    :param callable get_ftp: called with 'reconnect' flag, returns ftplib.FTP connection
+    :param str path: remote path
+    :param local_file: binary file-like object with 'seek' method
+    :param int size: local file size
+    :param int retries: attempts to continue transfer after the first one failed
+    :param float backoff: seconds to wait before the first retry, doubled for each next one
+    :param callable sleep: waits for seconds given
+    :raises: ftplib.all_errors of the last attempt, permanent FTP errors are not retried
+    """
+    _attempt = 0
+
+    while True:
+        try:
+            _ftp = get_ftp(bool(_attempt))
+            _offset = (_get_remote_size(_ftp, path) or 0) if _attempt else 0
+
+            if _offset > size:
+                # not our content
+                _offset = 0
+
+            if _offset:
+                logging.info(f"Resuming upload of [{path}] from [{_offset}] of [{size}] bytes")
+
+            local_file.seek(_offset)
+            _ftp.storbinary(f"{'APPE' if _offset else 'STOR'} {path}", local_file)
+            _stored = _get_remote_size(_ftp, path)
+
+            # servers not supporting SIZE are trusted
+            if _stored is None or _stored == size:
+                return
+
+            raise ftplib.error_temp(f"451 [{path}] has [{_stored}] bytes of [{size}] after transfer")
+        except ftplib.error_perm:
+            raise
+        except ftplib.all_errors as _e:
+            if _attempt >= retries:
+                raise
+
+            _delay = backoff * 2 ** _attempt
+            _attempt += 1
+            logging.warning(f"Upload of [{path}] interrupted: [{str(_e)}], retry [{_attempt}] of [{retries}] "
+                            f"in [{_delay}] seconds")
+            sleep(_delay)
+
+
+def _get_remote_size(ftp, path):
+    """
+    :return int: size of remote file, None if it is unknown
+    """
+    try:
+        ftp.voidcmd("TYPE I")
+        return ftp.size(path)
+    except ftplib.error_perm:
+        return None
+
+
+def _get_ftp(ftp_fs, reconnect):
+    """
+    :param FTPFS ftp_fs: FS to take connection from
+    :param bool reconnect: drop current connection and open new one
+    :return ftplib.FTP: connection
+    """
+    if reconnect and ftp_fs._ftp is not None:
+        _broken, ftp_fs._ftp = ftp_fs._ftp, None
+
+        try:
+            _broken.close()
+        except Exception:
+            pass
+
+    return ftp_fs.ftp
+
+
+def _delegate_path(target_fs, path):
+    """
+    Resolves path to the FS doing actual work, seeing through listing cache
+    :return tuple: FS, path at it and listing cache to notify of changes made, if any
+    """
+    _fs, _path = target_fs.delegate_path(path)
+
+    if not isinstance(_fs, CachedListingFS):
+        return _fs, _path, None
+
+    _listing = _fs.listing
+    _fs, _path = _fs.delegate_path(_path)
+    return _fs, _path, _listing
+
+
+def _written(target_fs, path):
+    """
+    Tells listing cache target is seen through, if any, that path may have changed
+    """
+    _, _path, _listing = _delegate_path(target_fs, path)
+
+    if _listing:
+        _listing.forget(_path)
+
+
+def _removed(target_fs, path):
+    """
+    Tells listing cache target is seen through, if any, that path is removed
+    """
+    _, _path, _listing = _delegate_path(target_fs, path)
+
+    if _listing:
+        _listing.removed(_path)
+
+
+def _remove(target_fs, path):
+    """
+    Removes file if it exists, keeping listing cache target is seen through up to date
+    """
+    if not target_fs.exists(path):
+        return
+
+    try:
+        target_fs.remove(path)
+    except Exception:
+        _written(target_fs, path)
+        raise
+
+    _removed(target_fs, path)
+
+
+def _transfer(work_fs, file_name, target_fs, temp_name, retries, backoff, digests=None):
+    """
+    Copies local file to target, resumable if target is FTP. Content sent is hashed if digests are given.
+    """
+    _ftp_fs, _path, _ = _delegate_path(target_fs, temp_name)
+
+    try:
+        if not isinstance(_ftp_fs, FTPFS):
+            if digests is None:
+                copy_file(work_fs, file_name, target_fs, temp_name)
+                return
+
+            with work_fs.openbin(file_name) as _local:
+                target_fs.upload(temp_name, TeeReader(_local, digests))
+
+            return
+
+        with work_fs.openbin(file_name) as _local:
+            if digests is not None:
+                # content resent after reconnection is not hashed twice
+                _local = TeeReader(_local, digests)
+
+            with ftp_errors(_ftp_fs, _path):
+                store_resumable(lambda reconnect: _get_ftp(_ftp_fs, reconnect), _path, _local,
+                                work_fs.getsize(file_name), retries=retries, backoff=backoff)
+    finally:
+        _written(target_fs, temp_name)
+
+
+def upload_file(work_fs, file_name, target_fs, basename, retries=0, backoff=5.0, digests=None):
+    """
+    Moves local file to target directory under temporary name and renames it to final name then.
+    Clients never see partially written file with final name. Local file is kept until upload is complete,
+    interrupted FTP transfer is continued from where it stopped.
+    :param fs.base.FS work_fs: FS containing file
+    :param str file_name: path to file relative to work_fs root
+    :param fs.base.FS target_fs: FS pointing to target directory
+    :param str basename: final file name, existing file is overwritten
+    :param int retries: attempts to continue interrupted FTP transfer
+    :param float backoff: seconds before the first retry, doubled for each next one
+    :param Digests digests: checksums to update with file content, it is read once for both hashing and upload
+    """
+    _temp_name = get_temp_name(basename)
+
+    try:
+        _remove(target_fs, _temp_name)
+        _transfer(work_fs, file_name, target_fs, _temp_name, retries, backoff, digests=digests)
+        commit_upload(target_fs, _temp_name, basename)
+    except Exception:
+        remove_quietly(target_fs, _temp_name)
+        raise
+
+    work_fs.remove(file_name)
+
+
+def remove_quietly(target_fs, basename):
+    """
+    Removes file if it exists, errors are logged only
+    """
+    try:
+        _remove(target_fs, basename)
+    except Exception as _e:
+        logging.error(f"Unable to remove [{basename}]: [{str(_e)}]")
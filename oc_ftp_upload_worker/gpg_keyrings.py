@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+""" Long-lived GPG homes shared between deliveries and messages """
+
+import atexit
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from fs.tempfs import TempFS
+
+
+class Keyring(object):
+    """
+    GPG home with imported keys
+    """
+
+    def __init__(self, digest, home_fs, gpg):
+        """
+        :param str digest: hash of key material imported
+        :param fs.tempfs.TempFS home_fs: FS containing gnupghome
+        :param gnupg.GPG gpg: GPG client instance working with this home
+        """
+        self.digest = digest
+        self.home_fs = home_fs
+        self.gpg = gpg
+        self.fingerprints = list(gpg.list_keys().fingerprints)
+        self.leases = 0
+        self.evicted = False
+
+    def close(self):
+        logging.debug(f"Removing GPG keyring [{self.digest}]")
+        self.home_fs.close()
+
+
+class GpgKeyrings(object):
+    """
+    Keeps one GPG home per distinct set of keys, keys are imported only once.
+    Keyring of an owner is dropped when owner's keys change, least recently used keyrings are dropped
+    when there are too many of them. Keyring in use is removed only after it is released.
+    """
+
+    def __init__(self, max_keyrings=32):
+        """
+        :param int max_keyrings: number of keyrings kept
+        """
+        self.max_keyrings = max_keyrings
+        self.__lock = threading.Lock()
+        # digest ==> Keyring, least recently used first
+        self.__keyrings = OrderedDict()
+        # owner ==> digest of its current keys
+        self.__owners = dict()
+
+    @contextmanager
+    def open(self, keys, passphrase=None, owner=None):
+        """
+        Leases keyring containing keys given, creates it if necessary
+        :param list keys: keys data, as bytes or strings
+        :param str passphrase: passphrase for private key import
+        :param str owner: identifier of keys user, e.g. client code; previous keyring of the owner is dropped
+        :return Keyring: keyring to use within context only
+        :raises DeliveryEncryptionError: if any key can not be imported
+        """
+        keyring = self.acquire(keys, passphrase=passphrase, owner=owner)
+
+        try:
+            yield keyring
+        finally:
+            self.release(keyring)
+
+    def acquire(self, keys, passphrase=None, owner=None):
+        """
+        Same as 'open' but keyring should be given back with 'release'
+        """
+        digest = get_keys_digest(keys, passphrase=passphrase)
+        _to_close = list()
+
+        with self.__lock:
+            keyring = self.__keyrings.get(digest)
+
+            if keyring is not None:
+                self.__keyrings.move_to_end(digest)
+                keyring.leases += 1
+
+            if owner is not None:
+                _previous = self.__owners.get(owner)
+                self.__owners[owner] = digest
+
+                if _previous is not None and _previous != digest:
+                    logging.info(f"Keys of [{owner}] changed, dropping its keyring")
+                    _to_close += self.__forget(_previous)
+
+        self.__close(_to_close)
+
+        if keyring is not None:
+            return keyring
+
+        keyring = self.__create(digest, keys, passphrase)
+
+        with self.__lock:
+            _existing = self.__keyrings.get(digest)
+
+            if _existing is not None:
+                # created by another thread meanwhile
+                _to_close.append(keyring)
+                keyring = _existing
+            else:
+                self.__keyrings[digest] = keyring
+
+            self.__keyrings.move_to_end(digest)
+            keyring.leases += 1
+            _to_close += self.__trim()
+
+        self.__close(_to_close)
+        return keyring
+
+    def release(self, keyring):
+        """
+        Gives leased keyring back
+        :param Keyring keyring: keyring returned by 'acquire'
+        """
+        with self.__lock:
+            keyring.leases -= 1
+            _close = keyring.evicted and not keyring.leases
+
+        if _close:
+            keyring.close()
+
+    def count(self):
+        """
+        :return int: number of keyrings kept
+        """
+        with self.__lock:
+            return len(self.__keyrings)
+
+    def close(self):
+        """
+        Removes all keyrings not in use
+        """
+        with self.__lock:
+            _to_close = list()
+
+            for digest in list(self.__keyrings.keys()):
+                _to_close += self.__evict(digest)
+
+            self.__owners.clear()
+
+        self.__close(_to_close)
+
+    def __create(self, digest, keys, passphrase):
+        # import here since ClientDeliverySender uses this module
+        from .ClientDeliverySender import _get_initialized_gpg
+        logging.debug(f"Creating GPG keyring [{digest}]")
+        home_fs = TempFS(identifier="dlgpg")
+        # agent of long-lived home should not accept wrong passphrase after a correct one was given
+        home_fs.writetext("gpg-agent.conf", "default-cache-ttl 0\nmax-cache-ttl 0\n")
+
+        try:
+            return Keyring(digest, home_fs, _get_initialized_gpg(home_fs, keys, passphrase=passphrase))
+        except Exception:
+            home_fs.close()
+            raise
+
+    def __forget(self, digest):
+        """
+        Evicts keyring if no other owner uses it. Should be called under lock.
+        :return list: keyrings to close
+        """
+        if digest in self.__owners.values():
+            return list()
+
+        return self.__evict(digest)
+
+    def __trim(self):
+        """
+        Evicts least recently used keyrings not in use. Should be called under lock.
+        :return list: keyrings to close
+        """
+        _to_close = list()
+
+        for digest, keyring in list(self.__keyrings.items()):
+            if len(self.__keyrings) <= self.max_keyrings:
+                break
+
+            if not keyring.leases:
+                _to_close += self.__evict(digest)
+
+        return _to_close
+
+    def __evict(self, digest):
+        """
+        Should be called under lock.
+        :return list: keyrings to close
+        """
+        keyring = self.__keyrings.pop(digest, None)
+
+        if keyring is None:
+            return list()
+
+        keyring.evicted = True
+
+        for owner in [_o for _o, _d in self.__owners.items() if _d == digest]:
+            del self.__owners[owner]
+
+        return list() if keyring.leases else [keyring]
+
+    def __close(self, keyrings):
+        for keyring in keyrings:
+            try:
+                keyring.close()
+            except Exception as _e:
+                logging.error(f"Unable to remove GPG keyring [{keyring.digest}]: [{str(_e)}]")
+
+
+def get_keys_digest(keys, passphrase=None):
+    """
+    :param list keys: keys data, as bytes or strings
+    :param str passphrase: passphrase keys are imported with
+    :return str: hash of keys set, independent of keys order
+    """
+    _hashes = sorted(hashlib.sha256(_key.encode("utf-8") if isinstance(_key, str) else _key).hexdigest()
+                     for _key in keys)
+
+    if passphrase is not None:
+        _hashes.append(hashlib.sha256(f"passphrase:{passphrase}".encode("utf-8")).hexdigest())
+
+    return hashlib.sha256(":".join(_hashes).encode("utf-8")).hexdigest()
+
+
+# keyrings shared by all senders of the process
+default_keyrings = GpgKeyrings()
+atexit.register(default_keyrings.close)
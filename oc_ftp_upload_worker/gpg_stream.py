@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Passing delivery content through external gpg process without intermediate files """
+
+import logging
+import subprocess
+import tempfile
+import threading
+
+
+def pipe_through_process(command, source, consume, prefix=None, chunk_size=1024 * 1024):
+    """
+    Feeds source to process stdin while process stdout is consumed. Memory usage does not depend on content size.
+    :param list command: process command line
+    :param source: file-like object with 'read' method, closed by caller
+    :param callable consume: called with process stdout as file-like object, should read it till the end
+    :param bytes prefix: data written to stdin before source content, e.g. passphrase line
+    :param int chunk_size: bytes read from source at once
+    :raises: subprocess.CalledProcessError if process failed, exceptions of source reading or consume call
+    """
+    with tempfile.TemporaryFile() as _stderr:
+        _process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=_stderr)
+        _feed_errors = list()
+
+        def _feed():
+            try:
+                if prefix:
+                    _process.stdin.write(prefix)
+
+                while True:
+                    _chunk = source.read(chunk_size)
+
+                    if not _chunk:
+                        break
+
+                    _process.stdin.write(_chunk)
+            except BrokenPipeError:
+                # process exited before reading all the input, its exit code tells the reason
+                pass
+            except Exception as _e:
+                _feed_errors.append(_e)
+                # process should not wait for the rest of input forever
+                _process.kill()
+            finally:
+                try:
+                    _process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        _feeder = threading.Thread(target=_feed, name="gpgfeed", daemon=True)
+        _feeder.start()
+
+        try:
+            consume(_process.stdout)
+        except Exception:
+            _process.kill()
+            raise
+        finally:
+            # closed output stops the process even if consumer has not read everything
+            _process.stdout.close()
+            _feeder.join()
+            _process.wait()
+
+        if _feed_errors:
+            raise _feed_errors.pop(0)
+
+        if _process.returncode:
+            _stderr.seek(0)
+            _message = _stderr.read().decode("utf-8", errors="replace")
+            logging.error(_message)
+            raise subprocess.CalledProcessError(_process.returncode, command[0], stderr=_message)
@@ -5,118 +5,279 @@ Logic for independent delivery processing. Allows to delay error raise to the en
 
 
 import logging
+import queue
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from itertools import chain
+from django.db import connection
 from oc_delivery_apps.dlmanager.models import Client, FtpUploadClientOptions
-from .ClientDeliverySender import EncryptingSender, SigningSender, MvnSender
+from .ClientDeliverySender import EncryptingSender, SigningSender, MvnSender, ConnectionsContext
 from .upload_errors import DeliveryUploadError, ClientSetupError, EnvironmentSetupError
 from .DeliveryDestinations import DeliveryDestinations
+from .delivery_staging import DeliveryStaging
 
 UploadResult = namedtuple("UploadResult", ("sent_deliveries", "raised_errors"))
 
 
-def process_client_deliveries_independently(deliveries, client_sender):
+def process_client_deliveries_independently(deliveries, client_sender, workers=1, resource_pool=None):
     """ Runs upload for client's deliveries independently. Raises errors are returned but not raised 
 
     :param deliveries: list of deliveries to send
     :param client_sender: initialized ClientDeliverySender
+    :param int workers: deliveries sent in parallel, limited by destination connections limit
+    :param ResourcePool resource_pool: pool to lease connections for additional workers from
     :returns: UploadResult with upload info
     """
+    deliveries = list(deliveries)
+    workers = min(int(workers or 1), len(deliveries))
 
-    sent_deliveries = []
-    raised_errors = []
+    if workers > 1:
+        workers = min(workers, client_sender.get_connections_limit())
 
-    for delivery in deliveries:
-        try:
-            client_sender.send_delivery(delivery)
-            sent_deliveries.append(delivery)
-            logging.info(f"Successfully sent: [{delivery.gav}]")
-        except DeliveryUploadError as exc:
-            # ignore this single delivery and don't change its flags
-            logging.error(f"Error uploading [{delivery.gav}]: {str(exc)}")
-            raised_errors.append(exc)
+    if workers > 1 and resource_pool is None:
+        logging.warning("No connections pool given, deliveries are sent one by one")
+        workers = 1
+
+    if workers > 1:
+        errors = _send_deliveries_parallel(deliveries, client_sender, workers, resource_pool)
+    elif getattr(client_sender, "is_pipelined", lambda: False)():
+        errors = client_sender.send_deliveries(deliveries)
+    else:
+        errors = [_send_delivery(client_sender, delivery) for delivery in deliveries]
 
+    sent_deliveries = [delivery for delivery, error in zip(deliveries, errors) if error is None]
+    raised_errors = [error for error in errors if error is not None]
     return UploadResult(sent_deliveries, raised_errors)
 
 
-def process_clients_independently(deliveries, clients, context, repo_svn_fs, **kwargs):
-    """ 
-    Processes upload for each client and joins all results. Each clients gets ClientDeliverySender based on upload type (currently signed or encrypted)
+def _send_delivery(client_sender, delivery):
+    """
+    Sends single delivery
+    :return DeliveryUploadError: error raised, None if delivery was sent
+    """
+    try:
+        client_sender.send_delivery(delivery)
+        logging.info(f"Successfully sent: [{delivery.gav}]")
+        return None
+    except DeliveryUploadError as exc:
+        # ignore this single delivery and don't change its flags
+        logging.error(f"Error uploading [{delivery.gav}]: {str(exc)}")
+        return exc
+
+
+def _send_deliveries_parallel(deliveries, client_sender, workers, resource_pool):
+    """
+    Sends deliveries by several threads, each thread takes a sender with its own connections.
+    Only connections the sender requires are leased, others are not given to its copies.
+    Additional connections are taken only if the pool has free ones, fewer workers are used otherwise,
+    so messages in progress do not wait for each other's connections.
+    :return list: results of '_send_delivery' in deliveries order
+    """
+    kinds = getattr(client_sender, "required_connections", lambda: ("mvn", "ftp"))()
+    senders = queue.Queue()
+    senders.put(client_sender)
+
+    def _send(delivery):
+        sender = senders.get()
+
+        try:
+            return _send_delivery(sender, delivery)
+        finally:
+            senders.put(sender)
+            # database connection of worker thread is not reused by anyone
+            connection.close()
+
+    with ExitStack() as leases:
+        for _ in range(workers - 1):
+            with ExitStack() as _worker_leases:
+                try:
+                    _leased = dict((_kind, _worker_leases.enter_context(resource_pool.lease(_kind, timeout=0)))
+                                   for _kind in kinds)
+                except TimeoutError as _e:
+                    logging.warning(f"Connections pool is exhausted, sending by fewer workers: [{str(_e)}]")
+                    break
+
+                leases.enter_context(_worker_leases.pop_all())
+
+            senders.put(client_sender.with_context(ConnectionsContext(_leased.get("mvn"), _leased.get("ftp"))))
 
+        workers = senders.qsize()
+        logging.info(f"Sending [{len(deliveries)}] deliveries by [{workers}] workers")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dlsend") as executor:
+            futures = [executor.submit(_send, delivery) for delivery in deliveries]
+            return [future.result() for future in futures]
+
+
+def _process_client(client, deliveries, context, repo_svn_fs, dd, staging, resource_pool=None, **kwargs):
+    """
+    Sends client's deliveries to all its destinations
+
+    :param client: client to process
     :param QuerySet deliveries: all deliveries to send
-    :param list clients: list of clients to process. Each client will receive its portion of deliveries
     :param Context context:
     :param SvnFS repo_svn_fs: svn clients filesystem
-    :param **kwargs: keyword arguments for resources initialization, see worker arguments description
-    :return UploadResult: info for all deliveries
+    :param DeliveryDestinations dd: client destinations configuration
+    :param DeliveryStaging staging: shared clean deliveries content
+    :param ResourcePool resource_pool: pool to lease connections for parallel sending from
+    :return: UploadResult for client, ClientSetupError if client is misconfigured, None if client is skipped
     """
-    dd = DeliveryDestinations(config=kwargs['delivery_destinations_file'])
-    upload_results = []
-    client_errors = []
+    try:
+        upload_options = client.ftpuploadclientoptions
+        can_receive, should_encrypt = upload_options.can_receive, upload_options.should_encrypt
+    except FtpUploadClientOptions.DoesNotExist:
+        # by default client receives encrypted deliveries
+        can_receive, should_encrypt = True, True
 
-    for client in clients:
+    if not can_receive:
+        logging.warning(f"[{client.code}] is marked as unreachable, skipping")
+        return None
 
-        try:
-            upload_options = client.ftpuploadclientoptions
-            can_receive, should_encrypt = upload_options.can_receive, upload_options.should_encrypt
-        except FtpUploadClientOptions.DoesNotExist:
-            # by default client receives encrypted deliveries
-            can_receive, should_encrypt = True, True
+    try:
+        client_deliveries = list(deliveries.filter(groupid__endswith=client.code))
+        _destinations = dd.client_delivery_dest(client)
+        _arts = list(filter(None, map(lambda x: x.get("artifactory"), _destinations)))
+        _ftp_enabled = True
+        _ftp_dest = None
 
-        if not can_receive:
-            logging.warning(f"[{client.code}] is marked as unreachable, skipping")
-            continue
+        for _ftp_d in list(map(lambda x: x.get("ftp"), _destinations)):
+            # provide target folder separately if may be discovered from DeliveryDestinations
+            if not _ftp_d:
+                continue
 
-        try:
-            client_deliveries = deliveries.filter(groupid__endswith=client.code)
+            if not _ftp_d.get("enabled", True):
+                _ftp_enabled = False
 
-            logging.debug(f'Checking if additional upload to MVN is required for [{client.code}]')
+            _ftp_dest = _ftp_d
+            break
 
-            for art in list(map(lambda x: x.get("artifactory"), dd.client_delivery_dest(client))):
+        logging.info(f"FTP enabled for [{client.code}]: [{_ftp_enabled}]")
+        mvn_senders = [MvnSender(client, context, dest=art, delivery_staging=staging, resource_pool=resource_pool,
+                                 **kwargs) for art in _arts]
+        ftp_sender = None
+        ftp_setup_error = None
 
-                if not art:
-                    continue
+        if _ftp_enabled:
+            try:
+                if should_encrypt:
+                    ftp_sender = EncryptingSender(client, context, repo_svn_fs=repo_svn_fs, dest=_ftp_dest,
+                                                  delivery_staging=staging, **kwargs)
+                else:
+                    ftp_sender = SigningSender(client, context, dest=_ftp_dest, delivery_staging=staging, **kwargs)
+            except ClientSetupError as exc:
+                # deliveries are still sent to MVN, the error is reported after that
+                ftp_setup_error = exc
 
-                logging.info(f'Performing additional upload to MVN for [{client.code}], repo: [{art}]')
+        senders = mvn_senders + ([ftp_sender] if ftp_sender is not None else [])
+        art_results = [list() for _ in mvn_senders]
+        ftp_results = list()
 
-                sender = MvnSender(client, context, dest=art, **kwargs)
+        # every batch is sent to all destinations before the next one is fetched,
+        # so only clean content of the current batch is staged
+        for batch in _get_batches(client_deliveries, senders, kwargs.get('delivery_workers')):
+            # only senders constructed successfully will fetch deliveries
+            staging.expect(batch, [_sender.staging_consumer for _sender in senders])
+            logging.debug(f'Checking if additional upload to MVN is required for [{client.code}]')
+
+            for art, sender, results in zip(_arts, mvn_senders, art_results):
+                logging.info(f'Performing additional upload to MVN for [{client.code}], repo: [{art}]')
 
                 try:
-                    art_client_result = process_client_deliveries_independently(client_deliveries, sender)
+                    results.append(process_client_deliveries_independently(
+                        batch, sender, workers=kwargs.get('delivery_workers'), resource_pool=resource_pool))
                 except Exception as exc:
                     logging.error(f'Failed to upload to MVN: [{str(exc)}]')
+                finally:
+                    _release_staged(staging, batch, sender)
 
-            _ftp_enabled = True
-            _ftp_dest = None
+            if ftp_sender is not None:
+                try:
+                    ftp_results.append(process_client_deliveries_independently(
+                        batch, ftp_sender, workers=kwargs.get('delivery_workers'), resource_pool=resource_pool))
+                finally:
+                    _release_staged(staging, batch, ftp_sender)
 
-            for _ftp_d in list(map(lambda x: x.get("ftp"), dd.client_delivery_dest(client))):
-                # provide target folder separately if may be discovered from DeliveryDestinations
-                if not _ftp_d:
-                    continue
+        if ftp_setup_error is not None:
+            raise ftp_setup_error
 
-                if not _ftp_d.get("enabled", True):
-                    _ftp_enabled = False
-                    
-                _ftp_dest = _ftp_d
-                break
+        if _ftp_enabled:
+            client_result = _join_results(ftp_results)
+        else:
+            client_result = _join_results(art_results[-1] if art_results else [])
 
-            logging.info(f"FTP enabled for [{client.code}]: [{_ftp_enabled}]")
+        logging.info(f"Sent to [{client.code}]: {len(client_result.sent_deliveries)}")
+        return client_result
+    except ClientSetupError as exc:
+        logging.error(f"Client [{client.code}] has configuration errors: [{str(exc)}]")
+        return exc
 
-            if _ftp_enabled:
-                if should_encrypt:
-                    sender = EncryptingSender(client, context, repo_svn_fs=repo_svn_fs, dest=_ftp_dest, **kwargs)
-                else:
-                    sender = SigningSender(client, context, dest=_ftp_dest, **kwargs,)
 
-                client_result = process_client_deliveries_independently(client_deliveries, sender)
-            else:
-                client_result = art_client_result
+def _get_batches(deliveries, senders, workers):
+    """
+    Splits deliveries to batches sent to all destinations one after another.
+    Deliveries of a single destination are not staged, so they are sent as one batch.
+    :param list deliveries: deliveries of client
+    :param list senders: senders of all client destinations
+    :param int workers: deliveries sent in parallel by each sender
+    :return list: lists of deliveries
+    """
+    if len(senders) < 2:
+        return [deliveries] if deliveries else []
+
+    _size = max(int(workers or 1), 1)
+    return [deliveries[_i:_i + _size] for _i in range(0, len(deliveries), _size)]
+
+
+def _join_results(results):
+    """
+    :param list results: UploadResult of each batch
+    :return UploadResult: all deliveries sent and errors raised
+    """
+    return UploadResult(list(chain.from_iterable(_r.sent_deliveries for _r in results)),
+                        list(chain.from_iterable(_r.raised_errors for _r in results)))
+
+
+def _release_staged(staging, deliveries, sender):
+    """
+    Drops staging expectations of sender for deliveries it has not fetched, e.g. after its failure
+    :param DeliveryStaging staging: shared clean deliveries content
+    :param QuerySet deliveries: deliveries sender was expected to fetch
+    :param ClientDeliverySender sender: sender done with deliveries
+    """
+    for delivery in deliveries:
+        staging.release(delivery, sender.staging_consumer)
+
+
+def process_clients_independently(deliveries, clients, context, repo_svn_fs, resource_pool=None, **kwargs):
+    """ 
+    Processes upload for each client and joins all results. Each clients gets ClientDeliverySender based on upload type (currently signed or encrypted)
+
+    :param QuerySet deliveries: all deliveries to send
+    :param list clients: list of clients to process. Each client will receive its portion of deliveries
+    :param Context context:
+    :param SvnFS repo_svn_fs: svn clients filesystem
+    :param ResourcePool resource_pool: pool to lease connections for parallel sending from
+    :param **kwargs: keyword arguments for resources initialization, see worker arguments description
+    :return UploadResult: info for all deliveries
+    """
+    dd = DeliveryDestinations(config=kwargs['delivery_destinations_file'])
+    upload_results = []
+    client_errors = []
+    # each delivery is downloaded once for all its destinations
+    staging = DeliveryStaging(scratch=kwargs.get('scratch'))
+
+    try:
+        for client in clients:
+            client_result = _process_client(client, deliveries, context, repo_svn_fs, dd, staging,
+                                            resource_pool=resource_pool, **kwargs)
 
-            logging.info(f"Sent to [{client.code}]: {len(client_result.sent_deliveries)}")
-            upload_results.append(client_result)
-        except ClientSetupError as exc:
-            logging.error(f"Client [{client.code}] has configuration errors: [{str(exc)}]")
-            client_errors.append(exc)
+            if isinstance(client_result, ClientSetupError):
+                client_errors.append(client_result)
+            elif client_result:
+                upload_results.append(client_result)
+    finally:
+        staging.close()
 
     result = UploadResult(list(chain.from_iterable([res.sent_deliveries for res in upload_results])),
                           list(chain.from_iterable([res.raised_errors for res in upload_results]))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Checksums computed while content flows, without separate reading """
+
+import hashlib
+import io
+
+
+class Digests(object):
+    """
+    Several checksums of the same content updated at once
+    """
+
+    def __init__(self, algorithms=("md5", "sha1", "sha256")):
+        """
+        :param tuple algorithms: hashlib algorithm names
+        """
+        self.__hashes = {_algorithm: hashlib.new(_algorithm) for _algorithm in algorithms}
+        self.size = 0
+
+    def update(self, chunk):
+        for _hash in self.__hashes.values():
+            _hash.update(chunk)
+
+        self.size += len(chunk)
+
+    def hexdigests(self):
+        """
+        :return dict: hex digest by algorithm name
+        """
+        return {_algorithm: _hash.hexdigest() for _algorithm, _hash in self.__hashes.items()}
+
+
+class TeeReader(object):
+    """
+    Binary stream passing content read through digests. Content read again after seeking back,
+    e.g. for resumed upload, is not hashed twice; content skipped by seeking forward is read for hashing.
+    Other attributes are taken from the stream wrapped.
+    """
+
+    def __init__(self, stream, digests=None, chunk_size=1024 * 1024):
+        """
+        :param stream: binary file-like object positioned at content start
+        :param Digests digests: checksums to update, all supported ones by default
+        :param int chunk_size: bytes read at once when skipped content is hashed
+        """
+        self.__stream = stream
+        self.digests = digests or Digests()
+        self.chunk_size = chunk_size
+        self.__position = 0
+
+    def read(self, size=-1):
+        _chunk = self.__stream.read(size) if size is not None and size >= 0 else self.__stream.read()
+        _start = self.__position
+        self.__position += len(_chunk)
+
+        if self.__position > self.digests.size:
+            self.digests.update(_chunk[self.digests.size - _start:])
+
+        return _chunk
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        _position = self.__stream.seek(offset, whence)
+
+        if _position > self.digests.size:
+            self.__stream.seek(self.digests.size)
+            self.__position = self.digests.size
+
+            while self.__position < _position and self.read(min(self.chunk_size, _position - self.__position)):
+                pass
+
+        self.__position = _position
+        return _position
+
+    def tell(self):
+        return self.__position
+
+    def readable(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+""" Cache of client keys read from SVN and client directories existing on FTP """
+
+import io
+import logging
+import posixpath
+import threading
+import time
+from fs.errors import ResourceNotFound
+
+
+class ClientKeysCache(object):
+    """
+    Keeps SVN listings and file contents until clients repository revision changes
+    and FTP directories existence for a limited time.
+    Safe for usage from several threads.
+    """
+
+    def __init__(self, ftp_ttl=300, clock=time.monotonic):
+        """
+        :param float ftp_ttl: seconds FTP directory existence is trusted for, zero disables FTP caching
+        :param callable clock: monotonic time source
+        """
+        self.ftp_ttl = ftp_ttl
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        # path ==> (revision, listing or ResourceNotFound raised)
+        self.__listings = dict()
+        # path ==> (revision, content)
+        self.__contents = dict()
+        # path ==> (expiration time, existence flag)
+        self.__ftp_dirs = dict()
+        self.__counters = dict((_kind, {"hits": 0, "misses": 0}) for _kind in ["svn_listing", "svn_file", "ftp_dir"])
+
+    def open(self, svn_fs):
+        """
+        Binds SVN FS to its current revision
+        :param SvnFS svn_fs: FS object pointing to repository root
+        :return: read-only FS-like view with 'listdir', 'open' and 'opendir' methods cached by revision.
+                 If revision can not be detected the view reads from 'svn_fs' directly.
+        """
+        return _RevisionView(self, svn_fs, get_svn_revision(svn_fs), "")
+
+    def ftp_exists(self, ftp_fs, path):
+        """
+        Checks FTP path existence, result is reused during TTL
+        :param FTPFS ftp_fs: FS object pointing to FTP root
+        :param str path: path to check
+        :return bool: whether path exists
+        """
+        if not self.ftp_ttl:
+            return ftp_fs.exists(path)
+
+        with self.__lock:
+            _cached = self.__ftp_dirs.get(path)
+
+            if _cached is not None and _cached[0] > self.__clock():
+                self.__count("ftp_dir", "hits")
+                return _cached[1]
+
+            self.__count("ftp_dir", "misses")
+
+        _exists = ftp_fs.exists(path)
+
+        with self.__lock:
+            self.__ftp_dirs[path] = (self.__clock() + self.ftp_ttl, _exists)
+
+        return _exists
+
+    def forget_ftp(self, path):
+        """
+        Drops cached FTP path existence, should be called when path is found missing while in use
+        :param str path: path to forget
+        """
+        with self.__lock:
+            self.__ftp_dirs.pop(path, None)
+
+    def stats(self):
+        """
+        :return dict: cache kind ==> dict with 'hits' and 'misses' counters
+        """
+        with self.__lock:
+            return dict((_kind, dict(_counters)) for _kind, _counters in self.__counters.items())
+
+    @property
+    def hits(self):
+        return sum(_counters["hits"] for _counters in self.stats().values())
+
+    @property
+    def misses(self):
+        return sum(_counters["misses"] for _counters in self.stats().values())
+
+    def log_stats(self):
+        logging.info("Keys cache: " + ", ".join(
+            f"{_kind} [{_c['hits']}/{_c['misses']}]" for _kind, _c in self.stats().items()) + " (hits/misses)")
+
+    def _listdir(self, svn_fs, revision, path):
+        with self.__lock:
+            _cached = self.__listings.get(path)
+
+            if _cached is not None and _cached[0] == revision:
+                self.__count("svn_listing", "hits")
+                _listing = _cached[1]
+            else:
+                self.__count("svn_listing", "misses")
+                _listing = None
+
+        if _listing is None:
+            try:
+                _listing = svn_fs.listdir(path)
+            except ResourceNotFound as _e:
+                _listing = _e
+
+            with self.__lock:
+                self.__listings[path] = (revision, _listing)
+
+        if isinstance(_listing, ResourceNotFound):
+            raise ResourceNotFound(path) from _listing
+
+        return list(_listing)
+
+    def _readbytes(self, svn_fs, revision, path):
+        with self.__lock:
+            _cached = self.__contents.get(path)
+
+            if _cached is not None and _cached[0] == revision:
+                self.__count("svn_file", "hits")
+                return _cached[1]
+
+            self.__count("svn_file", "misses")
+
+        with svn_fs.open(path, mode="rb") as _file:
+            _content = _file.read()
+
+        with self.__lock:
+            self.__contents[path] = (revision, _content)
+
+        return _content
+
+    def __count(self, kind, counter):
+        self.__counters[kind][counter] += 1
+
+
+class _RevisionView(object):
+    """
+    Read-only part of FS interface used for keys reading, bound to SVN revision
+    """
+
+    def __init__(self, cache, svn_fs, revision, prefix):
+        self.__cache = cache
+        self.__svn_fs = svn_fs
+        self.revision = revision
+        self.__prefix = prefix
+
+    def __path(self, path):
+        return posixpath.join(self.__prefix, path.lstrip(posixpath.sep)).rstrip(posixpath.sep) or posixpath.sep
+
+    def listdir(self, path):
+        if self.revision is None:
+            return self.__svn_fs.listdir(self.__path(path))
+
+        return self.__cache._listdir(self.__svn_fs, self.revision, self.__path(path))
+
+    def opendir(self, path):
+        # directory existence is checked the same way FS does
+        self.listdir(path)
+        return _RevisionView(self.__cache, self.__svn_fs, self.revision, self.__path(path))
+
+    def open(self, path, mode="r", **options):
+        if mode != "rb":
+            raise ValueError(f"Unsupported mode for cached SVN read: [{mode}]")
+
+        if self.revision is None:
+            return self.__svn_fs.open(self.__path(path), mode=mode, **options)
+
+        return io.BytesIO(self.__cache._readbytes(self.__svn_fs, self.revision, self.__path(path)))
+
+
+def get_svn_revision(svn_fs):
+    """
+    :param SvnFS svn_fs: FS object pointing to repository root
+    :return int: current revision of the repository, None if FS has no revisions
+    """
+    try:
+        return svn_fs.getinfo(posixpath.sep, namespaces=["svn"]).get("svn", "revision")
+    except Exception as _e:
+        logging.warning(f"Unable to get SVN revision: [{str(_e)}]")
+        return None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+""" Bounded concurrent processing of queue messages with per-client serialization """
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ClientMessageDispatcher(object):
+    """
+    Runs queue messages on a bounded pool of worker threads.
+    Messages for different clients are processed in parallel, while messages for the same client
+    are processed one after another in the order they were submitted.
+    Several messages submitted together are processed with single handler call.
+    """
+
+    def __init__(self, handler, finisher, workers=1, coalesce=False):
+        """
+        :param callable handler: called with client code, raises an exception if processing failed
+        :param callable finisher: called with (msg_id, status, message) as soon as message processing is completed
+        :param int workers: maximum number of handler calls accepted simultaneously
+        :param bool coalesce: join messages waiting for the same client into single handler call
+        """
+        if workers < 1:
+            raise ValueError(f"Workers count should be positive: [{workers}]")
+
+        self.__handler = handler
+        self.__finisher = finisher
+        self.__workers = workers
+        self.__coalesce = coalesce
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dlupload")
+        self.__condition = threading.Condition()
+        # client code ==> groups of message ids waiting for currently running group of the same client
+        self.__waiting = dict()
+        # message groups accepted but not finished yet, including waiting ones
+        self.__accepted = 0
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def free_capacity(self):
+        """
+        :return int: number of message groups which may be accepted now
+        """
+        with self.__condition:
+            return max(0, self.__workers - self.__accepted)
+
+    def takes_capacity(self, client_code):
+        """
+        :param str client_code: client code from messages
+        :return bool: whether messages for client would be accepted as a new group instead of joining waiting one
+        """
+        with self.__condition:
+            return not (self.__coalesce and self.__waiting.get(client_code))
+
+    def wait_for_capacity(self, timeout=None):
+        """
+        Blocks until one more message may be accepted
+        :param float timeout: seconds to wait, None means forever
+        :return bool: whether capacity is available
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__accepted < self.__workers, timeout)
+
+    def submit(self, client_code, *msg_ids):
+        """
+        Accepts messages for processing. Does not block: caller is responsible for capacity check.
+        :param str client_code: client code from messages
+        :param msg_ids: message identifiers to be passed to finisher, all of them are processed with single handler call
+        """
+        msg_ids = list(msg_ids)
+
+        with self.__condition:
+            _waiting = self.__waiting.get(client_code)
+
+            if _waiting is not None:
+                logging.debug(f"Client [{client_code}] is being processed, messages {msg_ids} will wait")
+
+                if self.__coalesce and _waiting:
+                    # next run starts after these messages arrived, so it covers them as well
+                    _waiting[-1].extend(msg_ids)
+                else:
+                    self.__accepted += 1
+                    _waiting.append(msg_ids)
+
+                return
+
+            self.__accepted += 1
+            self.__waiting[client_code] = deque()
+
+        self.__executor.submit(self.__process_client, client_code, msg_ids)
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting messages
+        :param bool wait: wait for all accepted messages to finish
+        """
+        self.__executor.shutdown(wait=wait)
+
+    def __process_client(self, client_code, msg_ids):
+        """
+        Processes messages and all messages for the same client arrived while they were running
+        """
+        while msg_ids is not None:
+            self.__process_messages(client_code, msg_ids)
+
+            with self.__condition:
+                self.__accepted -= 1
+                _waiting = self.__waiting[client_code]
+
+                if _waiting:
+                    msg_ids = _waiting.popleft()
+                else:
+                    del self.__waiting[client_code]
+                    msg_ids = None
+
+                self.__condition.notify_all()
+
+    def __process_messages(self, client_code, msg_ids):
+        """
+        Runs handler once for group of messages and reports its result to finisher for each message. Never raises.
+        """
+        logging.debug(f"Processing messages {msg_ids} for client [{client_code}]")
+        status, message = 'P', None
+
+        try:
+            self.__handler(client_code)
+        except Exception as e:
+            logging.exception(e)
+            status, message = 'F', str(e)
+
+        for _msg_id in msg_ids:
+            try:
+                self.__finisher(_msg_id, status, message)
+            except Exception as e:
+                logging.error(f"Unable to finish message [{_msg_id}]: [{str(e)}]")
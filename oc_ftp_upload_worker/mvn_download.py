@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+""" Downloads of large artifacts from MVN by parts over several connections """
+
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fs.errors import ResourceNotFound
+from oc_cdtapi.NexusAPI import NexusAPIError
+from .mvn_transfer import get_headers_sha1
+from .integrity import Digests
+
+
+class RangesNotSupported(Exception):
+    """
+    Repository ignored Range request and sent whole content
+    """
+    pass
+
+
+def download_artifact(nexus_api, gav, path, md5=None, connections=4, part_size=16 * 1024 * 1024,
+                      chunk_size=1024 * 1024):
+    """
+    Downloads artifact to local file. If repository accepts byte ranges and artifact is large enough,
+    file is preallocated and its parts are requested simultaneously, first part is read from the response
+    telling artifact size. Content assembled from parts is verified by size and checksums known:
+    the one given and ones told by repository. Single stream is used if ranges are not supported or
+    assembled content does not match.
+    :param NexusAPI nexus_api: client of repository to download from
+    :param str gav: artifact GAV
+    :param str path: local file path, overwritten
+    :param str md5: checksum registered for artifact, if known
+    :param int connections: maximal number of parts requested simultaneously, 1 disables ranges
+    :param int part_size: minimal part size, smaller artifacts are downloaded by single stream
+    :param int chunk_size: bytes read and written at once
+    :return dict: hex digests of content downloaded by algorithm name: 'md5', 'sha1' and 'sha256'
+    """
+    _response = _request(nexus_api, gav)
+
+    try:
+        _size = _get_ranged_size(_response)
+        _parts = min(connections, _size // part_size) if _size else 0
+
+        if _parts > 1:
+            try:
+                _download_parts(nexus_api, gav, _response, path, _size, _parts, chunk_size)
+                _digests = _verify_parts(path, gav, _size, md5, _response.headers)
+                logging.debug(f"[{gav}] downloaded by [{_parts}] parts")
+                return _digests
+            except RangesNotSupported:
+                logging.info(f"[{gav}] repository does not support ranges, downloading by single stream")
+            except NexusAPIError as _e:
+                logging.warning(f"[{gav}] downloading by parts failed, downloading by single stream: {_e}")
+
+            _response.close()
+            _response = _request(nexus_api, gav)
+
+        _digests = Digests()
+
+        with open(path, mode="wb") as _file:
+            for _chunk in _response.iter_content(chunk_size):
+                _digests.update(_chunk)
+                _file.write(_chunk)
+
+        return _digests.hexdigests()
+    finally:
+        _response.close()
+
+
+def get_artifact_size(nexus_api, gav):
+    """
+    Asks repository for artifact size by requesting its first byte only
+    :param NexusAPI nexus_api: client of repository
+    :param str gav: artifact GAV
+    :return int: artifact size, None if repository did not tell it
+    """
+    _response = _request(nexus_api, gav, headers={"Range": "bytes=0-0"})
+
+    try:
+        if _response.status_code == 206:
+            _match = re.match(r"bytes 0-0/(\d+)$", _response.headers.get("Content-Range", ""))
+            # single byte is read to let the connection be reused
+            _response.content
+            return int(_match.group(1)) if _match else None
+
+        if _response.headers.get("Content-Encoding") or not _response.headers.get("Content-Length"):
+            return None
+
+        return int(_response.headers["Content-Length"])
+    finally:
+        _response.close()
+
+
+def _request(nexus_api, gav, headers=None):
+    """
+    :return requests.Response: response with content not read yet
+    """
+    try:
+        return nexus_api.cat(gav, response=True, stream=True, headers=headers)
+    except NexusAPIError as _e:
+        if _e.code == 404:
+            raise ResourceNotFound(gav) from _e
+
+        raise
+
+
+def _get_ranged_size(response):
+    """
+    :return int: content size if it may be requested by ranges, None otherwise
+    """
+    if response.status_code != 200 or response.headers.get("Accept-Ranges", "").lower() != "bytes":
+        return None
+
+    # size of encoded content is not the size of the artifact
+    if response.headers.get("Content-Encoding") or not response.headers.get("Content-Length"):
+        return None
+
+    return int(response.headers["Content-Length"])
+
+
+def _download_parts(nexus_api, gav, response, path, size, parts, chunk_size):
+    """
+    Writes parts of preallocated file simultaneously, the first one is read from response given
+    """
+    _bounds = [size * _i // parts for _i in range(parts + 1)]
+
+    with open(path, mode="wb") as _file:
+        os.truncate(_file.fileno(), size)
+
+        with ThreadPoolExecutor(max_workers=parts - 1) as _executor:
+            _futures = [_executor.submit(_download_part, nexus_api, gav, _file.fileno(), _start, _end, chunk_size)
+                        for _start, _end in zip(_bounds[1:-1], _bounds[2:])]
+
+            try:
+                _write_part(response.raw, _file.fileno(), 0, _bounds[1], chunk_size)
+            finally:
+                # any part failure fails the whole download
+                for _future in _futures:
+                    _future.result()
+
+
+def _download_part(nexus_api, gav, fd, start, end, chunk_size):
+    """
+    Requests bytes from start to end, exclusive, and writes them to file at the same offset
+    """
+    _response = _request(nexus_api, gav, headers={"Range": f"bytes={start}-{end - 1}"})
+
+    try:
+        if _response.status_code != 206:
+            raise RangesNotSupported(gav)
+
+        if not _response.headers.get("Content-Range", "").startswith(f"bytes {start}-{end - 1}/"):
+            raise NexusAPIError(code=_response.status_code, url=_response.url, resp=_response,
+                                text=f"[{gav}] wrong range [{_response.headers.get('Content-Range')}] "
+                                     f"instead of [{start}-{end - 1}]")
+
+        _write_part(_response.raw, fd, start, end, chunk_size)
+
+        if _response.raw.read(1):
+            raise NexusAPIError(code=_response.status_code, url=_response.url, resp=_response,
+                                text=f"[{gav}] range [{start}-{end - 1}] is longer than requested")
+    finally:
+        _response.close()
+
+
+def _write_part(stream, fd, start, end, chunk_size):
+    """
+    Copies content from stream to file at offsets from start to end, exclusive
+    """
+    _offset = start
+
+    while _offset < end:
+        _chunk = stream.read(min(chunk_size, end - _offset))
+
+        if not _chunk:
+            raise NexusAPIError(text=f"Range [{start}-{end - 1}] ended at [{_offset}]")
+
+        os.pwrite(fd, _chunk, _offset)
+        _offset += len(_chunk)
+
+
+def _verify_parts(path, gav, size, md5, headers):
+    """
+    Checks content assembled from parts against its size and checksums given and told by repository.
+    Parts are written out of order, so content is read once more to hash it.
+    :return dict: hex digests of content by algorithm name
+    """
+    _digests = Digests()
+
+    with open(path, mode="rb") as _file:
+        for _chunk in iter(lambda: _file.read(1024 * 1024), b""):
+            _digests.update(_chunk)
+
+    _hexdigests = _digests.hexdigests()
+    _expected = {
+            "size": (str(size), str(_digests.size)),
+            "MD5": ((md5 or "").lower(), _hexdigests["md5"]),
+            "repository MD5": ((headers.get("X-Checksum-Md5") or "").lower(), _hexdigests["md5"]),
+            "repository SHA-1": (get_headers_sha1(headers), _hexdigests["sha1"])}
+
+    for _name, (_expected_value, _actual_value) in _expected.items():
+        if _expected_value and _actual_value != _expected_value:
+            raise NexusAPIError(text=f"[{gav}] {_name} [{_actual_value}] instead of [{_expected_value}]")
+
+    return _hexdigests
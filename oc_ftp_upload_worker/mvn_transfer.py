@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+""" Uploads to external MVN repository skipping content present there already """
+
+import hashlib
+import logging
+import posixpath
+import re
+from oc_cdtapi.NexusAPI import NexusAPIError
+
+_SHA1_PATTERN = re.compile(r"(?<![0-9a-f])[0-9a-f]{40}(?![0-9a-f])")
+_MD5_PATTERN = re.compile(r"(?<![0-9a-f])[0-9a-f]{32}(?![0-9a-f])")
+
+
+def get_sha1(data, chunk_size=1024 * 1024):
+    """
+    :param data: binary file-like object, read from the beginning and rewound then
+    :return tuple: size and SHA-1 hex digest of content
+    """
+    _hash = hashlib.sha1()
+    _size = 0
+    data.seek(0)
+
+    for _chunk in iter(lambda: data.read(chunk_size), b""):
+        _hash.update(_chunk)
+        _size += len(_chunk)
+
+    data.seek(0)
+    return _size, _hash.hexdigest()
+
+
+def get_headers_sha1(headers):
+    """
+    :param headers: case-insensitive mapping of HTTP response headers
+    :return str: SHA-1 hex digest of artifact content, None if headers do not tell it
+    """
+    # Artifactory and Nexus 3 headers, Nexus 2 gives it as ETag '{SHA1{...}}'
+    for _value in [headers.get("X-Checksum-Sha1"), headers.get("ETag")]:
+        _match = _SHA1_PATTERN.search(str(_value or "").lower())
+
+        if _match:
+            return _match.group(0)
+
+    return None
+
+
+def get_headers_md5(headers):
+    """
+    :param headers: case-insensitive mapping of HTTP response headers
+    :return str: MD5 hex digest of artifact content, None if headers do not tell it
+    """
+    _match = _MD5_PATTERN.search(str(headers.get("X-Checksum-Md5") or "").lower())
+    return _match.group(0) if _match else None
+
+
+def get_response_sha1(response):
+    """
+    Finds SHA-1 of artifact content in repository response
+    :param requests.Response response: response to HEAD or PUT request
+    :return str: SHA-1 hex digest, None if response does not tell it
+    """
+    _sha1 = get_headers_sha1(response.headers)
+
+    if _sha1:
+        return _sha1
+
+    # Artifactory deploy response
+    try:
+        _sha1 = response.json().get("checksums", dict()).get("sha1")
+    except (ValueError, AttributeError):
+        return None
+
+    return _sha1.lower() if _sha1 else None
+
+
+def is_uploaded(nexus_api, url, size, sha1):
+    """
+    Checks whether artifact with the same content is in repository already.
+    Checksum file is requested only if HEAD response does not tell SHA-1.
+    :param NexusAPI nexus_api: client of external repository
+    :param str url: artifact URL
+    :param int size: local content size
+    :param str sha1: local content SHA-1
+    :return bool: True if remote artifact is identical to local one
+    """
+    _response = nexus_api.web.head(url, allow_redirects=True)
+
+    if _response.status_code != 200:
+        return False
+
+    _remote_size = _response.headers.get("Content-Length")
+
+    if _remote_size is not None and int(_remote_size) != size:
+        return False
+
+    _remote_sha1 = get_response_sha1(_response)
+
+    if _remote_sha1 is None:
+        _response = nexus_api.web.get(url + ".sha1")
+
+        if _response.status_code != 200:
+            return False
+
+        _match = _SHA1_PATTERN.search(_response.text.lower())
+        _remote_sha1 = _match.group(0) if _match else None
+
+    return _remote_sha1 == sha1
+
+
+def upload_artifact(nexus_api, gav, repo, data):
+    """
+    Uploads artifact unless identical one is in repository already.
+    Upload is verified by response itself: its status and checksum if repository returns one.
+    :param NexusAPI nexus_api: client of external repository
+    :param str gav: artifact GAV
+    :param str repo: repository to upload to
+    :param data: binary file-like object with artifact content
+    :return bool: False if upload was skipped
+    """
+    _size, _sha1 = get_sha1(data)
+    _url = nexus_api.gav_get_url(gav, repo=_get_repo_id(repo))
+
+    if is_uploaded(nexus_api, _url, _size, _sha1):
+        logging.info(f"Identical [{gav}] is in [{repo}] already, skipping")
+        return False
+
+    _verify_upload(nexus_api.upload(gav, repo=repo, data=data), _url, gav, repo, _sha1)
+    return True
+
+
+def stream_artifact(nexus_api, gav, repo, source, chunk_size=64 * 1024):
+    """
+    Uploads artifact content read from another repository without local copy, only a chunk is kept in memory.
+    Upload is skipped if source tells size and SHA-1 of content and identical artifact is in repository already.
+    Content is verified by SHA-1 computed on the way: against source checksum and upload response one,
+    if repositories give them.
+    :param NexusAPI nexus_api: client of external repository
+    :param str gav: artifact GAV
+    :param str repo: repository to upload to
+    :param source: binary stream of artifact content, 'headers' of HTTP response are used if it has them
+    :param int chunk_size: bytes read and sent at once
+    :return bool: False if upload was skipped
+    """
+    _headers = getattr(source, "headers", None) or dict()
+    # size of encoded content is not the size of the artifact
+    _size = int(_headers["Content-Length"]) \
+        if _headers.get("Content-Length") and not _headers.get("Content-Encoding") else None
+    _source_sha1 = get_headers_sha1(_headers)
+    _url = nexus_api.gav_get_url(gav, repo=_get_repo_id(repo))
+
+    if _size is not None and _source_sha1 and is_uploaded(nexus_api, _url, _size, _source_sha1):
+        logging.info(f"Identical [{gav}] is in [{repo}] already, skipping")
+        return False
+
+    _reader = HashingReader(source, size=_size, chunk_size=chunk_size)
+    _response = nexus_api.upload(gav, repo=repo, data=_reader)
+
+    if _source_sha1 and _source_sha1 != _reader.sha1 or _size is not None and _size != _reader.size:
+        raise NexusAPIError(code=_response.status_code, url=_url, resp=_response,
+                            text=f"[{gav}] corrupted while streaming: SHA-1 [{_reader.sha1}] instead of "
+                                 f"[{_source_sha1}], size [{_reader.size}] instead of [{_size}]")
+
+    _verify_upload(_response, _url, gav, repo, _reader.sha1)
+    return True
+
+
+def remove_artifact(nexus_api, gav, repo):
+    """
+    Removes artifact uploaded already, e.g. found damaged after upload
+    :param NexusAPI nexus_api: client of external repository
+    :param str gav: artifact GAV
+    :param str repo: repository artifact is in
+    """
+    _url = nexus_api.gav_get_url(gav, repo=_get_repo_id(repo))
+    _response = nexus_api.web.delete(_url)
+
+    if _response.status_code not in [200, 202, 204, 404]:
+        raise NexusAPIError(code=_response.status_code, url=_url, resp=_response,
+                            text=f"MVN removal failed for [{gav}], repo: [{repo}]")
+
+
+class HashingReader(object):
+    """
+    Iterates over stream by chunks of bounded size computing SHA-1 of content passed
+    """
+
+    def __init__(self, stream, size=None, chunk_size=64 * 1024):
+        """
+        :param stream: binary file-like object
+        :param int size: content size if known, HTTP body is sent chunked otherwise
+        :param int chunk_size: bytes read at once
+        """
+        self.__stream = stream
+        self.__expected_size = size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.__hash = hashlib.sha1()
+
+    @property
+    def sha1(self):
+        return self.__hash.hexdigest()
+
+    def __len__(self):
+        # zero makes HTTP body chunked
+        return self.__expected_size or 0
+
+    def __bool__(self):
+        # reader of unknown size is not empty
+        return True
+
+    def __iter__(self):
+        while True:
+            _chunk = self.read(self.chunk_size)
+
+            if not _chunk:
+                return
+
+            yield _chunk
+
+    def read(self, size=-1):
+        _chunk = self.__stream.read(size) if size is not None and size >= 0 else self.__stream.read()
+        self.__hash.update(_chunk)
+        self.size += len(_chunk)
+        return _chunk
+
+
+def _verify_upload(response, url, gav, repo, sha1):
+    """
+    Checks upload by response only: its status and checksum if repository returns it
+    """
+    if response.status_code not in [200, 201, 204]:
+        raise NexusAPIError(code=response.status_code, url=url, resp=response,
+                            text=f"MVN uploading failed for [{gav}], repo: [{repo}]")
+
+    _uploaded_sha1 = get_response_sha1(response)
+
+    if _uploaded_sha1 is not None and _uploaded_sha1 != sha1:
+        raise NexusAPIError(code=response.status_code, url=url, resp=response,
+                            text=f"MVN uploading corrupted [{gav}]: SHA-1 [{_uploaded_sha1}] instead of [{sha1}]")
+
+
+def _get_repo_id(repo):
+    """
+    Repository may be given as 'repositories/id/sub', 'NexusAPI.upload' uses 'id' only then
+    """
+    if repo.startswith("repositories" + posixpath.sep):
+        return repo.split(posixpath.sep)[1]
+
+    return repo
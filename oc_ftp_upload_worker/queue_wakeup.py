@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+""" Waiting strategies for db queue main loop: PostgreSQL notifications and adaptive polling """
+
+import logging
+import select
+import time
+
+
+# PgQAPI gives out messages not earlier than this number of seconds after their creation
+CLAIM_DELAY = 60
+
+
+class BackoffPoller(object):
+    """
+    Produces intervals between queue polls: grows from minimum to maximum while queue stays empty.
+    Polls may be scheduled for moments when messages known to be enqueued become available.
+    """
+
+    def __init__(self, min_interval, max_interval, factor=2, clock=time.monotonic):
+        """
+        :param float min_interval: first interval after activity, seconds
+        :param float max_interval: interval upper limit, seconds
+        :param float factor: interval multiplier applied after each empty poll
+        :param callable clock: monotonic time source, seconds
+        """
+        if min_interval < 0 or max_interval < min_interval:
+            raise ValueError(f"Invalid poll intervals: [{min_interval}] - [{max_interval}]")
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.clock = clock
+        self.__current = min_interval
+        # moments of scheduled polls, ascending
+        self.__expected = list()
+
+    def reset(self):
+        """
+        Returns to minimal interval, should be called when activity detected
+        """
+        self.__current = self.min_interval
+
+    def expect(self, delay):
+        """
+        Schedules a poll, e.g. for the moment message notified about may be taken
+        :param float delay: seconds from now
+        """
+        self.__expected.append(self.clock() + delay)
+        self.__expected.sort()
+
+    def next_interval(self):
+        """
+        :return float: seconds to wait before next poll, not longer than until the nearest scheduled one
+        """
+        _interval = self.__current
+        self.__current = min(self.__current * self.factor, self.max_interval)
+        _now = self.clock()
+        # scheduled polls already done
+        self.__expected = [_moment for _moment in self.__expected if _moment > _now]
+
+        if self.__expected:
+            _interval = min(_interval, self.__expected[0] - _now)
+
+        return _interval
+
+
+class SleepWaiter(object):
+    """
+    Plain sleep, used when no notification source configured
+    """
+
+    def wait(self, timeout):
+        """
+        :param float timeout: seconds to sleep
+        :return bool: always False since nothing can interrupt the sleep
+        """
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class PgNotificationWaiter(object):
+    """
+    Blocks on PostgreSQL LISTEN channel until notification arrives or timeout expires.
+    Connection given is used exclusively for listening and should be in autocommit mode.
+    """
+
+    def __init__(self, connection, channel):
+        """
+        :param connection: psycopg2 connection (or any object with 'cursor', 'poll', 'fileno' and 'notifies')
+        :param str channel: notification channel name
+        """
+        if not channel:
+            raise ValueError("Notification channel is not set")
+
+        self.__connection = connection
+        self.channel = channel
+        _quoted = '"%s"' % channel.replace('"', '""')
+        logging.debug(f"Listening on [{channel}]")
+
+        with self.__connection.cursor() as _cursor:
+            _cursor.execute(f"LISTEN {_quoted}")
+
+    def wait(self, timeout):
+        """
+        :param float timeout: seconds to wait for notification
+        :return bool: True if notification was received
+        """
+        # notifications may arrive together with other server messages already read
+        if self.__drain():
+            return True
+
+        _readable, _, _ = select.select([self.__connection], [], [], timeout)
+
+        if not _readable:
+            return False
+
+        return self.__drain()
+
+    def __drain(self):
+        """
+        Reads pending server messages and forgets received notifications
+        :return bool: whether any notification was received
+        """
+        self.__connection.poll()
+        _notifies = self.__connection.notifies
+
+        if not _notifies:
+            return False
+
+        logging.debug(f"Notifications received: [{len(_notifies)}]")
+        del _notifies[:]
+        return True
+
+    def close(self):
+        try:
+            self.__connection.close()
+        except Exception as _e:
+            logging.error(f"Unable to close listening connection: [{str(_e)}]")
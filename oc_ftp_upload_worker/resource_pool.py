@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+""" Long-lived connections to external systems shared between messages """
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from fs.errors import ResourceNotFound
+from fs.tempfs import TempFS
+from oc_pyfs.NexusFS import NexusFS
+from oc_cdtapi.NexusAPI import NexusAPI, NexusAPIError
+from .fs_clients import get_svn_fs_client, get_ftp_fs_client, get_smtp_client
+
+
+class ResourcePool(object):
+    """
+    Keeps idle connections of several kinds and leases them exclusively.
+    Connection is checked before reuse and closed when idle or living too long.
+    Number of connections of a kind may be limited, lease waits for a free one then.
+    """
+
+    class _Entry(object):
+
+        def __init__(self, resource, created):
+            self.resource = resource
+            self.created = created
+            self.last_used = created
+
+    def __init__(self, idle_timeout=300, max_age=3600, clock=time.monotonic):
+        """
+        :param float idle_timeout: seconds idle connection is kept for
+        :param float max_age: seconds after creation connection is recycled after
+        :param callable clock: monotonic time source
+        """
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.__clock = clock
+        self.__lock = threading.Condition()
+        self.__kinds = dict()
+        self.__limits = dict()
+        self.__sizes = dict()
+        self.__idle = dict()
+        self.__leased = dict()
+        self.__closed = False
+
+    def register(self, kind, factory, check=None, reset=None, close=None, max_size=None):
+        """
+        Describes how to handle connections of a kind
+        :param str kind: connection kind name
+        :param callable factory: creates new connection, no arguments
+        :param callable check: returns False or raises if connection given is not usable anymore
+        :param callable reset: cleans connection state before it is returned to the pool
+        :param callable close: closes connection given, 'close' method is called by default
+        :param int max_size: maximum number of open connections of a kind, idle and leased ones, unlimited by default
+        """
+        self.__kinds[kind] = (factory, check, reset, close)
+        self.__limits[kind] = max_size
+        self.__sizes.setdefault(kind, 0)
+        self.__idle.setdefault(kind, list())
+
+    def acquire(self, kind, timeout=None):
+        """
+        Takes healthy idle connection of a kind or creates new one.
+        Waits for a connection to be released if the kind is limited and all its connections are leased.
+        :param str kind: connection kind name
+        :param float timeout: seconds to wait for a free connection, forever by default, 0 not to wait
+        :return: connection object, should be given back with 'release'
+        """
+        factory, check, _, _ = self.__kinds[kind]
+        self.evict()
+
+        while True:
+            with self.__lock:
+                if not self.__lock.wait_for(lambda: self.__closed or self.__idle[kind] or not self.__is_full(kind),
+                                            timeout):
+                    raise TimeoutError(f"No free [{kind}] connection in [{timeout}] seconds")
+
+                if self.__closed:
+                    raise ValueError("Resource pool is closed")
+
+                _entry = self.__idle[kind].pop() if self.__idle[kind] else None
+
+                if _entry is None:
+                    # the place is taken before connection is created, so parallel leases do not exceed the limit
+                    self.__sizes[kind] += 1
+
+            if _entry is None:
+                break
+
+            if self.__is_healthy(kind, _entry, check):
+                break
+
+            self.__close(kind, _entry)
+
+        if _entry is None:
+            logging.debug(f"Creating new [{kind}] connection")
+
+            try:
+                _entry = self._Entry(factory(), self.__clock())
+            except BaseException:
+                self.__free(kind)
+                raise
+
+        with self.__lock:
+            # the same object may be returned by factory several times, e.g. a shared stateless client
+            self.__leased.setdefault(id(_entry.resource), list()).append(_entry)
+
+        return _entry.resource
+
+    def release(self, kind, resource):
+        """
+        Gives leased connection back to the pool
+        :param str kind: connection kind name
+        :param resource: connection returned by 'acquire'
+        """
+        _, _, reset, _ = self.__kinds[kind]
+
+        with self.__lock:
+            _entries = self.__leased[id(resource)]
+            _entry = _entries.pop()
+
+            if not _entries:
+                del self.__leased[id(resource)]
+
+        try:
+            if reset:
+                reset(resource)
+        except Exception as _e:
+            logging.error(f"Unable to reset [{kind}] connection, closing it: [{str(_e)}]")
+            self.__close(kind, _entry)
+            return
+
+        _entry.last_used = self.__clock()
+
+        with self.__lock:
+            if not self.__closed:
+                self.__idle[kind].append(_entry)
+                self.__lock.notify_all()
+                return
+
+        self.__close(kind, _entry)
+
+    @contextmanager
+    def lease(self, kind, timeout=None):
+        """
+        Context manager for acquire/release pair
+        :param str kind: connection kind name
+        :param float timeout: seconds to wait for a free connection, see 'acquire'
+        """
+        resource = self.acquire(kind, timeout=timeout)
+
+        try:
+            yield resource
+        finally:
+            self.release(kind, resource)
+
+    def evict(self):
+        """
+        Closes idle connections which are unused or live too long
+        """
+        _now = self.__clock()
+        _expired = list()
+
+        with self.__lock:
+            for kind, entries in self.__idle.items():
+                _keep = list()
+
+                for _entry in entries:
+                    if self.__is_expired(_entry, _now):
+                        _expired.append((kind, _entry))
+                    else:
+                        _keep.append(_entry)
+
+                self.__idle[kind] = _keep
+
+        for kind, _entry in _expired:
+            logging.debug(f"Evicting [{kind}] connection")
+            self.__close(kind, _entry)
+
+    def idle_count(self, kind):
+        """
+        :param str kind: connection kind name
+        :return int: number of idle connections of a kind
+        """
+        with self.__lock:
+            return len(self.__idle[kind])
+
+    def close(self):
+        """
+        Closes all idle connections. Leased ones are closed when released.
+        """
+        with self.__lock:
+            self.__closed = True
+            _idle = [(kind, _entry) for kind, entries in self.__idle.items() for _entry in entries]
+            self.__idle = {kind: list() for kind in self.__idle.keys()}
+            self.__lock.notify_all()
+
+        for kind, _entry in _idle:
+            self.__close(kind, _entry)
+
+    def __is_full(self, kind):
+        return self.__limits[kind] is not None and self.__sizes[kind] >= self.__limits[kind]
+
+    def __free(self, kind):
+        with self.__lock:
+            self.__sizes[kind] -= 1
+            self.__lock.notify_all()
+
+    def __is_expired(self, entry, now):
+        if self.idle_timeout is not None and now - entry.last_used > self.idle_timeout:
+            return True
+
+        if self.max_age is not None and now - entry.created > self.max_age:
+            return True
+
+        return False
+
+    def __is_healthy(self, kind, entry, check):
+        if self.__is_expired(entry, self.__clock()):
+            return False
+
+        if not check:
+            return True
+
+        try:
+            return bool(check(entry.resource))
+        except Exception as _e:
+            logging.debug(f"[{kind}] connection check failed: [{str(_e)}]")
+            return False
+
+    def __close(self, kind, entry):
+        _, _, _, close = self.__kinds[kind]
+        self.__free(kind)
+
+        try:
+            if close:
+                close(entry.resource)
+            else:
+                entry.resource.close()
+        except Exception as _e:
+            logging.debug(f"Unable to close [{kind}] connection: [{str(_e)}]")
+
+
+class PooledNexusFS(NexusFS):
+    """
+    NexusFS owning its preload directory.
+    Preloaded artifacts are removed on 'clean_preloaded', directory itself is removed on close.
+    """
+
+    def __init__(self, client, work_fs=None):
+        """
+        :param NexusAPI client: repository client
+        :param fs.base.FS work_fs: preload directory owned by this FS, temporary one by default
+        """
+        self.nexus_client = client
+        self.work_fs = work_fs or TempFS()
+        super().__init__(client, work_fs=self.work_fs)
+
+    def open_stream(self, gav):
+        """
+        Opens artifact content for sequential reading without preloading
+        :param str gav: artifact GAV
+        :return: file-like object, should be closed by caller
+        """
+        try:
+            _response = self.nexus_client.cat(gav, response=True, stream=True)
+        except NexusAPIError as _e:
+            if _e.code == 404:
+                raise ResourceNotFound(gav) from _e
+
+            raise
+
+        _response.raw.decode_content = True
+        return _response.raw
+
+    def clean_preloaded(self):
+        """
+        Removes artifacts loaded during previous lease, their handles should be closed already
+        """
+        for _name in self.work_fs.listdir("/"):
+            self.work_fs.remove(_name)
+
+    def close(self):
+        super().close()
+        self.work_fs.close()
+
+
+def _check_ftp(ftp_fs):
+    """
+    :param FTPFS ftp_fs: FTP connection to check
+    :return bool: whether control connection is alive
+    """
+    with ftp_fs._lock:
+        ftp_fs.ftp.voidcmd("NOOP")
+
+    return True
+
+
+def _check_smtp(smtp_client):
+    """
+    :param smtplib.SMTP smtp_client: SMTP connection to check
+    :return bool: whether server answers
+    """
+    return smtp_client.noop()[0] == 250
+
+
+def _close_smtp(smtp_client):
+    try:
+        smtp_client.quit()
+    except Exception:
+        smtp_client.close()
+
+
+def create_resource_pool(**kwargs):
+    """
+    Creates pool with SVN, MVN, FTP and SMTP connections configured from worker arguments.
+    Each message in progress holds a connection of every kind, its delivery workers take more
+    up to destination connections limits, so connections of a kind are limited by their sum.
+    :param **kwargs: keyword options, see worker command line arguments for description
+    :return ResourcePool: pool with 'svn', 'mvn', 'mvn_ext', 'ftp' and 'smtp' connection kinds
+    """
+    pool = ResourcePool(idle_timeout=float(kwargs.get('pool_idle_timeout') or 300),
+                        max_age=float(kwargs.get('pool_max_age') or 3600))
+    _workers = max(int(kwargs.get('workers') or 1), 1)
+    _ftp_connections = max(int(kwargs.get('ftp_max_connections') or 1), 1)
+    _mvn_ext_connections = max(int(kwargs.get('mvn_ext_max_connections') or 1), 1)
+
+    pool.register("svn", lambda: get_svn_fs_client(
+        url=kwargs['svn_clients_url'],
+        user=kwargs['svn_clients_user'],
+        password=kwargs['svn_clients_password']),
+        max_size=max(_workers, int(kwargs.get('sweep_workers') or 1)))
+
+    pool.register("mvn", lambda: PooledNexusFS(NexusAPI(
+        root=kwargs['mvn_int_url'],
+        user=kwargs['mvn_int_user'],
+        auth=kwargs['mvn_int_password'],
+        download_repo=kwargs['mvn_download_repo']),
+        work_fs=kwargs['scratch'].open(identifier="dlmvn") if kwargs.get('scratch') else None),
+        reset=lambda nexus_fs: nexus_fs.clean_preloaded(),
+        # deliveries are downloaded by workers of both FTP and MVN destinations
+        max_size=_workers * max(_ftp_connections, _mvn_ext_connections))
+
+    # external repository is needed by MVN destinations only, so the client is created on first lease
+    pool.register("mvn_ext", lambda: create_external_nexus(**kwargs), close=lambda nexus_api: nexus_api.web.close(),
+                  max_size=_workers * _mvn_ext_connections)
+
+    pool.register("ftp", lambda: get_ftp_fs_client(
+        url=kwargs['ftp_url'],
+        user=kwargs['ftp_user'],
+        password=kwargs['ftp_password']),
+        check=_check_ftp, max_size=_workers * _ftp_connections)
+
+    pool.register("smtp", lambda: get_smtp_client(
+        url=kwargs['smtp_url'],
+        user=kwargs['smtp_user'],
+        password=kwargs['smtp_password']),
+        check=_check_smtp, close=_close_smtp, max_size=_workers)
+
+    return pool
+
+
+def create_external_nexus(**kwargs):
+    """
+    :param **kwargs: keyword options, see worker command line arguments for description
+    :return NexusAPI: client of external MVN repository, its HTTP session keeps connections alive
+    """
+    return NexusAPI(root=kwargs["mvn_ext_url"], user=kwargs["mvn_ext_user"], auth=kwargs["mvn_ext_password"])
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+""" Local disk space for delivery content being downloaded and processed """
+
+import atexit
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from fs.tempfs import TempFS
+from .upload_errors import ScratchSpaceError
+
+
+class ScratchSpace(object):
+    """
+    Work directories of deliveries placed under one configurable root, so files may be moved and linked
+    between them instead of being copied. Small deliveries may be placed to a separate fast directory, e.g. tmpfs.
+    Space is reserved for each directory before its content is downloaded: new directory is refused if disk
+    would not fit it together with space still expected by directories already opened by this process.
+    Directories of the process are kept in its session directory locked while the process lives,
+    session directories left by crashed or restarted processes are removed on first use.
+    """
+
+    def __init__(self, root=None, fast_root=None, fast_max_bytes=0, min_free_bytes=0):
+        """
+        :param str root: directory for work directories, system temporary directory by default
+        :param str fast_root: directory for work directories of small deliveries, not used if not given
+        :param int fast_max_bytes: largest reservation placed to fast_root
+        :param int min_free_bytes: disk space left free by reservations
+        """
+        self.root = root or tempfile.gettempdir()
+        self.fast_root = fast_root or None
+        self.fast_max_bytes = fast_max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.__lock = threading.Lock()
+        # root ==> (session directory, its locked file)
+        self.__sessions = dict()
+        self.__reservations = list()
+        self.__counters = {"opened": 0, "fast": 0, "rejected": 0}
+
+    def open(self, size=None, identifier="dlwork"):
+        """
+        Creates work directory with space reserved for its content
+        :param int size: bytes expected to be written to directory, reserved space is not checked if unknown
+        :param str identifier: part of directory name
+        :return ScratchFS: directory removed and its reservation released on close
+        :raises ScratchSpaceError: if disk has not enough free space
+        """
+        _size = size or 0
+
+        with self.__lock:
+            _root = self.__choose_root(_size)
+
+            if _root is None:
+                self.__counters["rejected"] += 1
+                raise ScratchSpaceError(f"Not enough free space at [{self.root}] for [{_size}] bytes")
+
+            _reservation = _Reservation(_size, os.stat(_root).st_dev)
+            _fs = ScratchFS(self, _reservation, identifier=identifier, temp_dir=self.__get_session(_root))
+            _reservation.path = _fs.getsyspath("/")
+            self.__reservations.append(_reservation)
+            self.__counters["opened"] += 1
+
+            if _root == self.fast_root:
+                self.__counters["fast"] += 1
+
+        logging.debug(f"Scratch directory [{_reservation.path}] reserved for [{_size}] bytes")
+        return _fs
+
+    def release(self, reservation):
+        """
+        Forgets space reserved for directory being closed
+        :param _Reservation reservation: reservation of closed directory
+        """
+        with self.__lock:
+            if reservation in self.__reservations:
+                self.__reservations.remove(reservation)
+
+    def stats(self):
+        """
+        :return dict: directories opened, ones placed to fast directory, ones refused and bytes reserved now
+        """
+        with self.__lock:
+            return dict(self.__counters, reserved=sum(_r.size for _r in self.__reservations))
+
+    def log_stats(self):
+        logging.info("Scratch space: " + ", ".join(f"{_k} [{_v}]" for _k, _v in self.stats().items()))
+
+    def close(self):
+        """
+        Removes session directories with all work directories still opened
+        """
+        with self.__lock:
+            _sessions = list(self.__sessions.values())
+            self.__sessions.clear()
+            self.__reservations.clear()
+
+        for _path, _lock_file in _sessions:
+            shutil.rmtree(_path, ignore_errors=True)
+            _lock_file.close()
+
+    def __choose_root(self, size):
+        """
+        Should be called under lock
+        :return str: root fitting size given, None if none fits
+        """
+        _roots = [self.root]
+
+        if self.fast_root and size and size <= self.fast_max_bytes:
+            _roots.insert(0, self.fast_root)
+
+        for _root in _roots:
+            os.makedirs(_root, exist_ok=True)
+
+            if not size or self.__get_available(_root) >= size:
+                return _root
+
+        return None
+
+    def __get_available(self, root):
+        """
+        Free disk space not expected by reservations of the same device. Should be called under lock.
+        """
+        _device = os.stat(root).st_dev
+        _expected = sum(_r.get_outstanding() for _r in self.__reservations if _r.device == _device)
+        return shutil.disk_usage(root).free - _expected - self.min_free_bytes
+
+    def __get_session(self, root):
+        """
+        Creates session directory at root on first call. Should be called under lock.
+        :return str: path to session directory
+        """
+        if root in self.__sessions:
+            return self.__sessions[root][0]
+
+        _remove_stale_sessions(root)
+        # directory gets its final name only after it is locked, so it is never taken for stale one
+        _path = tempfile.mkdtemp(prefix=".dlscratch-", dir=root)
+        _lock_file = open(os.path.join(_path, ".lock"), mode="a")
+        fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        _session = os.path.join(root, f"dlscratch-{os.getpid()}-{uuid.uuid4().hex}")
+        os.rename(_path, _session)
+        self.__sessions[root] = (_session, _lock_file)
+        return _session
+
+
+class ScratchFS(TempFS):
+    """
+    Work directory of ScratchSpace, its reservation is released on close
+    """
+
+    def __init__(self, scratch, reservation, identifier, temp_dir):
+        """
+        :param ScratchSpace scratch: space directory belongs to
+        :param _Reservation reservation: space reserved for directory
+        :param str identifier: part of directory name
+        :param str temp_dir: session directory to create directory in
+        """
+        self.__scratch = scratch
+        self.__reservation = reservation
+        super().__init__(identifier=identifier, temp_dir=temp_dir)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.__scratch.release(self.__reservation)
+
+
+class _Reservation(object):
+    """
+    Space reserved for scratch directory
+    """
+
+    def __init__(self, size, device):
+        self.size = size
+        self.device = device
+        self.path = None
+
+    def get_outstanding(self):
+        """
+        :return int: bytes reserved but not written yet, written ones are seen as taken at disk already
+        """
+        if not self.size or self.path is None:
+            return 0
+
+        _written = 0
+
+        for _path, _, _files in os.walk(self.path):
+            for _file in _files:
+                try:
+                    _written += os.path.getsize(os.path.join(_path, _file))
+                except OSError:
+                    continue
+
+        return max(0, self.size - _written)
+
+
+def _remove_stale_sessions(root):
+    """
+    Removes session directories which are not locked by their processes any more
+    """
+    for _name in os.listdir(root):
+        _path = os.path.join(root, _name)
+
+        if not _name.startswith("dlscratch-") or not os.path.isdir(_path):
+            continue
+
+        try:
+            with open(os.path.join(_path, ".lock"), mode="r") as _lock_file:
+                fcntl.flock(_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                logging.info(f"Removing scratch directory [{_path}] left by previous run")
+                shutil.rmtree(_path, ignore_errors=True)
+        except (BlockingIOError, FileNotFoundError):
+            # alive process or another one removing it
+            continue
+        except OSError as _e:
+            logging.warning(f"Unable to check scratch directory [{_path}]: [{str(_e)}]")
+
+
+default_scratch = ScratchSpace()
+# sessions of crashed processes are removed by the next ones
+atexit.register(default_scratch.close)
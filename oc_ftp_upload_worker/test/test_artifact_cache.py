@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import threading
+import unittest
+from fs.memoryfs import MemoryFS
+from fs.tempfs import TempFS
+from ..artifact_cache import ArtifactCache
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class Repository(object):
+    """
+    Source of artifacts counting downloads
+    """
+
+    def __init__(self, **artifacts):
+        self.artifacts = artifacts
+        self.downloads = list()
+        self.lock = threading.Lock()
+
+    def download(self, name):
+        def _download(fs, path):
+            with self.lock:
+                self.downloads.append(name)
+
+            fs.writebytes(path, self.artifacts[name])
+
+        return _download
+
+
+class ArtifactCacheTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_fs = TempFS()
+        self.work_fs = MemoryFS()
+        self.repository = Repository(first=b"first content", second=b"second content", third=b"third content")
+        self.cache = ArtifactCache(self.cache_fs.getsyspath("/"), max_bytes=1024)
+
+    def tearDown(self):
+        self.work_fs.close()
+        self.cache_fs.close()
+
+    def fetch(self, name, md5=None, cache=None):
+        return (cache or self.cache).fetch(f"g:{name}:1.0:zip", self.work_fs, "clean_file",
+                                           self.repository.download(name), md5=md5)
+
+    def md5(self, name):
+        return hashlib.md5(self.repository.artifacts[name]).hexdigest()
+
+    def test_downloaded_once(self):
+        self.assertFalse(self.fetch("first", md5=self.md5("first")))
+        self.assertEqual(b"first content", self.work_fs.readbytes("clean_file"))
+        self.work_fs.remove("clean_file")
+        self.assertTrue(self.fetch("first", md5=self.md5("first")))
+        self.assertEqual(b"first content", self.work_fs.readbytes("clean_file"))
+        self.assertEqual(["first"], self.repository.downloads)
+        self.assertEqual({"hits": 1, "misses": 1, "bytes_saved": 13, "bytes_downloaded": 13, "evictions": 0},
+                         self.cache.stats())
+        self.assertEqual([], self.cache_fs.listdir("tmp"))
+
+    def test_shared_between_instances(self):
+        self.fetch("first")
+        other_cache = ArtifactCache(self.cache_fs.getsyspath("/"), max_bytes=1024)
+        # content of GAV seen before is trusted when checksum is not registered
+        self.assertTrue(self.fetch("first", cache=other_cache))
+        self.assertEqual(1, len(self.repository.downloads))
+
+    def test_changed_checksum_downloaded(self):
+        self.fetch("first", md5=self.md5("first"))
+        self.repository.artifacts["first"] = b"replaced content"
+        self.assertFalse(self.fetch("first", md5=self.md5("first")))
+        self.assertEqual(b"replaced content", self.work_fs.readbytes("clean_file"))
+        self.assertTrue(self.fetch("first"))
+        self.assertEqual(2, len(self.repository.downloads))
+
+    def test_mismatch_not_cached(self):
+        self.assertFalse(self.fetch("first", md5=self.md5("second")))
+        # content is passed as is, checksum is checked later when it is sent
+        self.assertEqual(b"first content", self.work_fs.readbytes("clean_file"))
+        self.assertEqual([], self.cache_fs.listdir("objects"))
+        self.assertFalse(self.fetch("first", md5=self.md5("second")))
+        self.assertEqual(2, len(self.repository.downloads))
+
+    def test_least_recently_used_evicted(self):
+        cache = ArtifactCache(self.cache_fs.getsyspath("/"), max_bytes=30)
+        self.fetch("first", cache=cache)
+        self.fetch("second", cache=cache)
+        os.utime(self.cache_fs.getsyspath(f"objects/{self.md5('first')}"), (1, 1))
+        os.utime(self.cache_fs.getsyspath(f"objects/{self.md5('second')}"), (2, 2))
+        self.assertTrue(self.fetch("first", cache=cache))
+        self.fetch("third", cache=cache)
+        self.assertEqual(sorted([self.md5("first"), self.md5("third")]), sorted(self.cache_fs.listdir("objects")))
+        self.assertFalse(self.fetch("second", cache=cache))
+        self.assertEqual(2, cache.stats()["evictions"])
+
+    def test_damaged_entry_replaced(self):
+        self.fetch("first", md5=self.md5("first"))
+        self.cache_fs.writebytes(f"objects/{self.md5('first')}", b"first CONTENT")
+        self.assertFalse(self.fetch("first", md5=self.md5("first")))
+        self.assertEqual(b"first content", self.work_fs.readbytes("clean_file"))
+        self.assertEqual(b"first content", self.cache_fs.readbytes(f"objects/{self.md5('first')}"))
+        self.assertEqual(2, len(self.repository.downloads))
+
+    def test_download_digests_used(self):
+        def _download(fs, path):
+            fs.writebytes(path, b"first content")
+            return {"md5": self.md5("first")}
+
+        self.cache.fetch("g:first:1.0:zip", self.work_fs, "clean_file", _download)
+        self.assertEqual([self.md5("first")], self.cache_fs.listdir("objects"))
+
+    def test_too_large_not_cached(self):
+        cache = ArtifactCache(self.cache_fs.getsyspath("/"), max_bytes=10)
+        self.assertFalse(self.fetch("first", cache=cache))
+        self.assertEqual(b"first content", self.work_fs.readbytes("clean_file"))
+        self.assertEqual([], self.cache_fs.listdir("objects"))
+
+    def test_simultaneous_fetches_download_once(self):
+        results = list()
+
+        def _fetch():
+            with MemoryFS() as work_fs:
+                self.cache.fetch("g:first:1.0:zip", work_fs, "clean_file", self.repository.download("first"))
+                results.append(work_fs.readbytes("clean_file"))
+
+        threads = [threading.Thread(target=_fetch) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([b"first content"] * 4, results)
+        self.assertEqual(["first"], self.repository.downloads)
+        self.assertEqual(3, self.cache.stats()["hits"])
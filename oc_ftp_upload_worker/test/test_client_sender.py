@@ -3,14 +3,21 @@
 from . import django_settings
 import django.test
 import os
-from ..ClientDeliverySender import EncryptingSender, SigningSender, ConnectionsContext
+from ..ClientDeliverySender import EncryptingSender, SigningSender, MvnSender, ConnectionsContext
+from ..compression_policy import CompressionPolicy
+from ..artifact_cache import ArtifactCache
 from ..upload_errors import DeliveryUploadError, ClientSetupError, EnvironmentSetupError, DeliveryExistsError, DeliveryEncryptionError
 from oc_delivery_apps.dlmanager.models import Delivery, Client
+from oc_delivery_apps.checksums.controllers import CheckSumsController
+from oc_delivery_apps.checksums.models import CiTypes, LocTypes, CsTypes
 from fs.tempfs import TempFS
 from .test_keys import TestKeys
+from .test_mvn_transfer import RepositoryServer, HeadedStream
 import gnupg
+import hashlib
 from types import MethodType
 import posixpath
+import threading
 
 import logging
 logging.getLogger().propagate = False
@@ -99,6 +106,101 @@ class EncryptingSenderTestSuite(SenderTestSuite):
         delivery.refresh_from_db()
         self.assertTrue(delivery.flag_uploaded)
 
+    def test_delivery_streamed(self):
+        self.get_sender_params()
+        sender = EncryptingSender(delivery_streaming="y", **self._kwargs)
+        sender._get_clean_delivery_content = None  # regular processing must not be used
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        sender.send_delivery(delivery)
+        self.assert_sent_encrypted_content(self._kwargs.get("context")[1],
+                                           posixpath.join(self._kwargs.get("client_code"), "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp"),
+                                           "hello")
+        delivery.refresh_from_db()
+        self.assertTrue(delivery.flag_uploaded)
+
+    def test_failed_streaming_falls_back(self):
+        self.get_sender_params()
+        sender = EncryptingSender(delivery_streaming="y", **self._kwargs)
+        sender._get_streaming_command = MethodType(lambda _self, _delivery, _fs: (["false"], None), sender)
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        sender.send_delivery(delivery)
+        self.assertEqual(["SOMTEST-test_delivery-v1.0.pgp"], self._kwargs.get("context")[1].listdir(posixpath.join(self._kwargs.get("client_code"), "TO_BNK")))
+        self.assert_sent_encrypted_content(self._kwargs.get("context")[1],
+                                           posixpath.join(self._kwargs.get("client_code"), "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp"),
+                                           "hello")
+
+    def test_compression_recorded(self):
+        self.get_sender_params()
+        policy = CompressionPolicy()
+        sender = EncryptingSender(compression_policy=policy, dest={"compression": "none"}, **self._kwargs)
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        sender.send_delivery(delivery)
+        self.assert_sent_encrypted_content(self._kwargs.get("context")[1],
+                                           posixpath.join(self._kwargs.get("client_code"), "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp"),
+                                           "hello")
+        stats = policy.stats()
+        self.assertListEqual(["none"], list(stats.keys()))
+        self.assertEqual(1, stats["none"]["deliveries"])
+        self.assertEqual(len("hello"), stats["none"]["input_bytes"])
+
+    def test_deliveries_pipelined(self):
+        self.get_sender_params()
+        nexus_fs, ftp_fs = self._kwargs.get("context")
+        nexus_fs.writetext(self._kwargs["mvn_artifact"].replace(":v1.0:", ":v2.0:"), "hello")
+        sender = EncryptingSender(delivery_pipeline="y", **self._kwargs)
+        self.assertTrue(sender.is_pipelined())
+        deliveries = list()
+
+        # the last one is absent in MVN
+        for version in ["v1.0", "v2.0", "v3.0"]:
+            delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                                artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                                version=version)
+            delivery.save()
+            deliveries.append(delivery)
+
+        errors = sender.send_deliveries(deliveries)
+        self.assertEqual([None, None], errors[:2])
+        self.assertIsInstance(errors[2], DeliveryUploadError)
+        self.assertListEqual(["fetch", "process", "upload"], sorted(sender.stage_timings.keys()))
+        target_dir = posixpath.join(self._kwargs.get("client_code"), "TO_BNK")
+        self.assertEqual(sorted(["SOMTEST-test_delivery-v1.0.pgp", "SOMTEST-test_delivery-v2.0.pgp"]),
+                         sorted(ftp_fs.listdir(target_dir)))
+        self.assert_sent_encrypted_content(ftp_fs, posixpath.join(target_dir, "SOMTEST-test_delivery-v2.0.pgp"),
+                                           "hello")
+
+        for delivery, uploaded in zip(deliveries, [True, True, False]):
+            delivery.refresh_from_db()
+            self.assertEqual(uploaded, delivery.flag_uploaded)
+
+    def test_pipeline_stopped_on_unexpected_error(self):
+        self.get_sender_params()
+        sender = EncryptingSender(delivery_pipeline="y", **self._kwargs)
+
+        def _failing_process(_self, delivery, clean_file_name, work_fs):
+            raise RuntimeError("unexpected")
+
+        sender._process_delivery_content = MethodType(_failing_process, sender)
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+
+        with self.assertRaises(RuntimeError):
+            sender.send_deliveries([delivery])
+
+        delivery.refresh_from_db()
+        self.assertFalse(delivery.flag_uploaded)
+
     def test_foreign_delivery_skipped(self):
         self.get_sender_params()
         sender = EncryptingSender(**self._kwargs)
@@ -198,6 +300,89 @@ class EncryptingSenderTestSuite(SenderTestSuite):
         delivery.refresh_from_db()
         self.assertTrue(delivery.flag_uploaded)
 
+    def test_delivery_taken_from_artifact_cache(self):
+        self.get_sender_params()
+
+        with TempFS() as cache_fs:
+            artifact_cache = ArtifactCache(cache_fs.getsyspath("/"), max_bytes=1024)
+            delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                                artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                                version="v1.0")
+            delivery.save()
+            EncryptingSender(artifact_cache=artifact_cache, **self._kwargs).send_delivery(delivery)
+            ftp_path = posixpath.join(self._kwargs['client_code'], "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp")
+            self._kwargs.get('context')[1].remove(ftp_path)
+            # no download from MVN second time
+            self._kwargs.get('context')[0].remove(self._kwargs.get("mvn_artifact"))
+            EncryptingSender(artifact_cache=artifact_cache, **self._kwargs).send_delivery(delivery)
+            self.assert_sent_encrypted_content(self._kwargs.get('context')[1], ftp_path, b"hello")
+            self.assertEqual(1, artifact_cache.stats()["hits"])
+
+    def register_clean_delivery(self, delivery, content):
+        CiTypes(code="TEST", name="Test").save()
+        LocTypes(code="NXS", name="Nexus").save()
+        CsTypes(code="MD5", name="MD5").save()
+
+        CheckSumsController().add_location_checksum(hashlib.md5(content).hexdigest(), delivery.gav, "NXS", "TEST")
+
+    def test_damaged_delivery_failure(self):
+        self.get_sender_params()
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        self.register_clean_delivery(delivery, b"other")
+
+        for streaming in ["n", "y"]:
+            with self.assertRaises(DeliveryUploadError):
+                EncryptingSender(delivery_streaming=streaming, **self._kwargs).send_delivery(delivery)
+
+        self.assertEqual([], self._kwargs.get('context')[1].listdir(posixpath.join(self._kwargs['client_code'], "TO_BNK")))
+        delivery.refresh_from_db()
+        self.assertFalse(delivery.flag_uploaded)
+
+    def test_processed_delivery_registered(self):
+        self.get_sender_params()
+        LocTypes(code="FTP", name="FTP").save()
+        CsTypes(code="SHA256", name="SHA-256").save()
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        self.register_clean_delivery(delivery, b"hello")
+        ftp_path = posixpath.join(self._kwargs['client_code'], "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp")
+
+        for streaming in ["n", "y"]:
+            EncryptingSender(delivery_streaming=streaming, processed_location_type="FTP", **self._kwargs).send_delivery(delivery)
+            content = self._kwargs.get('context')[1].readbytes(ftp_path)
+            self.assertEqual(hashlib.md5(content).hexdigest(), CheckSumsController().get_location_checksum(ftp_path, "FTP"))
+            self.assertEqual(hashlib.sha256(content).hexdigest(),
+                             CheckSumsController().get_location_checksum(ftp_path, "FTP", cs_type="SHA256"))
+
+    def test_uploaded_delivery_skipped(self):
+        self.get_sender_params()
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        self.register_clean_delivery(delivery, b"hello")
+        ftp_path = posixpath.join(self._kwargs['client_code'], "TO_BNK", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp")
+        EncryptingSender(ftp_skip_identical="y", **self._kwargs).send_delivery(delivery)
+        content = self._kwargs.get('context')[1].readbytes(ftp_path)
+
+        sender = EncryptingSender(ftp_skip_identical="y", **self._kwargs)
+        # neither downloaded nor encrypted again
+        sender._get_clean_delivery_content = None
+        sender._process_delivery_content = None
+        sender.send_delivery(delivery)
+        self.assertEqual(content, self._kwargs.get('context')[1].readbytes(ftp_path))
+
+        # delivery made with other keys is replaced
+        sender = EncryptingSender(ftp_skip_identical="y", **self._kwargs)
+        sender.encryption_keys = sender.encryption_keys[-1:]
+        sender.send_delivery(delivery)
+        self.assertNotEqual(content, self._kwargs.get('context')[1].readbytes(ftp_path))
+
     def test_missing_data_subdir_failure(self):
         self.get_sender_params()
         self._kwargs.get('repo_svn_fs').removetree(posixpath.join(self._kwargs['country'], self._kwargs['client_code'], "data"))
@@ -290,6 +475,48 @@ class SigningSenderTestSuite(SenderTestSuite):
         delivery.refresh_from_db()
         self.assertTrue(delivery.flag_uploaded)
 
+    def test_delivery_sent_with_detached_signature(self):
+        self.get_sender_params()
+        ftp_fs = self._kwargs.get('context')[1]
+        target_dir = posixpath.join("PUBLIC", "CriticalPatch")
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+
+        for armor, extension in [(True, "asc"), (False, "sig")]:
+            sender = SigningSender(dest={"signature": "detached", "signature_armor": armor},
+                                   delivery_streaming="y", **self._kwargs)
+            sender.send_delivery(delivery)
+            basename = f"{self._kwargs['client_code']}-test_delivery-v1.0.zip"
+            self.assertIn(f"{basename}.{extension}", ftp_fs.listdir(target_dir))
+            # original file is uploaded unchanged
+            self.assertEqual("hello", ftp_fs.readtext(posixpath.join(target_dir, basename)))
+
+            with TempFS() as temp_fs:
+                gpg = gnupg.GPG(gnupghome=temp_fs.getsyspath(os.path.sep))
+                gpg.import_keys(TestKeys().get_key("company_pub"))
+                result = gpg.verify_data(ftp_fs.getsyspath(posixpath.join(target_dir, f"{basename}.{extension}")),
+                                         b"hello")
+
+                self.assertTrue(result.valid)
+
+            delivery.refresh_from_db()
+            self.assertTrue(delivery.flag_uploaded)
+
+    def test_delivery_streamed_signed(self):
+        self.get_sender_params()
+        sender = SigningSender(delivery_streaming="y", **self._kwargs)
+        sender._get_clean_delivery_content = None  # regular processing must not be used
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        sender.send_delivery(delivery)
+        self.assert_sent_signed_content(self._kwargs.get('context')[1],
+                    posixpath.join("PUBLIC", "CriticalPatch", f"{self._kwargs['client_code']}-test_delivery-v1.0.pgp"),
+                    b"hello")
+
     def test_criticalpatches_dir_required(self):
         self.get_sender_params()
         self._kwargs.get('context')[1].removetree(posixpath.join("PUBLIC", "CriticalPatch"))
@@ -313,3 +540,82 @@ class SigningSenderTestSuite(SenderTestSuite):
         self.get_sender_params()
         sender = SigningSender(**self._kwargs, dest={"enabled": True, "directory": posixpath.join("OTHERCLIENT", "OTHERDEST")})
         self.assertEqual(sender._get_destination_dir(), posixpath.join("OTHERCLIENT", "OTHERDEST"))
+
+
+class MvnSenderTestSuite(SenderTestSuite):
+
+    def setUp(self):
+        super().setUp()
+        self.server = RepositoryServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def get_sender_params(self):
+        self.get_basic_sender_params()
+        self._kwargs["mvn_ext_url"] = f"http://127.0.0.1:{self.server.server_address[1]}/artifactory"
+        self._kwargs["mvn_ext_user"] = "user"
+        self._kwargs["mvn_ext_password"] = "password"
+        self._kwargs["dest"] = {"target_repo": "repo"}
+
+    def send(self, sender):
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+        sender.send_delivery(delivery)
+        delivery.refresh_from_db()
+        self.assertTrue(delivery.flag_uploaded)
+        self.assertEqual([b"hello"], list(self.server.artifacts.values()))
+
+    def test_delivery_sent(self):
+        self.get_sender_params()
+        self.send(MvnSender(**self._kwargs))
+        self.assertEqual(0, self.server.requests["chunked"])
+
+    def test_delivery_streamed(self):
+        self.get_sender_params()
+        sender = MvnSender(delivery_streaming="y", **self._kwargs)
+        sender._get_clean_delivery_content = None  # regular processing must not be used
+        self.send(sender)
+        self.assertEqual(1, self.server.requests["chunked"])
+
+    def test_failed_streaming_falls_back(self):
+        self.get_sender_params()
+        self.server.corrupt_puts = 1
+        self.send(MvnSender(delivery_streaming="y", **self._kwargs))
+        # regular upload checks what the failed stream has stored
+        self.assertEqual(1, self.server.requests["chunked"])
+        self.assertEqual(1, self.server.requests["HEAD"])
+
+    def test_unconfirmed_delivery_not_streamed(self):
+        self.get_sender_params()
+        sender = MvnSender(delivery_streaming="y", **self._kwargs)
+        sender._get_registered_md5 = lambda delivery: hashlib.md5(b"hello").hexdigest()
+        # internal MVN does not tell MD5 of the stream
+        self.send(sender)
+        self.assertEqual(0, self.server.requests["chunked"])
+
+    def test_damaged_stream_removed(self):
+        self.get_sender_params()
+        sender = MvnSender(delivery_streaming="y", **self._kwargs)
+        registered = hashlib.md5(b"registered").hexdigest()
+        sender._get_registered_md5 = lambda delivery: registered
+        sender._open_clean_stream = lambda delivery: HeadedStream(b"hello", {"X-Checksum-Md5": registered})
+        delivery = Delivery(groupid=f"com.example.{self._kwargs['client_code']}",
+                            artifactid=f"{self._kwargs['client_code']}-test_delivery",
+                            version="v1.0")
+        delivery.save()
+
+        # regular upload rejects the same content
+        with self.assertRaises(DeliveryUploadError):
+            sender.send_delivery(delivery)
+
+        self.assertEqual(1, self.server.requests["chunked"])
+        self.assertEqual(1, self.server.requests["DELETE"])
+        self.assertEqual({}, self.server.artifacts)
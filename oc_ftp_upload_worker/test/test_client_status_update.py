@@ -7,8 +7,10 @@ import logging
 from fs.tempfs import TempFS
 from oc_delivery_apps.dlmanager.models import Client, FtpUploadClientOptions
 from ..ClientDeliverySender import EncryptingSender, SigningSender, ConnectionsContext
-from ..client_availability_update import is_client_encrypted_send_available, update_can_receive_status
+from ..client_availability_update import is_client_encrypted_send_available, update_can_receive_status, sweep_send_availability_statuses
+from ..resource_pool import ResourcePool
 import posixpath
+import unittest.mock
 
 import logging
 logging.getLogger().propagate = False
@@ -76,3 +78,75 @@ class ClientStatusUpdateTestSuite(django.test.TransactionTestCase):
         client, _ = Client.objects.get_or_create(code=self._client_code, country=self._country)
         update_can_receive_status(client, False)
         self.assertFalse(client.ftpuploadclientoptions.can_receive)
+
+
+class ClientStatusSweepTestSuite(django.test.TransactionTestCase):
+
+    def setUp(self):
+        django.core.management.call_command('migrate', verbosity=0, interactive=False)
+        self._country = 'SomeCountry'
+        self._repo_svn_fs = TempFS()
+        self._ftp_fs = TempFS()
+        self._pool = ResourcePool()
+        self._pool.register("svn", lambda: self._repo_svn_fs, close=lambda _fs: None)
+        self._pool.register("ftp", lambda: self._ftp_fs, close=lambda _fs: None)
+
+    def tearDown(self):
+        django.core.management.call_command('flush', verbosity=0, interactive=False)
+        self._repo_svn_fs.close()
+        self._ftp_fs.close()
+
+    def _create_client(self, code, has_keys=True, has_ftp_dir=True, **options):
+        client = Client.objects.create(code=code, country=self._country, is_active=True)
+
+        if options:
+            FtpUploadClientOptions(client=client, **options).save()
+
+        if has_keys:
+            self._repo_svn_fs.makedirs(posixpath.join(self._country, code, "data"))
+            self._repo_svn_fs.writetext(posixpath.join(self._country, code, "data", "pubkey.asc"), "key content")
+
+        if has_ftp_dir:
+            self._ftp_fs.makedirs(posixpath.join(code, "TO_BNK"))
+
+        return client
+
+    def _get_can_receive(self, code):
+        return FtpUploadClientOptions.objects.get(client__code=code).can_receive
+
+    def test_statuses_updated(self):
+        self._create_client("CONFIGURED")
+        self._create_client("NOKEYS", has_keys=False, can_receive=True)
+        self._create_client("NOFTP", has_ftp_dir=False, can_receive=True)
+        self._create_client("SIGNING", has_keys=False, has_ftp_dir=False, can_receive=False, should_encrypt=False)
+        sweep_send_availability_statuses(Client.objects.all(), resource_pool=self._pool, sweep_workers=2)
+        self.assertTrue(self._get_can_receive("CONFIGURED"))
+        self.assertFalse(self._get_can_receive("NOKEYS"))
+        self.assertFalse(self._get_can_receive("NOFTP"))
+        self.assertTrue(self._get_can_receive("SIGNING"))
+
+    def test_ftp_listed_once(self):
+        for _code in ["FIRST", "SECOND", "THIRD"]:
+            self._create_client(_code)
+
+        self._ftp_fs.writetext("FILE", "not a client directory")
+        self._create_client("FILE", has_ftp_dir=False)
+
+        with unittest.mock.patch.object(self._ftp_fs, "exists", side_effect=AssertionError("FTP checked per client")), \
+                unittest.mock.patch.object(self._ftp_fs, "scandir", wraps=self._ftp_fs.scandir) as scandir:
+            sweep_send_availability_statuses(Client.objects.all(), resource_pool=self._pool)
+
+        scandir.assert_called_once_with("/")
+        self.assertTrue(self._get_can_receive("SECOND"))
+        self.assertFalse(self._get_can_receive("FILE"))
+
+    def test_unchanged_statuses_not_written(self):
+        self._create_client("CONFIGURED", can_receive=True)
+        self._create_client("NOKEYS", has_keys=False, can_receive=True)
+
+        with self.assertNumQueries(4):
+            # clients and options selects, transaction, bulk update of single changed record
+            sweep_send_availability_statuses(Client.objects.all(), resource_pool=self._pool)
+
+        self.assertTrue(self._get_can_receive("CONFIGURED"))
+        self.assertFalse(self._get_can_receive("NOKEYS"))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from fs.tempfs import TempFS
+from ..compression_policy import CompressionPolicy, CompressionChoice, get_sampled_entropy
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class CompressionPolicyTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = CompressionPolicy()
+        self.work_fs = TempFS()
+        self.work_fs.writebytes("random", os.urandom(512 * 1024))
+        self.work_fs.writebytes("text", b"line of plain text\n" * 32 * 1024)
+
+    def tearDown(self):
+        self.work_fs.close()
+
+    def test_entropy(self):
+        self.assertGreater(get_sampled_entropy(self.work_fs.getsyspath("random"), 64 * 1024, 4), 7.9)
+        self.assertLess(get_sampled_entropy(self.work_fs.getsyspath("text"), 64 * 1024, 4), 5)
+        self.work_fs.create("empty")
+        self.assertEqual(0.0, get_sampled_entropy(self.work_fs.getsyspath("empty"), 64 * 1024, 4))
+
+    def test_auto(self):
+        self.assertEqual("none", self.policy.choose("zip", path=self.work_fs.getsyspath("random")).name)
+        # e.g. archive with stored entries
+        self.assertEqual("default", self.policy.choose("zip", path=self.work_fs.getsyspath("text")).name)
+        # packaging is trusted if content is not available
+        self.assertListEqual(["--compress-algo", "none"], self.policy.choose("zip").args)
+        self.assertEqual("default", self.policy.choose("txt").name)
+
+    def test_explicit_setting(self):
+        _random = self.work_fs.getsyspath("random")
+        self.assertEqual(CompressionChoice("default", []), self.policy.choose("zip", path=_random, setting="default"))
+        self.assertEqual(CompressionChoice("level-1", ["-z", "1"]), self.policy.choose("zip", path=_random, setting=1))
+        self.assertEqual("none", self.policy.choose("txt", setting="None").name)
+        self.assertEqual("default", self.policy.choose("zip", setting="unknown").name)
+
+    def test_stats(self):
+        _none = self.policy.choose("zip")
+        self.policy.record("g:a:v1", _none, 1000, 1100, 0.5)
+        self.policy.record("g:a:v2", _none, 2000, 2100, 0.25)
+        self.assertDictEqual({"none": {"deliveries": 2, "input_bytes": 3000, "output_bytes": 3200, "cpu_seconds": 0.75}},
+                             self.policy.stats())
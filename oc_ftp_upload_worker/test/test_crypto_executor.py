@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+import unittest
+import gnupg
+from fs.tempfs import TempFS
+from .test_keys import TestKeys
+from ..crypto_executor import CryptoExecutor, _MeasuredGPG
+from ..gpg_keyrings import GpgKeyrings
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class CryptoExecutorTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.keyrings = GpgKeyrings()
+        self.work_fs = TempFS()
+        self.work_fs.writebytes("clean_file", b"hello")
+
+    def tearDown(self):
+        self.keyrings.close()
+        self.work_fs.close()
+
+    def _assert_decrypted(self, encrypted_name, key):
+        with TempFS() as gpg_home_fs:
+            gpg = gnupg.GPG(gnupghome=gpg_home_fs.getsyspath("/"))
+            gpg.import_keys(key, passphrase="testkey")
+            result = gpg.decrypt(self.work_fs.readbytes(encrypted_name), passphrase="testkey")
+            self.assertEqual(b"hello", result.data)
+
+    def _encrypt(self, executor):
+        with self.keyrings.open([TestKeys().get_key("client_pub")]) as keyring:
+            return executor.encrypt(keyring, self.work_fs.getsyspath("clean_file"),
+                                    self.work_fs.getsyspath("encrypted_file"))
+
+    def test_encrypted_by_thread(self):
+        executor = CryptoExecutor(workers=2)
+        result = self._encrypt(executor)
+        executor.close()
+        self.assertTrue(result.ok)
+        self._assert_decrypted("encrypted_file", TestKeys().get_key("client_priv"))
+
+    def test_encrypted_by_process(self):
+        executor = CryptoExecutor(workers=1, processes=True)
+        result = self._encrypt(executor)
+        executor.close()
+        self.assertTrue(result.ok)
+        self._assert_decrypted("encrypted_file", TestKeys().get_key("client_priv"))
+
+    def test_cpu_of_other_processes_not_counted(self):
+        busy = [sys.executable, "-c", "import time\n_end = time.process_time() + 0.5\nwhile time.process_time() < _end: pass"]
+
+        with self.keyrings.open([TestKeys().get_key("client_pub")]) as keyring:
+            gpg = _MeasuredGPG(gpgbinary=keyring.gpg.gpgbinary, gnupghome=keyring.gpg.gnupghome)
+            # process of another job finishes while gpg output is read
+            gpg.on_data = lambda data: None if data else subprocess.run(busy, check=True)
+            result = gpg.encrypt(b"hello", list(keyring.fingerprints), always_trust=True)
+
+        self.assertTrue(result.ok)
+        self.assertLess(gpg.cpu_seconds, 0.4)
+
+    def test_sign_failure_reported(self):
+        executor = CryptoExecutor(workers=1)
+
+        with self.keyrings.open([TestKeys().get_key("company")], passphrase="testkey") as keyring:
+            result = executor.sign(keyring, "INVALID", self.work_fs.getsyspath("clean_file"),
+                                   self.work_fs.getsyspath("signed_file"))
+
+        executor.close()
+        self.assertFalse(result.ok)
+        self.assertTrue(result.stderr)
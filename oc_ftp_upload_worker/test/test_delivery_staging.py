@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from collections import namedtuple
+from fs.tempfs import TempFS
+from fs.memoryfs import MemoryFS
+from ..delivery_staging import DeliveryStaging
+from ..scratch import ScratchSpace
+from ..upload_errors import DeliveryUploadError
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+MockDelivery = namedtuple("MockDelivery", ["gav"])
+
+
+class MockDownloader(object):
+
+    def __init__(self, fail_times=0):
+        self.logged_calls = list()
+        self.fail_times = fail_times
+
+    def __call__(self, delivery, target_fs, target_name):
+        self.logged_calls.append(delivery.gav)
+
+        if self.fail_times:
+            self.fail_times -= 1
+            raise DeliveryUploadError(f"Not found at MVN: [{delivery.gav}]")
+
+        target_fs.writetext(target_name, f"content of {delivery.gav}")
+
+
+class DeliveryStagingTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.staging = DeliveryStaging()
+        self.delivery = MockDelivery("g.SOMTEST:a:v1")
+        self.targets = [TempFS(), MemoryFS()]
+
+    def tearDown(self):
+        self.staging.close()
+        [_fs.close() for _fs in self.targets]
+
+    def test_downloaded_once(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["mvn", "ftp"])
+
+        for _consumer, _target in zip(["mvn", "ftp"], self.targets):
+            self.staging.fetch(self.delivery, _target, "clean_file", download, _consumer)
+            self.assertEqual("content of g.SOMTEST:a:v1", _target.readtext("clean_file"))
+
+        self.assertListEqual(["g.SOMTEST:a:v1"], download.logged_calls)
+        # released after the last consumer
+        self.assertEqual(0, self.staging.staged_count())
+
+    def test_linked_within_scratch_space(self):
+        with TempFS() as root_fs:
+            scratch = ScratchSpace(root=root_fs.getsyspath("/"))
+            staging = DeliveryStaging(scratch=scratch)
+            work_fs = [scratch.open(), scratch.open()]
+
+            try:
+                staging.expect([self.delivery], ["mvn", "ftp", "other"])
+
+                for _consumer, _work_fs in zip(["mvn", "ftp"], work_fs):
+                    staging.fetch(self.delivery, _work_fs, "clean_file", MockDownloader(), _consumer)
+
+                # staged file and both work files are the same one on disk
+                self.assertEqual(3, os.stat(work_fs[0].getsyspath("clean_file")).st_nlink)
+            finally:
+                [_fs.close() for _fs in work_fs]
+                staging.close()
+                scratch.close()
+
+    def test_single_consumer_not_staged(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["ftp"])
+        self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "ftp")
+        self.assertEqual(0, self.staging.staged_count())
+        self.assertEqual("content of g.SOMTEST:a:v1", self.targets[0].readtext("clean_file"))
+
+    def test_staged_until_last_consumer(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["mvn", "other", "ftp"])
+        self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "mvn")
+        self.staging.fetch(self.delivery, self.targets[1], "clean_file", download, "other")
+        self.assertEqual(1, self.staging.staged_count())
+        # fetched delivery stays consumed
+        self.staging.release(self.delivery, "mvn")
+        self.assertEqual(1, self.staging.staged_count())
+        self.staging.release(self.delivery, "ftp")
+        self.assertEqual(0, self.staging.staged_count())
+
+    def test_failed_download_retried(self):
+        download = MockDownloader(fail_times=1)
+        self.staging.expect([self.delivery], ["mvn", "ftp"])
+
+        with self.assertRaises(DeliveryUploadError):
+            self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "mvn")
+
+        self.staging.fetch(self.delivery, self.targets[1], "clean_file", download, "ftp")
+        self.assertEqual("content of g.SOMTEST:a:v1", self.targets[1].readtext("clean_file"))
+        self.assertEqual(2, len(download.logged_calls))
+
+    def test_claimed_only_if_not_shared(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["mvn", "ftp"])
+        self.assertFalse(self.staging.claim(self.delivery, "mvn"))
+        self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "mvn")
+        # the last consumer may get content on its own, but it is staged already
+        self.assertFalse(self.staging.claim(self.delivery, "ftp"))
+        self.staging.fetch(self.delivery, self.targets[1], "clean_file", download, "ftp")
+        self.staging.expect([self.delivery], ["ftp"])
+        self.assertTrue(self.staging.claim(self.delivery, "ftp"))
+        self.assertListEqual(["g.SOMTEST:a:v1"], download.logged_calls)
+
+    def test_released_consumer_not_waited_for(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["mvn", "ftp"])
+        # e.g. sender failed before fetching
+        self.staging.release(self.delivery, "ftp")
+        self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "mvn")
+        self.assertEqual(0, self.staging.staged_count())
+
+    def test_staged_copy_removed_on_release(self):
+        download = MockDownloader()
+        self.staging.expect([self.delivery], ["mvn", "ftp"])
+        self.staging.fetch(self.delivery, self.targets[0], "clean_file", download, "mvn")
+        self.assertEqual(1, self.staging.staged_count())
+        self.staging.release(self.delivery, "ftp")
+        self.assertEqual(0, self.staging.staged_count())
+
+    def test_staged_size_reserved(self):
+        with TempFS() as root_fs:
+            scratch = ScratchSpace(root=root_fs.getsyspath("/"))
+            staging = DeliveryStaging(scratch=scratch)
+
+            try:
+                staging.expect([self.delivery], ["mvn", "ftp"])
+                staging.fetch(self.delivery, self.targets[0], "clean_file", MockDownloader(), "mvn",
+                              measure=lambda delivery: 4096)
+                self.assertEqual(4096, scratch.stats()["reserved"])
+                staging.fetch(self.delivery, self.targets[1], "clean_file", MockDownloader(), "ftp")
+                self.assertEqual(0, scratch.stats()["reserved"])
+            finally:
+                staging.close()
+                scratch.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+from collections import Counter
+from fs.memoryfs import MemoryFS
+from fs.errors import ResourceNotFound
+from ..ftp_listing import CachedListingFS, FtpListingCache
+from ..ftp_transfer import upload_file, upload_stream, replace, remove_quietly, get_source_name, mark_uploaded
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class CountingFS(MemoryFS):
+    """
+    MemoryFS counting metadata requests which would be round trips to FTP server
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = Counter()
+
+    def scandir(self, path, namespaces=None, page=None):
+        self.requests["scandir"] += 1
+        return super().scandir(path, namespaces=namespaces, page=page)
+
+    def getinfo(self, path, namespaces=None):
+        self.requests["getinfo"] += 1
+        return super().getinfo(path, namespaces=namespaces)
+
+
+class FtpListingTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.ftp_fs = CountingFS()
+        self.ftp_fs.makedirs("CLIENT/TO_BNK")
+        self.ftp_fs.writebytes("CLIENT/TO_BNK/first.pgp", b"first")
+        self.ftp_fs.writebytes("CLIENT/TO_BNK/second.pgp", b"second")
+        self.ftp_fs.requests.clear()
+        self.cached_fs = CachedListingFS(self.ftp_fs)
+
+    def tearDown(self):
+        self.ftp_fs.close()
+
+    def test_directory_listed_once(self):
+        target_fs = self.cached_fs.opendir("CLIENT/TO_BNK")
+        self.assertTrue(target_fs.exists("first.pgp"))
+        self.assertTrue(target_fs.exists("second.pgp"))
+        self.assertFalse(target_fs.exists("third.pgp"))
+        self.assertEqual(6, target_fs.getsize("second.pgp"))
+        self.assertEqual(["first.pgp", "second.pgp"], sorted(target_fs.listdir("/")))
+        # 'CLIENT' for opendir and 'CLIENT/TO_BNK' for its content
+        self.assertEqual({"scandir": 2}, dict(self.ftp_fs.requests))
+
+    def test_missing_parent_not_listed(self):
+        self.assertTrue(self.cached_fs.exists("CLIENT/TO_BNK"))
+        self.assertFalse(self.cached_fs.exists("OTHER/TO_BNK"))
+        self.assertFalse(self.cached_fs.exists("OTHER/TO_BNK/file.pgp"))
+        self.assertFalse(self.cached_fs.exists("CLIENT/TO_BNK/missing/file.pgp"))
+        # 'OTHER' is known to be missing, so 'OTHER/TO_BNK' is not listed
+        self.assertEqual({"scandir": 3}, dict(self.ftp_fs.requests))
+        self.assertEqual(1, self.cached_fs.listing.stats()["hits"])
+
+    def test_own_writes_seen(self):
+        target_fs = self.cached_fs.opendir("CLIENT/TO_BNK")
+        self.assertFalse(target_fs.exists("third.pgp"))
+
+        upload_stream(target_fs, "third.pgp", io.BytesIO(b"third content"))
+        self.assertEqual(13, target_fs.getsize("third.pgp"))
+        remove_quietly(target_fs, "second.pgp")
+        self.assertFalse(target_fs.exists("second.pgp"))
+        replace(target_fs, "third.pgp", "first.pgp")
+        self.assertFalse(target_fs.exists("third.pgp"))
+        self.assertEqual(13, target_fs.getsize("first.pgp"))
+        self.assertEqual(["first.pgp"], target_fs.listdir("/"))
+        self.assertEqual(b"third content", self.ftp_fs.readbytes("CLIENT/TO_BNK/first.pgp"))
+
+    def test_writes_reported(self):
+        self.assertEqual(["TO_BNK"], self.cached_fs.listdir("CLIENT"))
+        self.cached_fs.makedir("CLIENT/NEW")
+        # made bypassing the worker's own write calls
+        self.assertFalse(self.cached_fs.exists("CLIENT/NEW"))
+        self.cached_fs.listing.forget("CLIENT/NEW")
+        self.assertTrue(self.cached_fs.isdir("CLIENT/NEW"))
+        self.cached_fs.removedir("CLIENT/NEW")
+        self.cached_fs.listing.removed("CLIENT/NEW")
+        self.assertEqual(["TO_BNK"], self.cached_fs.listdir("CLIENT"))
+
+    def test_missing_directory_raises(self):
+        with self.assertRaises(ResourceNotFound):
+            self.cached_fs.opendir("OTHER")
+
+        with self.assertRaises(ResourceNotFound):
+            self.cached_fs.listdir("OTHER")
+
+    def test_cache_shared(self):
+        other_fs = CountingFS()
+        other_fs.makedirs("CLIENT/TO_BNK")
+        other_fs.requests.clear()
+        shared_fs = self.cached_fs.with_fs(other_fs)
+        self.assertTrue(self.cached_fs.exists("CLIENT/TO_BNK/first.pgp"))
+        self.assertTrue(shared_fs.exists("CLIENT/TO_BNK/first.pgp"))
+        self.assertEqual(0, sum(other_fs.requests.values()))
+        other_fs.close()
+
+    def test_upload_through_cache(self):
+        target_fs = self.cached_fs.opendir("CLIENT/TO_BNK")
+
+        with MemoryFS() as work_fs:
+            for _content in [b"new", b"newer", b"newer"]:
+                work_fs.writebytes("local", _content)
+                upload_file(work_fs, "local", target_fs, "first.pgp")
+                mark_uploaded(target_fs, "first.pgp", "key")
+
+        self.assertEqual(5, target_fs.getsize("first.pgp"))
+        self.assertEqual(b"newer", self.ftp_fs.readbytes("CLIENT/TO_BNK/first.pgp"))
+        self.assertEqual(sorted(self.ftp_fs.listdir("CLIENT/TO_BNK")), sorted(target_fs.listdir("/")))
+        self.assertIn(get_source_name("first.pgp"), target_fs.listdir("/"))
+
+
+class FtpListingCacheTestSuite(unittest.TestCase):
+
+    def test_forgotten_entry_refreshed(self):
+        with CountingFS() as ftp_fs:
+            ftp_fs.makedir("dir")
+            ftp_fs.writebytes("dir/file", b"1")
+            listing = FtpListingCache()
+            self.assertEqual(1, listing.lookup(ftp_fs, "dir/file").size)
+            ftp_fs.writebytes("dir/file", b"12")
+            listing.forget("dir/file")
+            self.assertEqual(2, listing.lookup(ftp_fs, "dir/file").size)
+            ftp_fs.remove("dir/file")
+            listing.forget("dir/file")
+            self.assertIsNone(listing.lookup(ftp_fs, "dir/file"))
+            self.assertEqual([], listing.listdir(ftp_fs, "dir"))
+            self.assertEqual({"hits": 3, "listings": 1, "refreshes": 2}, listing.stats())
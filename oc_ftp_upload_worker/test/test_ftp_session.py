@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import ftplib
+import threading
+import unittest
+import unittest.mock
+from fs.ftpfs import FTPFS
+from fs.memoryfs import MemoryFS
+from ..ftp_session import FtpSessions
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class MockFTPFS(FTPFS):
+    """
+    FTPFS opening mocked connections
+    """
+
+    def __init__(self):
+        super().__init__("localhost")
+        self.opened = list()
+
+    def _open_ftp(self):
+        _ftp = unittest.mock.MagicMock()
+        self.opened.append(_ftp)
+        return _ftp
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FtpSessionsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sessions = FtpSessions(probe_after=30, max_idle=600, keepalive_interval=0, clock=self.clock)
+        self.ftp_fs = MockFTPFS()
+
+    def test_connected_once(self):
+        self.assertTrue(self.sessions.ensure(self.ftp_fs))
+        self.clock.now += 5
+        self.assertFalse(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(1, len(self.ftp_fs.opened))
+        # recently used connection is not probed
+        self.ftp_fs.opened[0].voidcmd.assert_not_called()
+        self.assertEqual({"connects": 1, "reconnects": 0, "probes": 0, "keepalives": 0}, self.sessions.stats())
+
+    def test_alive_connection_kept(self):
+        self.sessions.ensure(self.ftp_fs)
+        self.clock.now += 60
+        self.assertFalse(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(1, len(self.ftp_fs.opened))
+        self.ftp_fs.opened[0].voidcmd.assert_called_once_with("NOOP")
+        self.assertEqual(1, self.sessions.stats()["probes"])
+        self.assertEqual(0, self.sessions.stats()["reconnects"])
+
+    def test_dead_connection_reopened(self):
+        self.sessions.ensure(self.ftp_fs)
+        self.ftp_fs.opened[0].voidcmd.side_effect = EOFError()
+        self.clock.now += 60
+        self.assertTrue(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(2, len(self.ftp_fs.opened))
+        self.assertIs(self.ftp_fs.opened[1], self.ftp_fs._ftp)
+        self.ftp_fs.opened[0].close.assert_called_once_with()
+        self.assertEqual(1, self.sessions.stats()["reconnects"])
+
+    def test_idle_connection_reopened(self):
+        self.sessions.ensure(self.ftp_fs)
+        self.clock.now += 601
+        self.assertTrue(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(2, len(self.ftp_fs.opened))
+        self.ftp_fs.opened[0].voidcmd.assert_not_called()
+        self.assertEqual({"connects": 1, "reconnects": 1, "probes": 0, "keepalives": 0}, self.sessions.stats())
+
+    def test_used_connection_not_idle(self):
+        self.sessions.ensure(self.ftp_fs)
+        # long upload finished just now
+        self.clock.now += 700
+        self.sessions.used(self.ftp_fs)
+        self.clock.now += 5
+        self.assertFalse(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(1, len(self.ftp_fs.opened))
+        self.ftp_fs.opened[0].voidcmd.assert_not_called()
+        self.assertEqual({"connects": 1, "reconnects": 0, "probes": 0, "keepalives": 0}, self.sessions.stats())
+
+    def test_unknown_connection_probed(self):
+        # e.g. opened by resource pool
+        self.ftp_fs._get_ftp()
+        self.ftp_fs.opened[0].voidcmd.side_effect = ftplib.error_temp("421 timeout")
+        self.assertTrue(self.sessions.ensure(self.ftp_fs))
+        self.assertEqual(2, len(self.ftp_fs.opened))
+        self.assertEqual(1, self.sessions.stats()["reconnects"])
+
+    def test_keepalive_sent(self):
+        sessions = FtpSessions(keepalive_interval=0.01)
+        sessions.ensure(self.ftp_fs)
+        sent = threading.Event()
+        self.ftp_fs.opened[0].voidcmd.side_effect = lambda _cmd: sent.set()
+
+        with sessions.keepalive(self.ftp_fs):
+            self.assertTrue(sent.wait(5))
+
+        self.assertGreater(sessions.stats()["keepalives"], 0)
+        self.assertEqual(1, len(self.ftp_fs.opened))
+
+    def test_keepalive_skipped_while_busy(self):
+        sessions = FtpSessions(keepalive_interval=0.01)
+        sessions.ensure(self.ftp_fs)
+        done = threading.Event()
+
+        def _hold():
+            with self.ftp_fs._lock:
+                done.wait(5)
+
+        holder = threading.Thread(target=_hold)
+        holder.start()
+
+        with sessions.keepalive(self.ftp_fs):
+            threading.Event().wait(0.1)
+
+        done.set()
+        holder.join()
+        self.ftp_fs.opened[0].voidcmd.assert_not_called()
+        self.assertEqual(0, sessions.stats()["keepalives"])
+
+    def test_not_ftp_ignored(self):
+        with MemoryFS() as memory_fs:
+            self.assertFalse(self.sessions.ensure(memory_fs))
+
+            with self.sessions.keepalive(memory_fs):
+                pass
+
+        self.assertEqual(0, self.sessions.stats()["connects"])
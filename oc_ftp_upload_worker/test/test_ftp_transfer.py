@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import ftplib
+import hashlib
+import os
+import socket
+import socketserver
+import threading
+import unittest
+from fs.memoryfs import MemoryFS
+from fs.tempfs import TempFS
+from ..ftp_transfer import upload_file, get_source_name, get_temp_name, store_resumable, is_uploaded, mark_uploaded
+from ..integrity import Digests, TeeReader
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class FtpTransferTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.work_fs = TempFS()
+        self.ftp_fs = MemoryFS()
+        self.ftp_fs.makedir("TO_BNK")
+        self.target_fs = self.ftp_fs.opendir("TO_BNK")
+
+    def tearDown(self):
+        self.work_fs.close()
+        self.ftp_fs.close()
+
+    def test_overwritten(self):
+        self.target_fs.writetext("delivery.pgp", "old content")
+        self.work_fs.writetext("processed_file", "new content")
+        upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.pgp")
+        self.assertEqual("new content", self.target_fs.readtext("delivery.pgp"))
+        self.assertListEqual(["delivery.pgp"], self.target_fs.listdir("/"))
+        self.assertFalse(self.work_fs.exists("processed_file"))
+
+    def test_partial_upload_not_visible(self):
+        self.target_fs.writetext("delivery.pgp", "old content")
+        self.work_fs.writetext("processed_file", "new content")
+        _upload = self.ftp_fs.upload
+
+        def _failing_upload(path, file, *args, **kwargs):
+            _upload(path, file, *args, **kwargs)
+            raise IOError("connection lost")
+
+        self.ftp_fs.upload = _failing_upload
+
+        with self.assertRaises(IOError):
+            upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.pgp")
+
+        self.assertEqual("old content", self.target_fs.readtext("delivery.pgp"))
+        self.assertFalse(self.target_fs.exists(get_temp_name("delivery.pgp")))
+
+    def test_uploaded_recognized_by_source(self):
+        self.work_fs.writetext("processed_file", "content")
+        self.work_fs.writetext("processed_file.asc", "signature")
+        self.assertFalse(is_uploaded(self.target_fs, ["delivery.zip", "delivery.zip.asc"], "key"))
+        upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.zip")
+        mark_uploaded(self.target_fs, "delivery.zip", "key")
+        # delivery is complete with signature only
+        self.assertFalse(is_uploaded(self.target_fs, ["delivery.zip", "delivery.zip.asc"], "key"))
+        upload_file(self.work_fs, "processed_file.asc", self.target_fs, "delivery.zip.asc")
+        self.assertTrue(is_uploaded(self.target_fs, ["delivery.zip", "delivery.zip.asc"], "key"))
+        self.assertFalse(is_uploaded(self.target_fs, ["delivery.zip", "delivery.zip.asc"], "other key"))
+
+    def test_uploaded_content_hashed(self):
+        digests = Digests()
+        self.work_fs.writetext("processed_file", "content")
+        upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.pgp", digests=digests)
+        self.assertEqual(hashlib.sha256(b"content").hexdigest(), digests.hexdigests()["sha256"])
+        self.assertEqual(hashlib.md5(b"content").hexdigest(), digests.hexdigests()["md5"])
+        self.assertEqual(7, digests.size)
+
+    def test_stale_source_removed(self):
+        self.work_fs.writetext("processed_file", "content")
+        upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.zip")
+        mark_uploaded(self.target_fs, "delivery.zip", "key")
+        self.assertTrue(self.target_fs.exists(get_source_name("delivery.zip")))
+        self.work_fs.writetext("processed_file", "other content")
+        upload_file(self.work_fs, "processed_file", self.target_fs, "delivery.zip")
+        self.assertListEqual(["delivery.zip"], self.target_fs.listdir("/"))
+
+
+class CuttingFtpHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal FTP server: passive binary uploads, SIZE, nothing else.
+    Data connection of an upload is cut after server's 'cut_after' bytes are received.
+    """
+
+    def handle(self):
+        self.passive = None
+        self.reply("220 Ready")
+
+        for _line in self.rfile:
+            _command, _, _argument = _line.decode("utf-8").strip().partition(" ")
+            _handler = getattr(self, f"do_{_command.upper()}", None)
+
+            if _handler is None:
+                self.reply("502 Not implemented")
+                continue
+
+            if _handler(_argument) is False:
+                return
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("utf-8"))
+
+    def do_USER(self, argument):
+        self.reply("331 Password required")
+
+    def do_PASS(self, argument):
+        self.reply("230 Logged in")
+
+    def do_TYPE(self, argument):
+        self.reply("200 Type set")
+
+    def do_QUIT(self, argument):
+        self.reply("221 Bye")
+        return False
+
+    def do_SIZE(self, argument):
+        if argument not in self.server.files:
+            self.reply("550 Not found")
+            return
+
+        self.reply(f"213 {len(self.server.files[argument])}")
+
+    def do_PASV(self, argument):
+        self.passive = socket.socket()
+        self.passive.bind(("127.0.0.1", 0))
+        self.passive.listen(1)
+        _port = self.passive.getsockname()[1]
+        self.reply(f"227 Entering Passive Mode (127,0,0,1,{_port >> 8},{_port & 0xff})")
+
+    def do_STOR(self, argument):
+        self.server.files[argument] = bytearray()
+        return self.receive(argument)
+
+    def do_APPE(self, argument):
+        self.server.commands.append("APPE")
+        self.server.files.setdefault(argument, bytearray())
+        return self.receive(argument)
+
+    def receive(self, path):
+        self.reply("150 Ok to send data")
+        _data_conn, _ = self.passive.accept()
+        self.passive.close()
+
+        with _data_conn:
+            while True:
+                _chunk = _data_conn.recv(8192)
+
+                if not _chunk:
+                    break
+
+                if self.server.cuts and len(self.server.files[path]) + len(_chunk) >= self.server.cut_after:
+                    self.server.cuts -= 1
+                    self.server.files[path] += _chunk[:self.server.cut_after - len(self.server.files[path])]
+                    _data_conn.shutdown(socket.SHUT_RDWR)
+                    self.reply("426 Connection closed; transfer aborted")
+                    return False
+
+                self.server.files[path] += _chunk
+
+        self.reply("226 Transfer complete")
+
+
+class CuttingFtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, cut_after, cuts):
+        super().__init__(("127.0.0.1", 0), CuttingFtpHandler)
+        self.cut_after = cut_after
+        self.cuts = cuts
+        self.files = dict()
+        self.commands = list()
+
+
+class ResumableUploadTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.content = os.urandom(1024 * 1024)
+        self.work_fs = TempFS()
+        self.work_fs.writebytes("processed_file", self.content)
+        self.delays = list()
+
+    def tearDown(self):
+        self.work_fs.close()
+        [_ftp.close() for _ftp in self.connections]
+        self.server.shutdown()
+        self.server.server_close()
+
+    def start_server(self, cut_after, cuts):
+        self.server = CuttingFtpServer(cut_after, cuts)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.connections = list()
+
+    def get_ftp(self, reconnect):
+        if reconnect or not self.connections:
+            _ftp = ftplib.FTP()
+            _ftp.connect("127.0.0.1", self.server.server_address[1], timeout=10)
+            _ftp.login("user", "password")
+            self.connections.append(_ftp)
+
+        return self.connections[-1]
+
+    def store(self, retries):
+        with self.work_fs.openbin("processed_file") as local_file:
+            store_resumable(self.get_ftp, ".delivery.pgp.part", local_file, len(self.content),
+                            retries=retries, backoff=1, sleep=self.delays.append)
+
+    def test_resumed_after_cut(self):
+        self.start_server(cut_after=600 * 1024, cuts=2)
+        self.store(retries=3)
+        self.assertEqual(self.content, bytes(self.server.files[".delivery.pgp.part"]))
+        self.assertListEqual(["APPE", "APPE"], self.server.commands)
+        self.assertListEqual([1, 2], self.delays)
+
+    def test_resumed_content_hashed_once(self):
+        self.start_server(cut_after=600 * 1024, cuts=2)
+
+        with self.work_fs.openbin("processed_file") as local_file:
+            reader = TeeReader(local_file)
+            store_resumable(self.get_ftp, ".delivery.pgp.part", reader, len(self.content),
+                            retries=3, backoff=1, sleep=self.delays.append)
+
+        self.assertEqual(hashlib.sha1(self.content).hexdigest(), reader.digests.hexdigests()["sha1"])
+        self.assertEqual(len(self.content), reader.digests.size)
+
+    def test_retries_limited(self):
+        self.start_server(cut_after=600 * 1024, cuts=3)
+
+        with self.assertRaises(ftplib.all_errors):
+            self.store(retries=2)
+
+        self.assertEqual(2, len(self.delays))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import unittest
+from .test_keys import TestKeys
+from ..gpg_keyrings import GpgKeyrings, get_keys_digest
+from ..upload_errors import DeliveryEncryptionError
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class GpgKeyringsTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.keyrings = GpgKeyrings(max_keyrings=2)
+        self.company_key = TestKeys().get_key("company_pub")
+        self.client_key = TestKeys().get_key("client_pub")
+
+    def tearDown(self):
+        self.keyrings.close()
+
+    def test_reused_for_same_keys(self):
+        with self.keyrings.open([self.company_key, self.client_key]) as keyring:
+            self.assertEqual(2, len(keyring.fingerprints))
+
+        # order of keys does not matter
+        with self.keyrings.open([self.client_key, self.company_key]) as reused:
+            self.assertIs(keyring, reused)
+
+        self.assertEqual(1, self.keyrings.count())
+
+    def test_passphrase_distinguishes(self):
+        self.assertNotEqual(get_keys_digest([self.company_key]),
+                            get_keys_digest([self.company_key], passphrase="testkey"))
+
+    def test_owner_keys_changed(self):
+        with self.keyrings.open([self.company_key, self.client_key], owner="TEST") as keyring:
+            pass
+
+        with self.keyrings.open([self.company_key], owner="TEST"):
+            pass
+
+        self.assertTrue(keyring.evicted)
+        self.assertTrue(keyring.home_fs.isclosed())
+        self.assertEqual(1, self.keyrings.count())
+
+    def test_leased_kept_until_released(self):
+        keyring = self.keyrings.acquire([self.client_key], owner="TEST")
+        self.keyrings.acquire([self.company_key], owner="TEST")
+        self.assertTrue(keyring.evicted)
+        # still usable by its holder
+        self.assertEqual(1, len(keyring.gpg.list_keys().fingerprints))
+        self.keyrings.release(keyring)
+        self.assertTrue(keyring.home_fs.isclosed())
+
+    def test_least_recently_used_trimmed(self):
+        with self.keyrings.open([self.company_key]) as company:
+            pass
+
+        with self.keyrings.open([self.client_key]):
+            pass
+
+        with self.keyrings.open([self.company_key, self.client_key]):
+            pass
+
+        self.assertEqual(2, self.keyrings.count())
+        self.assertTrue(company.evicted)
+
+    def test_invalid_key(self):
+        with self.assertRaises(DeliveryEncryptionError):
+            with self.keyrings.open([b"INVALID KEY"]):
+                pass
+
+        self.assertEqual(0, self.keyrings.count())
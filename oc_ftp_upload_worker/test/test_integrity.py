@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import unittest
+from ..integrity import Digests, TeeReader
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class HeadedStream(io.BytesIO):
+
+    headers = {"Content-Length": "10"}
+
+
+class TeeReaderTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.content = b"0123456789"
+        self.reader = TeeReader(HeadedStream(self.content), chunk_size=3)
+
+    def assert_hashed(self):
+        self.assertEqual({"md5": hashlib.md5(self.content).hexdigest(),
+                          "sha1": hashlib.sha1(self.content).hexdigest(),
+                          "sha256": hashlib.sha256(self.content).hexdigest()}, self.reader.digests.hexdigests())
+        self.assertEqual(len(self.content), self.reader.digests.size)
+
+    def test_read_hashed(self):
+        self.assertEqual(b"0123", self.reader.read(4))
+        self.assertEqual(b"456789", self.reader.read())
+        self.assertEqual(b"", self.reader.read(4))
+        self.assert_hashed()
+
+    def test_reread_not_hashed_twice(self):
+        self.reader.read(6)
+        self.assertEqual(2, self.reader.seek(2))
+        self.assertEqual(b"2345", self.reader.read(4))
+        self.assertEqual(6, self.reader.tell())
+        self.reader.read()
+        self.assert_hashed()
+
+    def test_skipped_content_hashed(self):
+        self.reader.read(2)
+        self.assertEqual(8, self.reader.seek(8))
+        self.assertEqual(b"89", self.reader.read())
+        self.assert_hashed()
+
+    def test_stream_attributes_kept(self):
+        self.assertEqual("10", self.reader.headers["Content-Length"])
+        self.reader.close()
+        self.assertTrue(self.reader.closed)
+
+    def test_algorithms_chosen(self):
+        digests = Digests(["md5"])
+        digests.update(self.content)
+        self.assertEqual({"md5": hashlib.md5(self.content).hexdigest()}, digests.hexdigests())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import unittest
+import posixpath
+from fs.info import Info
+from fs.tempfs import TempFS
+from fs.errors import ResourceNotFound
+from ..keys_cache import ClientKeysCache
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class RevisionedFS(TempFS):
+    """
+    Local stand-in for SvnFS: reports revision in 'svn' namespace and counts reads
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.revision = 1
+        self.reads = 0
+
+    def getinfo(self, path, namespaces=None):
+        _info = super().getinfo(path, namespaces)
+
+        if "svn" not in (namespaces or []):
+            return _info
+
+        return Info(dict(_info.raw, svn={"revision": self.revision}))
+
+    def listdir(self, path):
+        self.reads += 1
+        return super().listdir(path)
+
+    def openbin(self, path, mode="r", buffering=-1, **options):
+        self.reads += 1
+        return super().openbin(path, mode, buffering, **options)
+
+
+class MockClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class ClientKeysCacheTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.svn_fs = RevisionedFS()
+        self.data_dir = posixpath.join("SomeCountry", "SOMTEST", "data")
+        self.svn_fs.makedirs(self.data_dir)
+        self.svn_fs.writetext(posixpath.join(self.data_dir, "pubkey.asc"), "key content")
+        self.clock = MockClock()
+        self.cache = ClientKeysCache(ftp_ttl=10, clock=self.clock)
+
+    def tearDown(self):
+        self.svn_fs.close()
+
+    def _read_keys(self):
+        data_fs = self.cache.open(self.svn_fs).opendir(self.data_dir)
+
+        with data_fs.open("pubkey.asc", mode="rb") as _key_file:
+            return data_fs.listdir("/"), _key_file.read()
+
+    def test_reused_while_revision_not_changed(self):
+        self.assertEqual((["pubkey.asc"], b"key content"), self._read_keys())
+        _reads = self.svn_fs.reads
+        self.assertEqual((["pubkey.asc"], b"key content"), self._read_keys())
+        self.assertEqual(_reads, self.svn_fs.reads)
+        self.assertEqual({"hits": 1, "misses": 1}, self.cache.stats()["svn_file"])
+
+    def test_reread_on_new_revision(self):
+        self._read_keys()
+        self.svn_fs.writetext(posixpath.join(self.data_dir, "pubkey.asc"), "new key content")
+        self.svn_fs.revision = 2
+        self.assertEqual((["pubkey.asc"], b"new key content"), self._read_keys())
+        self.assertEqual({"hits": 0, "misses": 2}, self.cache.stats()["svn_file"])
+
+    def test_missing_directory_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ResourceNotFound):
+                self.cache.open(self.svn_fs).opendir("SomeCountry/SOMOTHER/data")
+
+        self.assertEqual({"hits": 1, "misses": 1}, self.cache.stats()["svn_listing"])
+
+    def test_no_revision_not_cached(self):
+        plain_fs = TempFS()
+        plain_fs.makedir("data")
+        self.assertListEqual([], self.cache.open(plain_fs).listdir("data"))
+        plain_fs.writetext("data/pubkey.asc", "key content")
+        self.assertListEqual(["pubkey.asc"], self.cache.open(plain_fs).listdir("data"))
+        self.assertEqual(0, self.cache.hits + self.cache.misses)
+        plain_fs.close()
+
+    def test_ftp_existence_expires(self):
+        ftp_fs = TempFS()
+        self.assertFalse(self.cache.ftp_exists(ftp_fs, "SOMTEST/TO_BNK"))
+        ftp_fs.makedirs("SOMTEST/TO_BNK")
+        self.assertFalse(self.cache.ftp_exists(ftp_fs, "SOMTEST/TO_BNK"))
+        self.clock.now = 11
+        self.assertTrue(self.cache.ftp_exists(ftp_fs, "SOMTEST/TO_BNK"))
+        self.assertEqual({"hits": 1, "misses": 2}, self.cache.stats()["ftp_dir"])
+        ftp_fs.close()
+
+    def test_ftp_forgotten(self):
+        ftp_fs = TempFS()
+        ftp_fs.makedirs("SOMTEST/TO_BNK")
+        self.assertTrue(self.cache.ftp_exists(ftp_fs, "SOMTEST/TO_BNK"))
+        ftp_fs.removetree("SOMTEST")
+        self.cache.forget_ftp("SOMTEST/TO_BNK")
+        self.assertFalse(self.cache.ftp_exists(ftp_fs, "SOMTEST/TO_BNK"))
+        ftp_fs.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import unittest
+import threading
+from ..message_dispatcher import ClientMessageDispatcher
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class MockHandler(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.max_running = 0
+        self.max_running_per_client = 0
+        self.release = threading.Event()
+        self.logged_calls = list()
+
+    def __call__(self, client_code):
+        with self.lock:
+            self.running[client_code] = self.running.get(client_code, 0) + 1
+            self.max_running = max(self.max_running, sum(self.running.values()))
+            self.max_running_per_client = max(self.max_running_per_client, self.running[client_code])
+            self.logged_calls.append(client_code)
+
+        self.release.wait(5)
+
+        with self.lock:
+            self.running[client_code] -= 1
+
+        if client_code == "FAILING":
+            raise ValueError("fail")
+
+
+class MockFinisher(object):
+
+    def __init__(self):
+        self.logged_calls = list()
+
+    def __call__(self, msg_id, status, message=None):
+        self.logged_calls.append((msg_id, status, message))
+
+
+class ClientMessageDispatcherTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = MockHandler()
+        self.finisher = MockFinisher()
+
+    def test_invalid_workers_count(self):
+        with self.assertRaises(ValueError):
+            ClientMessageDispatcher(self.handler, self.finisher, workers=0)
+
+    def test_different_clients_parallel(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=2)
+        dispatcher.submit("SOMTEST", 1)
+        dispatcher.submit("SOMOTHER", 2)
+        self.assertEqual(0, dispatcher.free_capacity())
+        self.handler.release.set()
+        dispatcher.shutdown()
+        self.assertEqual(2, self.handler.max_running)
+        self.assertListEqual([(1, 'P', None), (2, 'P', None)], sorted(self.finisher.logged_calls))
+
+    def test_same_client_serialized(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=3)
+        self.handler.release.set()
+
+        for _msg_id in range(3):
+            dispatcher.submit("SOMTEST", _msg_id)
+
+        dispatcher.shutdown()
+        self.assertEqual(1, self.handler.max_running_per_client)
+        # order of messages for the same client is kept
+        self.assertListEqual([0, 1, 2], [_c[0] for _c in self.finisher.logged_calls])
+
+    def test_failure_finished(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=2)
+        self.handler.release.set()
+        dispatcher.submit("FAILING", 1)
+        dispatcher.submit("SOMTEST", 2)
+        dispatcher.shutdown()
+        self.assertListEqual([(1, 'F', "fail"), (2, 'P', None)], sorted(self.finisher.logged_calls))
+
+    def test_capacity_released(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=1)
+        dispatcher.submit("SOMTEST", 1)
+        self.assertFalse(dispatcher.wait_for_capacity(0.1))
+        self.handler.release.set()
+        self.assertTrue(dispatcher.wait_for_capacity(5))
+        dispatcher.shutdown()
+
+    def test_free_capacity(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=3, coalesce=True)
+        dispatcher.submit("SOMTEST", 1)
+        self.assertTrue(dispatcher.takes_capacity("SOMTEST"))
+        dispatcher.submit("SOMTEST", 2)
+        self.assertEqual(1, dispatcher.free_capacity())
+        # joins waiting group
+        self.assertFalse(dispatcher.takes_capacity("SOMTEST"))
+        self.assertTrue(dispatcher.takes_capacity("SOMOTHER"))
+        self.handler.release.set()
+        dispatcher.shutdown()
+        self.assertEqual(3, dispatcher.free_capacity())
+
+    def test_waiting_messages_coalesced(self):
+        dispatcher = ClientMessageDispatcher(self.handler, self.finisher, workers=1, coalesce=True)
+        dispatcher.submit("SOMTEST", 1, 2)
+        dispatcher.submit("SOMTEST", 3)
+        dispatcher.submit("SOMTEST", 4)
+        self.handler.release.set()
+        dispatcher.shutdown()
+        # first group is running, all later messages are joined into single run
+        self.assertListEqual(["SOMTEST", "SOMTEST"], self.handler.logged_calls)
+        self.assertListEqual([1, 2, 3, 4], [_c[0] for _c in self.finisher.logged_calls])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import re
+import threading
+import unittest
+from fs.errors import ResourceNotFound
+from fs.tempfs import TempFS
+from oc_cdtapi.NexusAPI import NexusAPI
+from ..mvn_download import download_artifact, get_artifact_size
+from .test_mvn_transfer import RepositoryHandler, RepositoryServer
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class DownloadHandler(RepositoryHandler):
+    """
+    Repository serving artifacts by byte ranges
+    """
+
+    def do_GET(self):
+        self.server.requests["GET"] += 1
+        _content = self.server.artifacts.get(self.path)
+
+        if _content is None:
+            self.reply(404)
+            return
+
+        _headers = {"X-Checksum-Md5": hashlib.md5(_content).hexdigest()} if self.server.checksum_headers else dict()
+        _range = re.match(r"bytes=(\d+)-(\d+)$", self.headers.get("Range", ""))
+
+        if self.server.ranges:
+            _headers["Accept-Ranges"] = "bytes"
+
+        if not _range or not self.server.ranges or self.server.ignore_ranges:
+            self.reply(200, _content, headers=_headers)
+            return
+
+        self.server.requests["ranges"] += 1
+        _start, _end = int(_range.group(1)), int(_range.group(2))
+        _headers["Content-Range"] = f"bytes {_start}-{_end}/{len(_content)}"
+        _part = _content[_start:_end + 1]
+
+        if self.server.corrupt_ranges:
+            self.server.corrupt_ranges -= 1
+            _part = bytes(len(_part))
+
+        self.reply(206, _part, headers=_headers)
+
+    def reply(self, code, body=b"", headers=None, send_body=True):
+        try:
+            super().reply(code, body, headers=headers, send_body=send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            # client took the part needed only
+            pass
+
+
+class MvnDownloadTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RepositoryServer(DownloadHandler)
+        self.server.ranges = True
+        self.server.ignore_ranges = False
+        self.server.corrupt_ranges = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.nexus_api = NexusAPI(root=f"http://127.0.0.1:{self.server.server_address[1]}/artifactory",
+                                  user="user", auth="password", download_repo="repo")
+        self.gav = "g.CLIENT:a:1.0:zip"
+        self.content = os.urandom(1000)
+        self.server.artifacts["/artifactory/repo/g/CLIENT/a/1.0/a-1.0.zip"] = self.content
+        self.work_fs = TempFS()
+        self.path = self.work_fs.getsyspath("clean_file")
+
+    def tearDown(self):
+        self.work_fs.close()
+        self.nexus_api.web.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def download(self, **kwargs):
+        digests = download_artifact(self.nexus_api, self.gav, self.path, connections=4, part_size=100, chunk_size=64,
+                                    **kwargs)
+        self.assertEqual(self.content, self.work_fs.readbytes("clean_file"))
+        self.assertEqual({"md5": hashlib.md5(self.content).hexdigest(), "sha1": hashlib.sha1(self.content).hexdigest(),
+                          "sha256": hashlib.sha256(self.content).hexdigest()}, digests)
+
+    def test_downloaded_by_parts(self):
+        self.download(md5=hashlib.md5(self.content).hexdigest())
+        # the first part is taken from response telling size
+        self.assertEqual(3, self.server.requests["ranges"])
+        self.assertEqual(4, self.server.requests["GET"])
+
+    def test_small_downloaded_by_single_stream(self):
+        download_artifact(self.nexus_api, self.gav, self.path, connections=4, part_size=600)
+        self.assertEqual(self.content, self.work_fs.readbytes("clean_file"))
+        self.assertEqual(0, self.server.requests["ranges"])
+        self.assertEqual(1, self.server.requests["GET"])
+
+    def test_ranges_not_advertised(self):
+        self.server.ranges = False
+        self.download()
+        self.assertEqual(1, self.server.requests["GET"])
+
+    def test_ranges_ignored_falls_back(self):
+        self.server.ignore_ranges = True
+        self.download()
+        self.assertEqual(0, self.server.requests["ranges"])
+        self.assertEqual(5, self.server.requests["GET"])
+
+    def test_corrupted_part_falls_back(self):
+        self.server.corrupt_ranges = 1
+        self.download()
+        self.assertEqual(5, self.server.requests["GET"])
+
+    def test_registered_checksum_mismatch_falls_back(self):
+        self.server.checksum_headers = False
+        self.download(md5=hashlib.md5(b"other").hexdigest())
+        self.assertEqual(5, self.server.requests["GET"])
+
+    def test_size_by_first_byte(self):
+        self.assertEqual(1000, get_artifact_size(self.nexus_api, self.gav))
+        self.assertEqual(1, self.server.requests["ranges"])
+
+    def test_size_without_ranges(self):
+        self.server.ranges = False
+        self.assertEqual(1000, get_artifact_size(self.nexus_api, self.gav))
+
+    def test_missing_raises(self):
+        self.gav = "g.CLIENT:a:2.0:zip"
+
+        with self.assertRaises(ResourceNotFound):
+            download_artifact(self.nexus_api, self.gav, self.path)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from oc_cdtapi.NexusAPI import NexusAPI, NexusAPIError
+from ..mvn_transfer import upload_artifact, stream_artifact, remove_artifact, get_headers_md5
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class RepositoryHandler(BaseHTTPRequestHandler):
+    """
+    Artifactory-like repository keeping artifacts in memory
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.requests["connections"] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.requests["HEAD"] += 1
+        _content = self.server.artifacts.get(self.path)
+
+        if _content is None:
+            self.reply(404)
+            return
+
+        _headers = {"Content-Length": str(len(_content))}
+
+        if self.server.checksum_headers:
+            _headers["X-Checksum-Sha1"] = hashlib.sha1(_content).hexdigest()
+
+        self.reply(200, headers=_headers, send_body=False)
+
+    def do_GET(self):
+        self.server.requests["GET"] += 1
+
+        if self.path.endswith(".sha1") and self.path[:-len(".sha1")] in self.server.artifacts:
+            self.reply(200, hashlib.sha1(self.server.artifacts[self.path[:-len(".sha1")]]).hexdigest().encode())
+            return
+
+        self.reply(404)
+
+    def do_PUT(self):
+        self.server.requests["PUT"] += 1
+
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            self.server.requests["chunked"] += 1
+            _content = self.read_chunked()
+        else:
+            _content = self.rfile.read(int(self.headers["Content-Length"]))
+
+        self.server.artifacts[self.path] = _content
+        _sha1 = hashlib.sha1(_content).hexdigest()
+
+        if self.server.corrupt_puts:
+            self.server.corrupt_puts -= 1
+            _sha1 = "0" * 40
+
+        self.reply(201, f'{{"checksums": {{"sha1": "{_sha1}"}}}}'.encode(),
+                   headers={"Content-Type": "application/json"})
+
+    def do_DELETE(self):
+        self.server.requests["DELETE"] += 1
+        self.reply(204 if self.server.artifacts.pop(self.path, None) is not None else 404)
+
+    def read_chunked(self):
+        _content = b""
+
+        while True:
+            _size = int(self.rfile.readline().strip(), 16)
+            _content += self.rfile.read(_size)
+            self.rfile.readline()
+
+            if not _size:
+                return _content
+
+    def reply(self, code, body=b"", headers=None, send_body=True):
+        self.send_response(code)
+        _headers = {"Content-Length": str(len(body))}
+        _headers.update(headers or dict())
+
+        for _name, _value in _headers.items():
+            self.send_header(_name, _value)
+
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+
+class RepositoryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler=RepositoryHandler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.artifacts = dict()
+        self.requests = Counter()
+        self.checksum_headers = True
+        self.corrupt_puts = 0
+
+
+class HeadedStream(io.BytesIO):
+    """
+    Stream of internal repository response
+    """
+
+    def __init__(self, content, headers):
+        super().__init__(content)
+        self.headers = headers
+
+
+class MvnTransferTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RepositoryServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.nexus_api = NexusAPI(root=f"http://127.0.0.1:{self.server.server_address[1]}/artifactory",
+                                  user="user", auth="password")
+        self.gav = "g.CLIENT:a:1.0:zip"
+        self.path = "/artifactory/repo/g/CLIENT/a/1.0/a-1.0.zip"
+
+    def tearDown(self):
+        self.nexus_api.web.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def upload(self, content):
+        return upload_artifact(self.nexus_api, self.gav, "repo", io.BytesIO(content))
+
+    def test_identical_skipped(self):
+        self.assertTrue(self.upload(b"content"))
+        self.assertFalse(self.upload(b"content"))
+        self.assertEqual(b"content", self.server.artifacts[self.path])
+        self.assertEqual(1, self.server.requests["PUT"])
+        # no separate existence check after upload
+        self.assertEqual(2, self.server.requests["HEAD"])
+        self.assertEqual(0, self.server.requests["GET"])
+
+    def test_changed_uploaded(self):
+        self.assertTrue(self.upload(b"content"))
+        self.assertTrue(self.upload(b"other content"))
+        self.assertTrue(self.upload(b"another!"))
+        self.assertEqual(b"another!", self.server.artifacts[self.path])
+        self.assertEqual(3, self.server.requests["PUT"])
+
+    def test_checksum_file_used(self):
+        self.server.checksum_headers = False
+        self.assertTrue(self.upload(b"content"))
+        self.assertFalse(self.upload(b"content"))
+        self.assertEqual(1, self.server.requests["GET"])
+        self.assertEqual(1, self.server.requests["PUT"])
+
+    def test_corrupted_upload_failure(self):
+        self.server.corrupt_puts = 1
+
+        with self.assertRaises(NexusAPIError):
+            self.upload(b"content")
+
+    def test_connection_reused(self):
+        for _content in [b"first", b"second", b"second"]:
+            self.upload(_content)
+
+        self.assertEqual(1, self.server.requests["connections"])
+
+    def stream(self, content, headers=None):
+        return stream_artifact(self.nexus_api, self.gav, "repo", HeadedStream(content, headers or dict()),
+                               chunk_size=4)
+
+    def test_streamed(self):
+        self.assertTrue(self.stream(b"streamed content"))
+        self.assertEqual(b"streamed content", self.server.artifacts[self.path])
+        self.assertEqual(1, self.server.requests["chunked"])
+
+    def test_streamed_identical_skipped(self):
+        headers = {"Content-Length": "7", "X-Checksum-Sha1": hashlib.sha1(b"content").hexdigest()}
+        self.assertTrue(self.stream(b"content", headers))
+        self.assertFalse(self.stream(b"content", headers))
+        self.assertEqual(1, self.server.requests["PUT"])
+        # size is known, so body is not chunked
+        self.assertEqual(0, self.server.requests["chunked"])
+
+    def test_stream_corrupted_at_source_failure(self):
+        with self.assertRaises(NexusAPIError):
+            self.stream(b"content", {"X-Checksum-Sha1": hashlib.sha1(b"other").hexdigest()})
+
+    def test_stream_corrupted_at_target_failure(self):
+        self.server.corrupt_puts = 1
+
+        with self.assertRaises(NexusAPIError):
+            self.stream(b"content")
+
+    def test_removed(self):
+        self.upload(b"content")
+        remove_artifact(self.nexus_api, self.gav, "repo")
+        self.assertNotIn(self.path, self.server.artifacts)
+        # missing one is removed already
+        remove_artifact(self.nexus_api, self.gav, "repo")
+
+    def test_headers_md5(self):
+        self.assertEqual(hashlib.md5(b"content").hexdigest(),
+                         get_headers_md5({"X-Checksum-Md5": hashlib.md5(b"content").hexdigest().upper()}))
+        self.assertIsNone(get_headers_md5({"ETag": hashlib.sha1(b"content").hexdigest()}))
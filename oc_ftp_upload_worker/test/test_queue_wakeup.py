@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import unittest
+import socket
+import threading
+import time
+from ..queue_wakeup import BackoffPoller, PgNotificationWaiter
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class LocalNotificationSource(object):
+    """
+    In-process stand-in for listening psycopg2 connection: notifications are passed through socket pair
+    """
+
+    class Cursor(object):
+
+        def __init__(self, source):
+            self.source = source
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def execute(self, query):
+            self.source.executed.append(query)
+
+    def __init__(self):
+        self.__reader, self.__writer = socket.socketpair()
+        self.__reader.setblocking(False)
+        self.notifies = list()
+        self.executed = list()
+
+    def cursor(self):
+        return self.Cursor(self)
+
+    def fileno(self):
+        return self.__reader.fileno()
+
+    def poll(self):
+        try:
+            while True:
+                _data = self.__reader.recv(1024)
+
+                if not _data:
+                    break
+
+                self.notifies.extend(_data.split(b"\n")[:-1])
+        except BlockingIOError:
+            pass
+
+    def notify(self, payload):
+        self.__writer.send(payload + b"\n")
+
+    def close(self):
+        self.__reader.close()
+        self.__writer.close()
+
+
+class PgNotificationWaiterTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.source = LocalNotificationSource()
+        self.waiter = PgNotificationWaiter(self.source, "dlupload")
+
+    def tearDown(self):
+        self.waiter.close()
+
+    def test_channel_listened(self):
+        self.assertListEqual(['LISTEN "dlupload"'], self.source.executed)
+
+    def test_channel_required(self):
+        with self.assertRaises(ValueError):
+            PgNotificationWaiter(LocalNotificationSource(), None)
+
+    def test_timeout_without_notification(self):
+        self.assertFalse(self.waiter.wait(0.1))
+
+    def test_pending_notification_returned_immediately(self):
+        self.source.notify(b"1")
+        self.assertTrue(self.waiter.wait(5))
+        # notification is consumed
+        self.assertFalse(self.waiter.wait(0.1))
+
+    def test_wakeup_on_notification(self):
+        _timer = threading.Timer(0.2, self.source.notify, args=(b"2",))
+        _timer.start()
+        _started = time.monotonic()
+        self.assertTrue(self.waiter.wait(10))
+        self.assertLess(time.monotonic() - _started, 5)
+        _timer.join()
+
+
+class BackoffPollerTestSuite(unittest.TestCase):
+
+    def test_intervals_grow_and_reset(self):
+        poller = BackoffPoller(1, 5)
+        self.assertListEqual([1, 2, 4, 5, 5], [poller.next_interval() for _ in range(5)])
+        poller.reset()
+        self.assertEqual(1, poller.next_interval())
+
+    def test_fixed_interval(self):
+        poller = BackoffPoller(10, 10)
+        self.assertListEqual([10, 10, 10], [poller.next_interval() for _ in range(3)])
+
+    def test_expected_poll_shortens_interval(self):
+        now = [100]
+        poller = BackoffPoller(10, 80, clock=lambda: now[0])
+        poller.expect(25)
+        self.assertEqual(10, poller.next_interval())
+        now[0] = 110
+        # backoff would wait 20 seconds, message is due in 15
+        self.assertEqual(15, poller.next_interval())
+        now[0] = 125
+        self.assertEqual(40, poller.next_interval())
+
+    def test_invalid_intervals(self):
+        with self.assertRaises(ValueError):
+            BackoffPoller(5, 1)
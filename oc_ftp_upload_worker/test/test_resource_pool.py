@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import unittest
+import threading
+from ..resource_pool import ResourcePool
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class MockClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class MockConnection(object):
+
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+        self.resets = 0
+
+    def close(self):
+        self.closed = True
+
+
+class ResourcePoolTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+        self.created = list()
+        self.pool = ResourcePool(idle_timeout=10, max_age=100, clock=self.clock)
+        self.pool.register("ftp", self._create, check=lambda _c: _c.alive, reset=self._reset)
+
+    def _create(self):
+        _connection = MockConnection(len(self.created))
+        self.created.append(_connection)
+        return _connection
+
+    def _reset(self, connection):
+        connection.resets += 1
+
+    def test_connection_reused(self):
+        with self.pool.lease("ftp") as _first:
+            pass
+
+        with self.pool.lease("ftp") as _second:
+            pass
+
+        self.assertIs(_first, _second)
+        self.assertEqual(1, len(self.created))
+        self.assertEqual(2, _first.resets)
+        self.assertEqual(1, self.pool.idle_count("ftp"))
+
+    def test_lease_exclusive(self):
+        with self.pool.lease("ftp") as _first, self.pool.lease("ftp") as _second:
+            self.assertIsNot(_first, _second)
+
+        self.assertEqual(2, self.pool.idle_count("ftp"))
+
+    def test_lease_waits_for_free(self):
+        self.pool.register("svn", self._create, max_size=1)
+        _released = threading.Event()
+
+        def _hold():
+            with self.pool.lease("svn"):
+                _released.wait(5)
+
+        _holder = threading.Thread(target=_hold)
+        _holder.start()
+
+        while not self.created:
+            threading.Event().wait(0.01)
+
+        threading.Timer(0.1, _released.set).start()
+
+        with self.pool.lease("svn") as _connection:
+            self.assertTrue(_released.is_set())
+
+        _holder.join()
+        self.assertEqual(1, len(self.created))
+        self.assertIs(self.created[0], _connection)
+
+    def test_lease_timeout(self):
+        self.pool.register("svn", self._create, max_size=1)
+
+        with self.pool.lease("svn"):
+            with self.assertRaises(TimeoutError):
+                self.pool.acquire("svn", timeout=0)
+
+        with self.pool.lease("svn", timeout=0):
+            pass
+
+        self.assertEqual(1, len(self.created))
+
+    def test_closed_connection_frees_place(self):
+        self.pool.register("svn", self._create, check=lambda _c: _c.alive, max_size=1)
+
+        with self.pool.lease("svn") as _first:
+            pass
+
+        _first.alive = False
+
+        with self.pool.lease("svn", timeout=0) as _second:
+            self.assertIsNot(_first, _second)
+
+        self.assertTrue(_first.closed)
+
+    def test_failed_factory_frees_place(self):
+        self.pool.register("svn", lambda: [].pop(), max_size=1)
+
+        for _ in range(2):
+            with self.assertRaises(IndexError):
+                self.pool.acquire("svn", timeout=0)
+
+    def test_dead_connection_replaced(self):
+        with self.pool.lease("ftp") as _first:
+            pass
+
+        _first.alive = False
+
+        with self.pool.lease("ftp") as _second:
+            self.assertIsNot(_first, _second)
+
+        self.assertTrue(_first.closed)
+        self.assertFalse(_second.closed)
+
+    def test_idle_connection_evicted(self):
+        with self.pool.lease("ftp") as _first:
+            pass
+
+        self.clock.now = 11
+        self.pool.evict()
+        self.assertTrue(_first.closed)
+        self.assertEqual(0, self.pool.idle_count("ftp"))
+
+    def test_old_connection_recycled(self):
+        with self.pool.lease("ftp") as _first:
+            pass
+
+        for _now in range(5, 110, 5):
+            self.clock.now = _now
+
+            with self.pool.lease("ftp") as _connection:
+                pass
+
+        self.assertTrue(_first.closed)
+        self.assertIsNot(_first, _connection)
+        self.assertEqual(2, len(self.created))
+
+    def test_failed_reset_closes(self):
+        self.pool.register("smtp", self._create, reset=lambda _c: _c.missing_method())
+
+        with self.pool.lease("smtp") as _connection:
+            pass
+
+        self.assertTrue(_connection.closed)
+        self.assertEqual(0, self.pool.idle_count("smtp"))
+
+    def test_close(self):
+        _leased = self.pool.acquire("ftp")
+
+        with self.pool.lease("ftp") as _idle:
+            pass
+
+        self.pool.close()
+        self.assertTrue(_idle.closed)
+        self.assertFalse(_leased.closed)
+        self.pool.release("ftp", _leased)
+        self.assertTrue(_leased.closed)
+
+        with self.assertRaises(ValueError):
+            self.pool.acquire("ftp")
+
+    def test_concurrent_leases(self):
+        _leased = set()
+        _lock = threading.Lock()
+        _errors = list()
+
+        def _use():
+            for _ in range(50):
+                with self.pool.lease("ftp") as _connection:
+                    with _lock:
+                        if _connection.number in _leased:
+                            _errors.append(_connection.number)
+
+                        _leased.add(_connection.number)
+
+                    with _lock:
+                        _leased.discard(_connection.number)
+
+        _threads = [threading.Thread(target=_use) for _ in range(4)]
+        [_t.start() for _t in _threads]
+        [_t.join() for _t in _threads]
+        self.assertListEqual([], _errors)
+        self.assertLessEqual(len(self.created), 4)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import unittest
+from fs.tempfs import TempFS
+from ..scratch import ScratchSpace
+from ..upload_errors import ScratchSpaceError, DeliveryUploadError
+
+import logging
+logging.getLogger().propagate = False
+logging.getLogger().disabled = True
+
+
+class ScratchSpaceTestSuite(unittest.TestCase):
+
+    def setUp(self):
+        self.root_fs = TempFS()
+        self.root = self.root_fs.getsyspath("/")
+        self.scratch = ScratchSpace(root=os.path.join(self.root, "scratch"), fast_root=os.path.join(self.root, "fast"),
+                                    fast_max_bytes=1024)
+
+    def tearDown(self):
+        self.scratch.close()
+        self.root_fs.close()
+
+    def free(self):
+        return shutil.disk_usage(self.root).free
+
+    def sessions(self, root="scratch"):
+        return [_name for _name in os.listdir(os.path.join(self.root, root)) if _name.startswith("dlscratch-")]
+
+    def test_directory_removed_on_close(self):
+        work_fs = self.scratch.open(size=2048)
+        work_fs.writebytes("clean_file", b"content")
+        path = work_fs.getsyspath("/")
+        self.assertTrue(path.startswith(os.path.join(self.root, "scratch", self.sessions()[0])))
+        self.assertEqual(2048, self.scratch.stats()["reserved"])
+        work_fs.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual({"opened": 1, "fast": 0, "rejected": 0, "reserved": 0}, self.scratch.stats())
+
+    def test_small_placed_to_fast_root(self):
+        with self.scratch.open(size=1024) as small_fs, self.scratch.open() as unknown_fs:
+            self.assertTrue(small_fs.getsyspath("/").startswith(os.path.join(self.root, "fast")))
+            self.assertTrue(unknown_fs.getsyspath("/").startswith(os.path.join(self.root, "scratch")))
+
+        self.assertEqual(1, self.scratch.stats()["fast"])
+
+    def test_not_fitting_refused(self):
+        with self.assertRaises(DeliveryUploadError):
+            self.scratch.open(size=self.free() + 1024 * 1024 * 1024)
+
+        self.assertEqual(1, self.scratch.stats()["rejected"])
+
+    def test_reserved_space_not_given_twice(self):
+        size = self.free() * 2 // 3
+
+        with self.scratch.open(size=size):
+            with self.assertRaises(ScratchSpaceError):
+                self.scratch.open(size=size)
+
+        self.scratch.open(size=size).close()
+
+    def test_stale_sessions_removed(self):
+        self.scratch.open().close()
+        # session of living process is locked
+        alive = self.sessions()[0]
+        stale = os.path.join(self.root, "scratch", "dlscratch-1-stale")
+        os.makedirs(os.path.join(stale, "dlwork"))
+        open(os.path.join(stale, ".lock"), mode="w").close()
+        other_scratch = ScratchSpace(root=os.path.join(self.root, "scratch"))
+
+        try:
+            other_scratch.open().close()
+            self.assertFalse(os.path.exists(stale))
+            self.assertIn(alive, self.sessions())
+            self.assertEqual(2, len(self.sessions()))
+        finally:
+            other_scratch.close()
+
+        self.assertEqual([alive], self.sessions())
+
+    def test_close_removes_sessions(self):
+        self.scratch.open(size=1024)
+        self.scratch.open(size=2048)
+        self.scratch.close()
+        self.assertEqual([], self.sessions("scratch"))
+        self.assertEqual([], self.sessions("fast"))
@@ -5,14 +5,21 @@ import django.test
 import os
 from fs.tempfs import TempFS
 from types import MethodType
-from oc_delivery_apps.checksums.models import Files, Locations, CiTypes, LocTypes
+from oc_delivery_apps.checksums.models import Files, Locations, CiTypes, LocTypes, CheckSums, CsTypes, CsProv
 from oc_delivery_apps.dlmanager.models import Delivery, Client, ClientEmailAddress, FtpUploadClientOptions
-from ..upload_steps import get_pending_deliveries, notify_client
+from ..upload_steps import get_pending_deliveries, notify_client, get_registered_md5
 from ..independent_upload import process_client_deliveries_independently, process_clients_independently
 from ..upload_errors import DeliveryUploadError, ClientSetupError, EnvironmentSetupError
-from ..ClientDeliverySender import ConnectionsContext, EncryptingSender
+from ..ClientDeliverySender import ConnectionsContext, EncryptingSender, MvnSender
+from ..resource_pool import ResourcePool
+from ..delivery_staging import DeliveryStaging
 from .test_keys import TestKeys
+from fs.memoryfs import MemoryFS
+import copy
 import posixpath
+import threading
+import time
+import unittest.mock
 
 import logging
 logging.getLogger().propagate = False
@@ -94,6 +101,36 @@ class PendingQueueTestSuite(UploadStepsBaseTestCase):
         pending_deliveries = get_pending_deliveries()
         self.assertListEqual(sorted([2, 5, 6]), sorted([dlv.pk for dlv in pending_deliveries]))
 
+    def test_client_pending_deliveries(self):
+        clients = Client.objects.filter(code=self._kwargs['client_code_1'])
+        pending_deliveries = get_pending_deliveries(clients)
+        self.assertListEqual(sorted([2, 6]), sorted([dlv.pk for dlv in pending_deliveries]))
+        self.assertListEqual([], list(get_pending_deliveries([])))
+
+    def test_locations_checked_at_once(self):
+        citype, _ = CiTypes.objects.get_or_create(code="TEST")
+        delivery_file, _ = Files.objects.get_or_create(ci_type=citype)
+        at_nexus, _ = LocTypes.objects.get_or_create(code="NXS")
+        Locations(file=delivery_file, loc_type=at_nexus, path=Delivery.objects.get(pk=5).gav).save()
+
+        # deliveries, current and historical locations
+        with self.assertNumQueries(3):
+            pending_deliveries = get_pending_deliveries()
+
+        self.assertListEqual(sorted([2, 5, 6]), sorted([dlv.pk for dlv in pending_deliveries]))
+
+    def test_registered_md5(self):
+        citype, _ = CiTypes.objects.get_or_create(code="TEST")
+        delivery_file, _ = Files.objects.get_or_create(ci_type=citype)
+        at_nexus, _ = LocTypes.objects.get_or_create(code="NXS")
+        md5, _ = CsTypes.objects.get_or_create(code="MD5")
+        Locations(file=delivery_file, loc_type=at_nexus, path=Delivery.objects.get(pk=2).gav).save()
+        checksum = CheckSums(file=delivery_file, cs_type=md5, checksum="0123456789abcdef0123456789abcdef")
+        checksum.save()
+        CsProv(cs=checksum, cs_prov="Regular").save()
+        self.assertEqual("0123456789abcdef0123456789abcdef", get_registered_md5(Delivery.objects.get(pk=2).gav))
+        self.assertIsNone(get_registered_md5(Delivery.objects.get(pk=5).gav))
+
 class ClientProcessingTestSuite(UploadStepsBaseTestCase):
 
     def get_sender_params(self):
@@ -141,6 +178,108 @@ class ClientProcessingTestSuite(UploadStepsBaseTestCase):
         self.assertListEqual(sorted([2]), sorted([dlv.pk for dlv in result.sent_deliveries]))
         self.assertEqual(1, len(result.raised_errors))
 
+    def test_parallel_upload(self):
+        for _version in range(7, 17):
+            Delivery(groupid=f"g.{self._kwargs['client_code_1']}", artifactid="a", version=f"v{_version}",
+                     flag_approved=True, flag_uploaded=False, flag_failed=False, pk=_version).save()
+
+        class ParallelMockSender(object):
+            def __init__(self, context=None):
+                self.context = context
+                # shared by all copies
+                self.lock = threading.Lock()
+                self.stats = {"active": 0, "max_active": 0, "contexts": set()}
+
+            def with_context(self, context):
+                sender = copy.copy(self)
+                sender.context = context
+                return sender
+
+            def get_connections_limit(self):
+                return 3
+
+            def send_delivery(self, delivery):
+                with self.lock:
+                    self.stats["active"] += 1
+                    self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+                    self.stats["contexts"].add(id(self.context))
+
+                time.sleep(0.05)
+
+                with self.lock:
+                    self.stats["active"] -= 1
+
+                if delivery.pk == 6:
+                    raise DeliveryUploadError("fail")
+
+        pool = ResourcePool()
+        pool.register("mvn", MemoryFS)
+        pool.register("ftp", MemoryFS)
+        to_process = get_pending_deliveries().filter(groupid__endswith=self._kwargs['client_code_1'])
+        sender = ParallelMockSender()
+        result = process_client_deliveries_independently(to_process, sender, workers=8, resource_pool=pool)
+        pool.close()
+
+        self.assertListEqual([dlv.pk for dlv in to_process if dlv.pk != 6],
+                             [dlv.pk for dlv in result.sent_deliveries])
+        self.assertEqual(1, len(result.raised_errors))
+        # limited by destination, each worker has its own connections
+        self.assertEqual(3, sender.stats["max_active"])
+        self.assertEqual(3, len(sender.stats["contexts"]))
+
+    def test_parallel_leases_required_only(self):
+        class MvnMockSender(MockSender):
+            def with_context(self, context):
+                self.logged_calls.append(context)
+                return self
+
+            def get_connections_limit(self):
+                return 2
+
+            def required_connections(self):
+                return ("mvn",)
+
+        pool = ResourcePool()
+        # leasing FTP fails
+        pool.register("mvn", MemoryFS)
+        to_process = get_pending_deliveries().filter(groupid__endswith=self._kwargs['client_code_1'])
+        sender = MvnMockSender()
+        result = process_client_deliveries_independently(to_process, sender, workers=2, resource_pool=pool)
+        pool.close()
+        self.assertListEqual(sorted([2, 6]), sorted([dlv.pk for dlv in result.sent_deliveries]))
+        self.assertIsNone(sender.logged_calls[0].base_ftp_fs)
+
+    def test_parallel_exhausted_pool(self):
+        class ContextMockSender(MockSender):
+            def with_context(self, context):
+                self.logged_calls.append(context)
+                return self
+
+            def get_connections_limit(self):
+                return 2
+
+        pool = ResourcePool()
+        pool.register("mvn", MemoryFS)
+        pool.register("ftp", MemoryFS, max_size=1)
+        to_process = get_pending_deliveries().filter(groupid__endswith=self._kwargs['client_code_1'])
+        sender = ContextMockSender()
+
+        with pool.lease("ftp"):
+            result = process_client_deliveries_independently(to_process, sender, workers=2, resource_pool=pool)
+
+        self.assertListEqual(sorted([2, 6]), sorted([dlv.pk for dlv in result.sent_deliveries]))
+        # sent by the sender itself, MVN connection taken for the second worker is given back
+        self.assertListEqual(sorted([2, 6]), sorted(sender.logged_calls))
+        self.assertEqual(1, pool.idle_count("mvn"))
+        pool.close()
+
+    def test_parallel_needs_pool(self):
+        to_process = get_pending_deliveries().filter(groupid__endswith=self._kwargs['client_code_1'])
+        sender = MockSender()
+        sender.get_connections_limit = lambda: 4
+        result = process_client_deliveries_independently(to_process, sender, workers=4)
+        self.assertListEqual(sorted([2, 6]), sorted([dlv.pk for dlv in result.sent_deliveries]))
+
     def test_single_client_fails_skipped(self):
         # no any setup for second client
         self.get_sender_params()
@@ -153,6 +292,43 @@ class ClientProcessingTestSuite(UploadStepsBaseTestCase):
         self.assertEqual(1, len(result.raised_errors))
         self.assertIsInstance(result.raised_errors.pop(0), ClientSetupError)
 
+    def test_staging_released_after_client_failure(self):
+        # second client has no keys, so its sender fails before fetching anything
+        self.get_sender_params()
+        self._kwargs.pop('client')
+        closed = list()
+
+        class CheckedStaging(DeliveryStaging):
+            def close(self):
+                closed.append((self.expected_count(), self.staged_count()))
+                super().close()
+
+        with unittest.mock.patch("oc_ftp_upload_worker.independent_upload.DeliveryStaging", CheckedStaging):
+            process_clients_independently(get_pending_deliveries(), Client.objects.all(), **self._kwargs)
+
+        self.assertListEqual([(0, 0)], closed)
+
+    def test_deliveries_fanned_out_one_by_one(self):
+        self.get_sender_params()
+        self._kwargs.pop('client')
+
+        with open(self._kwargs['delivery_destinations_file'], mode='wt') as _config:
+            _config.write(f"{self._kwargs['client_code_1']}:\n  - artifactory:\n      target_repo: external\n")
+
+        staged = list()
+
+        def _upload_delivery(sender, delivery, processed_file_name, work_fs, target_dir):
+            staged.append(sender.kwargs['delivery_staging'].staged_count())
+
+        with unittest.mock.patch.object(MvnSender, "_upload_delivery", _upload_delivery):
+            result = process_clients_independently(get_pending_deliveries(),
+                                                   Client.objects.filter(code=self._kwargs['client_code_1']),
+                                                   **self._kwargs)
+
+        self.assertListEqual(sorted([2, 6]), sorted([dlv.pk for dlv in result.sent_deliveries]))
+        # the next delivery is staged only after the previous one is sent everywhere
+        self.assertListEqual([1, 1], staged)
+
     def test_only_receiving_client_processed(self):
         # no any setup for second client
         client = Client.objects.get(code=self._kwargs['client_code_1'])
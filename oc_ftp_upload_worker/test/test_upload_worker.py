@@ -45,3 +45,92 @@ class UploadWorkerTest(django.test.TransactionTestCase):
     def test_upload_to_ftp_no_client_provided(self):
         with self.assertRaises(ValueError):
             self.app.upload_to_ftp(client=None)
+
+    def test_custom_run_finishes_messages(self):
+        class StopLoop(Exception):
+            pass
+
+        self.app.queue_name = 'cdt.dlupload.input'
+        self.app.sleep = "0"
+        self.app.workers = 2
+        self.app.pgq = unittest.mock.MagicMock()
+        self.app.pgq.new_msg_from_queue.side_effect = [
+                (["upload_delivery", [self.client_code], {}], 1),
+                (["upload_delivery", [], {}], 2),
+                None,
+                StopLoop()]
+
+        with unittest.mock.patch.object(self.app, 'upload_delivery') as _x:
+            with self.assertRaises(StopLoop):
+                self.app.custom_run()
+
+            _x.assert_called_once_with(self.client_code)
+
+        self.app.pgq.msg_proc_end.assert_called_once_with(1, comment_text=None)
+        self.app.pgq.msg_proc_fail.assert_called_once_with(2, error_message='Invalid message structure')
+
+    def test_messages_claimed_while_workers_free(self):
+        dispatcher = unittest.mock.MagicMock()
+        dispatcher.free_capacity.return_value = 1
+        # the first client joins messages waiting for it
+        dispatcher.takes_capacity.side_effect = lambda client_code: client_code != self.client_code
+        self.app.queue_name = 'cdt.dlupload.input'
+        self.app.pgq = unittest.mock.MagicMock()
+        self.app.pgq.new_msg_from_queue.side_effect = [
+                (["upload_delivery", [self.client_code], {}], 1),
+                (["upload_delivery", [], {}], 2),
+                (["upload_delivery", ["SOMOTHER"], {}], 3),
+                (["upload_delivery", ["SOMTHIRD"], {}], 4)]
+
+        claimed = self.app.claim_messages(10, dispatcher)
+        self.assertListEqual([1, 2, 3], [_msg_id for _, _msg_id in claimed])
+        self.assertEqual(3, self.app.pgq.new_msg_from_queue.call_count)
+
+    def test_custom_run_polls_when_notified_message_is_due(self):
+        class StopLoop(Exception):
+            pass
+
+        self.app.queue_name = 'cdt.dlupload.input'
+        self.app.sleep = "600"
+        self.app.sleep_min = "600"
+        self.app.workers = 1
+        self.app.pgq = unittest.mock.MagicMock()
+        self.app.pgq.new_msg_from_queue.side_effect = [None, StopLoop()]
+        waiter = unittest.mock.MagicMock()
+        # notification arrives during the first wait only
+        waiter.wait.side_effect = [True, False]
+
+        with unittest.mock.patch.object(self.app, 'get_queue_waiter', return_value=waiter):
+            with self.assertRaises(StopLoop):
+                self.app.custom_run()
+
+        self.assertEqual(600, waiter.wait.call_args_list[0].args[0])
+        # no useless poll before the message may be taken
+        self.assertAlmostEqual(61, waiter.wait.call_args_list[1].args[0], delta=1)
+        self.assertEqual(2, self.app.pgq.new_msg_from_queue.call_count)
+        waiter.close.assert_called_once()
+
+    def test_custom_run_joins_client_messages(self):
+        class StopLoop(Exception):
+            pass
+
+        self.app.queue_name = 'cdt.dlupload.input'
+        self.app.sleep = "0"
+        self.app.workers = 2
+        self.app.batch_size = 5
+        self.app.pgq = unittest.mock.MagicMock()
+        # the same client's messages are taken together while another worker is free
+        self.app.pgq.new_msg_from_queue.side_effect = [
+                (["upload_delivery", [self.client_code], {}], 1),
+                (["upload_delivery", [self.client_code], {}], 2),
+                (["upload_delivery", ["SOMOTHER"], {}], 3),
+                None,
+                StopLoop()]
+
+        with unittest.mock.patch.object(self.app, 'upload_delivery') as _x:
+            with self.assertRaises(StopLoop):
+                self.app.custom_run()
+
+            self.assertListEqual(sorted([self.client_code, "SOMOTHER"]), sorted([_c.args[0] for _c in _x.call_args_list]))
+
+        self.assertListEqual([1, 2, 3], sorted([_c.args[0] for _c in self.app.pgq.msg_proc_end.call_args_list]))
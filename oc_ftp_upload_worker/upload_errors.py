@@ -20,6 +20,11 @@ class DeliveryEncryptionError(DeliveryUploadError):
     pass
 
 
+class ScratchSpaceError(DeliveryUploadError):
+    """ Delivery wasn't downloaded because local disk has not enough free space for it """
+    pass
+
+
 class ClientSetupError(UploadProcessException):
     """ Error in external resource related to client """
     pass
@@ -3,8 +3,10 @@
 
 
 import logging
+from django.db.models import Q
+from django.utils import timezone
+from oc_delivery_apps.checksums.models import Locations, LocTypes, CsTypes
 from oc_delivery_apps.checksums.controllers import CheckSumsController
-from oc_delivery_apps.checksums.models import Locations, LocTypes
 from oc_delivery_apps.dlmanager.models import Client, Delivery
 from .upload_errors import DeliveryUploadError, ClientSetupError, EnvironmentSetupError
 import os
@@ -14,34 +16,84 @@ from oc_cdtapi.NexusAPI import gav_to_path, parse_gav
 from string import Template
 
 
-def get_pending_deliveries():
+def get_pending_deliveries(clients=None):
     """ Retrieves deliveries that should be uploaded from database. Checks technical status (only flag_approved should be set) and history (deliveries with archive removed from Nexus are skipped)
 
+    :param list clients: clients to retrieve deliveries for, all clients if not given
     :return QuerySet: pending deliveries
     """
     pending_deliveries = Delivery.objects.filter(flag_approved=True, flag_uploaded=False, flag_failed=False)
-    sendable_deliveries = filter(_is_sendable, pending_deliveries)
+
+    if clients is not None:
+        _clients_filter = Q(pk__in=[])
+
+        for client in clients:
+            _clients_filter |= Q(groupid__endswith=client.code)
+
+        pending_deliveries = pending_deliveries.filter(_clients_filter)
+
+    pending_deliveries = list(pending_deliveries)
+    deleted_gavs = _get_deleted_locations([dlv.gav for dlv in pending_deliveries])
+    unsendable_deliveries = [dlv for dlv in pending_deliveries if dlv.gav in deleted_gavs]
+
+    if unsendable_deliveries:
+        logging.warning(f"Deliveries are unsendable: {', '.join([dlv.gav for dlv in unsendable_deliveries])}")
+
     # convert it back to QuerySet for easier further usage
-    sendable_ids = [dlv.pk for dlv in sendable_deliveries]
-    unsendable_deliveries = pending_deliveries.exclude(pk__in=sendable_ids)
-    logging.warning(f"Deliveries are unsendable: {', '.join([dlv.gav for dlv in unsendable_deliveries])}")
-    processed_deliveries = pending_deliveries.filter(pk__in=sendable_ids)
-    return processed_deliveries
+    sendable_ids = [dlv.pk for dlv in pending_deliveries if dlv.gav not in deleted_gavs]
+    return Delivery.objects.filter(pk__in=sendable_ids)
+
+
+def _get_deleted_locations(gavs, chunk_size=500):
+    """
+    Finds GAVs which were registered at Nexus once but are absent there now.
+    Files not registered at all are not reported since it may be old delivery without file registered.
+    :param list gavs: delivery GAVs to check
+    :param int chunk_size: maximal number of GAVs passed to single query
+    :return set: GAVs removed from Nexus
+    """
+    _location_filter = dict(loc_type__code="NXS", input_date__lte=timezone.now(), revision=None, file_dst=None)
+    gavs = list(set(gavs))
+    existing_gavs = set()
+    existed_gavs = set()
+
+    for _start in range(0, len(gavs), chunk_size):
+        _chunk = gavs[_start:_start + chunk_size]
+        existing_gavs.update(Locations.objects.filter(path__in=_chunk, **_location_filter).values_list("path", flat=True))
+        _absent = [_gav for _gav in _chunk if _gav not in existing_gavs]
+
+        if _absent:
+            existed_gavs.update(Locations.history.filter(path__in=_absent, **_location_filter).values_list("path", flat=True))
+
+    return existed_gavs
+
+
+def get_registered_md5(gav):
+    """
+    :param str gav: delivery GAV
+    :return str: MD5 of delivery content registered at Nexus location, None if not registered
+    """
+    return CheckSumsController().get_location_checksum(gav, "NXS")
 
 
-def _is_sendable(delivery):
+def register_processed_location(path, loc_type, checksums, clean_gav):
     """
-    Check if delivery can be send
-    :param dlmanager.Delivery delivery: delivery record
-    :return bool: may be send or not
+    Registers processed delivery at its location with checksums computed while it was uploaded.
+    CI type of clean delivery registered at Nexus is used, it is detected by path otherwise.
+    :param str path: location path
+    :param str loc_type: location type code
+    :param dict checksums: hex digests by algorithm name: 'md5', 'sha1' and 'sha256'
+    :param str clean_gav: GAV of clean delivery
     """
-    controller = CheckSumsController()
-    exists_now = bool(controller.get_file_by_location(delivery.gav, "NXS", history=False))
-    existed_ever = bool(controller.get_file_by_location(delivery.gav, "NXS", history=True))
-    # we only want to exclude files with explicit location removal
-    # if file wasn't found at all, it may be because of old delivery without file registered
-    was_deleted = existed_ever and not exists_now
-    return not was_deleted
+    _controller = CheckSumsController()
+    _clean_file = _controller.get_file_by_location(clean_gav, "NXS", history=False)
+    _controller.add_location_checksum(checksums["md5"], path, loc_type,
+                                      _clean_file.ci_type.code if _clean_file else None)
+    _file = _controller.get_file_by_location(path, loc_type, history=False)
+
+    # other checksum types are optional in database
+    for _cs_type in CsTypes.objects.filter(code__in=["SHA1", "SHA256"]).values_list("code", flat=True):
+        _controller.add_checksum(_file, checksums[_cs_type.lower()], cs_type=_cs_type)
 
 
 def notify_deliveries_recipients(mailer, clients, deliveries, **kwargs):
@@ -2,13 +2,22 @@
 
 from oc_dlinterface.dlupload_worker_interface import queue_published, UploadWorkerServer
 import os
-import time
 import argparse
+import threading
 import logging
 from oc_orm_initializator.orm_initializator import OrmInitializator
 import pkg_resources
 from oc_logging.Logging import setup_logging
 from oc_cdtapi import PgQAPI
+from .message_dispatcher import ClientMessageDispatcher
+from .queue_wakeup import BackoffPoller, SleepWaiter, PgNotificationWaiter, CLAIM_DELAY
+from .resource_pool import create_resource_pool
+from .keys_cache import ClientKeysCache
+from .crypto_executor import CryptoExecutor
+from .compression_policy import CompressionPolicy
+from .artifact_cache import ArtifactCache
+from .scratch import ScratchSpace
+from .ftp_session import FtpSessions
 
 class UploadWorkerApplication(UploadWorkerServer):
 
@@ -28,30 +37,112 @@ class UploadWorkerApplication(UploadWorkerServer):
         msg = None
         logging.debug('Entering main loop')
         logging.debug('self.queue_name is [%s]' % self.queue_name)
-        while True:
-            client_code = None
-            ds = self.pgq.new_msg_from_queue(self.queue_name)
-            if not ds:
-                logging.debug('No new messages in queue.')
-                logging.debug('Sleeping [%s]' % self.sleep)
-                time.sleep(int(self.sleep))
-                continue
-            msg, msg_id = ds
-            logging.debug('new_msg_from_queue id [%s] is [%s]' % (msg_id, msg) )
-            if not msg or len(msg) < 2 or not msg[1] or len(msg[1]) < 1:
-                logging.error('Invalid message structure: %s', msg)
-                self.finish_msg_prc(msg_id, 'F', 'Invalid message structure')
-                continue
-            client_code = msg[1][0]
-            logging.debug('client_code from message: [%s]' % client_code)
-            logging.debug('Calling upload_delivery')
-            try:
-                self.upload_delivery(client_code)
-            except Exception as e:
-                em = str(e)
-                self.finish_msg_prc(msg_id, 'F', em)
-                continue
-            self.finish_msg_prc(msg_id, 'P')
+        # claiming several messages at once makes sense only if messages for the same client are joined
+        dispatcher = ClientMessageDispatcher(self.upload_delivery_threaded, self.finish_msg_prc,
+                                             workers=self.workers, coalesce=self.batch_size > 1)
+        poller = BackoffPoller(min(float(self.sleep_min), float(self.sleep)), float(self.sleep))
+        waiter = self.get_queue_waiter()
+
+        try:
+            while True:
+                # do not claim messages we are not able to start soon
+                dispatcher.wait_for_capacity()
+                claimed = self.claim_messages(self.batch_size, dispatcher)
+
+                if not claimed:
+                    logging.debug('No new messages in queue.')
+                    _interval = poller.next_interval()
+                    logging.debug('Waiting [%s]' % _interval)
+
+                    while waiter.wait(_interval):
+                        # new message was enqueued, but it can't be taken earlier than PgQAPI gives it out:
+                        # poll right then instead of now, a second later to tolerate clocks difference
+                        poller.expect(CLAIM_DELAY + 1)
+                        _interval = poller.next_interval()
+                        logging.debug('Message enqueued, waiting [%s]' % _interval)
+
+                    continue
+
+                poller.reset()
+
+                # client code ==> message ids, one upload run for each client
+                client_messages = dict()
+
+                for msg, msg_id in claimed:
+                    logging.debug('new_msg_from_queue id [%s] is [%s]' % (msg_id, msg) )
+                    client_code = _get_client_code(msg)
+                    if client_code is None:
+                        logging.error('Invalid message structure: %s', msg)
+                        self.finish_msg_prc(msg_id, 'F', 'Invalid message structure')
+                        continue
+                    logging.debug('client_code from message: [%s]' % client_code)
+                    client_messages.setdefault(client_code, list()).append(msg_id)
+
+                for client_code, msg_ids in client_messages.items():
+                    logging.debug('Submitting upload_delivery for [%s], messages: %s' % (client_code, msg_ids))
+                    dispatcher.submit(client_code, *msg_ids)
+        finally:
+            waiter.close()
+            logging.debug('Waiting for accepted messages to finish')
+            dispatcher.shutdown(wait=True)
+
+    def get_queue_waiter(self):
+        """
+        Creates an object to wait for new messages with. Notification channel is listened if configured.
+        :return: object with 'wait(timeout)' and 'close()' methods
+        """
+        if not self.queue_channel:
+            return SleepWaiter()
+
+        logging.info('Waiting for notifications on [%s]' % self.queue_channel)
+        # separate connection: listening one must not be shared with queries from other threads
+        return PgNotificationWaiter(self.pgq.pg_connect(), self.queue_channel)
+
+    def claim_messages(self, count, dispatcher=None):
+        """
+        Takes up to 'count' new messages from queue, marking them as active.
+        If dispatcher is given, a message is taken only while dispatcher is able to start it,
+        messages joining ones already taken or waiting for the same client do not need a free worker.
+        :param int count: maximum number of messages to take
+        :param ClientMessageDispatcher dispatcher: dispatcher messages will be submitted to
+        :return list: (msg, msg_id) tuples
+        """
+        claimed = list()
+        free = dispatcher.free_capacity() if dispatcher else count
+        # clients of messages taken, each of them needs a single worker at most
+        clients = set()
+
+        with self.pgq_lock:
+            while len(claimed) < count and free > 0:
+                ds = self.pgq.new_msg_from_queue(self.queue_name)
+
+                if not ds:
+                    break
+
+                claimed.append(ds)
+                client_code = _get_client_code(ds[0])
+
+                if client_code is None or client_code in clients:
+                    continue
+
+                clients.add(client_code)
+
+                if not dispatcher or dispatcher.takes_capacity(client_code):
+                    free -= 1
+
+        return claimed
+
+    def upload_delivery_threaded(self, client):
+        """
+        Wrapper for upload_delivery called from dispatcher threads.
+        Each thread gets its own database connections, they have to be released after processing.
+        :param str client: client code
+        """
+        try:
+            self.upload_delivery(client)
+        finally:
+            from django.db import connections
+            connections.close_all()
 
     def finish_msg_prc(self, msg_id, status, message=None):
         """
@@ -61,13 +152,15 @@ class UploadWorkerApplication(UploadWorkerServer):
         :param str message: optional error/comment message
         """
         logging.debug('Reached finish_msg_prc')
-        if status == 'P':
-            logging.debug('Status is [P]rocessed. Calling msg_proc_end')
-            self.pgq.msg_proc_end(msg_id, comment_text=message)
-        else:
-            logging.debug('Status in not [P]rocessed, calling msg_proc_fail')
-            self.pgq.msg_proc_fail(msg_id, error_message=message)
-            
+        # messages are finished from dispatcher threads while main loop polls the queue
+        with self.pgq_lock:
+            if status == 'P':
+                logging.debug('Status is [P]rocessed. Calling msg_proc_end')
+                self.pgq.msg_proc_end(msg_id, comment_text=message)
+            else:
+                logging.debug('Status in not [P]rocessed, calling msg_proc_fail')
+                self.pgq.msg_proc_fail(msg_id, error_message=message)
+
 
     def __init__(self, *args, **kvargs):
         """
@@ -76,6 +169,19 @@ class UploadWorkerApplication(UploadWorkerServer):
         """
         self.setup_orm = kvargs.pop('setup_orm', True)
         self.msg_source = None
+        self.workers = 1
+        self.batch_size = 1
+        self.sleep = "10"
+        self.sleep_min = "10"
+        self.queue_channel = None
+        self.pgq_lock = threading.Lock()
+        self.resource_pool = None
+        self.keys_cache = None
+        self.crypto_executor = None
+        self.compression_policy = None
+        self.ftp_sessions = None
+        self.artifact_cache = None
+        self.scratch = None
         super().__init__(*args, **kvargs)
 
     def __fix_args(self, args):
@@ -130,7 +236,26 @@ class UploadWorkerApplication(UploadWorkerServer):
         args = self.__fix_args(args)
         self.msg_source = args.msg_source
         self.sleep = args.sleep
+        self.sleep_min = args.sleep_min or args.sleep
+        self.queue_channel = args.queue_channel
+        self.workers = int(args.workers)
+        self.batch_size = int(args.batch_size)
         self.queue_name = 'cdt.dlupload.input'
+        # connections are kept between messages, so they are created lazily on first use
+        self.scratch = ScratchSpace(root=args.scratch_dir, fast_root=args.scratch_fast_dir,
+                                    fast_max_bytes=int(float(args.scratch_fast_max_size) * 1024 * 1024),
+                                    min_free_bytes=int(float(args.scratch_min_free) * 1024 * 1024))
+        self.resource_pool = create_resource_pool(scratch=self.scratch, **args.__dict__)
+        self.keys_cache = ClientKeysCache(ftp_ttl=float(args.ftp_dir_cache_ttl))
+        self.crypto_executor = CryptoExecutor(workers=int(args.crypto_workers),
+                                              processes=args.crypto_executor.lower() == "process")
+        self.compression_policy = CompressionPolicy()
+        self.ftp_sessions = FtpSessions(probe_after=float(args.ftp_probe_after), max_idle=float(args.ftp_max_idle),
+                                        keepalive_interval=float(args.ftp_keepalive_interval))
+
+        if args.artifact_cache_dir:
+            self.artifact_cache = ArtifactCache(args.artifact_cache_dir,
+                                                max_bytes=int(float(args.artifact_cache_size) * 1024 * 1024))
 
         # just log the arguments
         for _k, _v in args.__dict__.items():
@@ -208,7 +333,8 @@ class UploadWorkerApplication(UploadWorkerServer):
 
         client = self.get_client_info(client)
         from .client_availability_update import update_send_availability_statuses
-        update_send_availability_statuses(client, **self.args.__dict__)
+        update_send_availability_statuses(client, resource_pool=self.resource_pool, keys_cache=self.keys_cache,
+                                          **self.args.__dict__)
 
     def upload_to_ftp(self, client):
         """
@@ -222,7 +348,10 @@ class UploadWorkerApplication(UploadWorkerServer):
         client = self.get_client_info(client)
 
         from .ftp_connect import perform_upload
-        perform_upload(client, **self.args.__dict__)
+        perform_upload(client, resource_pool=self.resource_pool, keys_cache=self.keys_cache,
+                       crypto_executor=self.crypto_executor, compression_policy=self.compression_policy,
+                       ftp_sessions=self.ftp_sessions, artifact_cache=self.artifact_cache,
+                       scratch=self.scratch, **self.args.__dict__)
 
     def custom_args(self, parser):
         """
@@ -235,6 +364,95 @@ class UploadWorkerApplication(UploadWorkerServer):
 
         parser.add_argument("--msg-source", dest="msg_source", help="The source of messages - amqp or db", default=os.getenv("MSG_SOURCE"))
         parser.add_argument("--sleep", dest="sleep", help="Seconds between new messages queries", default="10")
+        parser.add_argument("--sleep-min", dest="sleep_min",
+                            help="Seconds between new messages queries right after activity, grows up to '--sleep' while queue is empty",
+                            default=os.getenv("SLEEP_MIN"))
+        parser.add_argument("--queue-channel", dest="queue_channel",
+                            help="PSQL notification channel to wait for new messages on instead of plain sleep",
+                            default=os.getenv("QUEUE_CHANNEL"))
+        parser.add_argument("--workers", dest="workers", help="Messages for different clients processed in parallel",
+                            default=os.getenv("WORKERS") or "1")
+        parser.add_argument("--batch-size", dest="batch_size",
+                            help="Messages to take from queue at once, messages for the same client are processed with single upload",
+                            default=os.getenv("BATCH_SIZE") or "1")
+        parser.add_argument("--pool-idle-timeout", dest="pool_idle_timeout",
+                            help="Seconds unused SVN, MVN, FTP and SMTP connection is kept open for",
+                            default=os.getenv("POOL_IDLE_TIMEOUT") or "300")
+        parser.add_argument("--pool-max-age", dest="pool_max_age",
+                            help="Seconds after which SVN, MVN, FTP and SMTP connection is reopened",
+                            default=os.getenv("POOL_MAX_AGE") or "3600")
+        parser.add_argument("--delivery-streaming", dest="delivery_streaming",
+                            help="Pass deliveries from MVN through gpg to FTP without temporary files (y/n)",
+                            default=os.getenv("DELIVERY_STREAMING") or "n")
+        parser.add_argument("--ftp-skip-identical", dest="ftp_skip_identical",
+                            help="Skip delivery on FTP already made of the same clean content with the same keys (y/n)",
+                            default=os.getenv("FTP_SKIP_IDENTICAL") or "n")
+        parser.add_argument("--ftp-upload-retries", dest="ftp_upload_retries",
+                            help="Attempts to continue interrupted FTP upload from where it stopped",
+                            default=os.getenv("FTP_UPLOAD_RETRIES") or "3")
+        parser.add_argument("--ftp-retry-backoff", dest="ftp_retry_backoff",
+                            help="Seconds before the first FTP upload retry, doubled for each next one",
+                            default=os.getenv("FTP_RETRY_BACKOFF") or "5")
+        parser.add_argument("--ftp-probe-after", dest="ftp_probe_after",
+                            help="Seconds of FTP connection idleness after which it is checked with NOOP before use",
+                            default=os.getenv("FTP_PROBE_AFTER") or "30")
+        parser.add_argument("--ftp-max-idle", dest="ftp_max_idle",
+                            help="Seconds of FTP connection idleness after which it is reopened without check",
+                            default=os.getenv("FTP_MAX_IDLE") or "600")
+        parser.add_argument("--ftp-keepalive-interval", dest="ftp_keepalive_interval",
+                            help="Seconds between FTP keep-alives sent while delivery is processed, 0 to disable",
+                            default=os.getenv("FTP_KEEPALIVE_INTERVAL") or "30")
+        parser.add_argument("--ftp-dir-cache-ttl", dest="ftp_dir_cache_ttl",
+                            help="Seconds client's FTP directory existence check result is reused for, 0 disables reuse",
+                            default=os.getenv("FTP_DIR_CACHE_TTL") or "300")
+        parser.add_argument("--mvn-download-connections", dest="mvn_download_connections",
+                            help="Connections large delivery is downloaded from MVN over by parts, 1 to download by single stream",
+                            default=os.getenv("MVN_DOWNLOAD_CONNECTIONS") or "4")
+        parser.add_argument("--mvn-download-part-size", dest="mvn_download_part_size",
+                            help="Minimal size of delivery part downloaded from MVN by separate connection, megabytes",
+                            default=os.getenv("MVN_DOWNLOAD_PART_SIZE") or "16")
+        parser.add_argument("--processed-location-type", dest="processed_location_type",
+                            help="Location type processed deliveries are registered with in checksums database, off if empty",
+                            default=os.getenv("PROCESSED_LOCATION_TYPE") or "")
+        parser.add_argument("--artifact-cache-dir", dest="artifact_cache_dir",
+                            help="Directory clean deliveries downloaded from MVN are kept in between runs, cache is off if empty",
+                            default=os.getenv("ARTIFACT_CACHE_DIR") or "")
+        parser.add_argument("--artifact-cache-size", dest="artifact_cache_size",
+                            help="Megabytes of deliveries kept in artifact cache, least recently used ones are removed",
+                            default=os.getenv("ARTIFACT_CACHE_SIZE") or "10240")
+        parser.add_argument("--scratch-dir", dest="scratch_dir",
+                            help="Directory deliveries are downloaded and processed in, system temporary directory if empty",
+                            default=os.getenv("SCRATCH_DIR") or "")
+        parser.add_argument("--scratch-fast-dir", dest="scratch_fast_dir",
+                            help="Fast directory, e.g. tmpfs, small deliveries are downloaded and processed in, off if empty",
+                            default=os.getenv("SCRATCH_FAST_DIR") or "")
+        parser.add_argument("--scratch-fast-max-size", dest="scratch_fast_max_size",
+                            help="Megabytes of space needed by delivery to be processed in fast directory at most",
+                            default=os.getenv("SCRATCH_FAST_MAX_SIZE") or "64")
+        parser.add_argument("--scratch-min-free", dest="scratch_min_free",
+                            help="Megabytes left free in scratch directories, deliveries not fitting are postponed",
+                            default=os.getenv("SCRATCH_MIN_FREE") or "512")
+        parser.add_argument("--crypto-workers", dest="crypto_workers",
+                            help="Encryption and signing jobs run simultaneously by all uploads",
+                            default=os.getenv("CRYPTO_WORKERS") or "4")
+        parser.add_argument("--crypto-executor", dest="crypto_executor",
+                            help="Run encryption and signing jobs in 'thread' or 'process' workers",
+                            default=os.getenv("CRYPTO_EXECUTOR") or "thread")
+        parser.add_argument("--gpg-compression", dest="gpg_compression",
+                            help="gpg compression: 'auto' to skip it for incompressible content, 'none', 'default' or level 0-9",
+                            default=os.getenv("GPG_COMPRESSION") or "auto")
+        parser.add_argument("--delivery-pipeline", dest="delivery_pipeline",
+                            help="Download next deliveries of a client while previous ones are encrypted and uploaded (y/n)",
+                            default=os.getenv("DELIVERY_PIPELINE") or "n")
+        parser.add_argument("--delivery-workers", dest="delivery_workers",
+                            help="Deliveries of a client processed in parallel",
+                            default=os.getenv("DELIVERY_WORKERS") or "1")
+        parser.add_argument("--ftp-max-connections", dest="ftp_max_connections",
+                            help="Deliveries uploaded to FTP simultaneously, limits '--delivery-workers'",
+                            default=os.getenv("FTP_MAX_CONNECTIONS") or "4")
+        parser.add_argument("--mvn-ext-max-connections", dest="mvn_ext_max_connections",
+                            help="Deliveries uploaded to external MVN simultaneously, limits '--delivery-workers'",
+                            default=os.getenv("MVN_EXT_MAX_CONNECTIONS") or "4")
 
         ### PSQL arguments
         parser.add_argument("--psql-url", dest="psql_url", help="PSQL URL, including schema path",
@@ -332,6 +550,17 @@ class UploadWorkerApplication(UploadWorkerServer):
         return parser
 
 
+def _get_client_code(msg):
+    """
+    :param list msg: message payload: method name, positional arguments and keyword ones
+    :return str: client code given to upload, None if message structure is invalid
+    """
+    if not msg or len(msg) < 2 or not msg[1] or len(msg[1]) < 1:
+        return None
+
+    return msg[1][0]
+
+
 
 if __name__ == '__main__':
     exit(UploadWorkerApplication().main())